@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Append-only store for causal network analysis results.
+
+Every analysed event (mutation, translocation, cytogenetic abnormality)
+appends its rows to one SQLite table instead of writing its own
+<mutation>_causal_results.csv. Parallel workers append concurrently,
+SQLite serializes the writes. Results are read back with column
+predicates that are evaluated by the database, e.g.
+
+    store = CausalStore("causalResults.sqlite")
+    store.query([("Fraction_of_edges_correctly_aligned", ">=", 0.5)], mutation="TP53")
+"""
+import contextlib
+import operator
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+STORE_NAME = "causalResults.sqlite"
+TEXT_COLUMNS = ["Mutation", "Regulator", "Regulon"]
+RESULT_COLUMNS = TEXT_COLUMNS + [
+    "MutationRegulatorEdge",
+    "-log10(p)_MutationRegulatorEdge",
+    "RegulatorRegulon_Spearman_R",
+    "RegulatorRegulon_Spearman_p-value",
+    "Regulon_stratification_t-statistic",
+    "-log10(p)_Regulon_stratification",
+    "Fraction_of_edges_correctly_aligned"
+]
+# column written by older versions of causalNetworkAnalysisTask, it holds -log10(p)
+LEGACY_COLUMNS = {"Regulon_stratification_p-value": "-log10(p)_Regulon_stratification"}
+OPERATORS = {"<": operator.lt, "<=": operator.le, "=": operator.eq, "==": operator.eq,
+             ">=": operator.ge, ">": operator.gt, "!=": operator.ne}
+
+
+def _quote(column):
+    return '"{}"'.format(column.replace('"', '""'))
+
+
+def _checkPredicates(where):
+    for column, op, value in where:
+        if column not in RESULT_COLUMNS:
+            raise ValueError("unknown causal results column '{}'".format(column))
+        if op not in OPERATORS:
+            raise ValueError("unsupported operator '{}'".format(op))
+
+
+def applyPredicates(df, where):
+    """Filters a causal results DataFrame with (column, operator, value) predicates"""
+    where = list(where or [])
+    _checkPredicates(where)
+    columns = df.rename(columns=LEGACY_COLUMNS)
+    mask = np.ones(df.shape[0], dtype=bool)
+    for column, op, value in where:
+        mask &= np.asarray(OPERATORS[op](columns[column].astype(float if column not in TEXT_COLUMNS else str),
+                                         value))
+    return df[mask]
+
+
+class CausalStore(object):
+    """Causal results table in a SQLite file, rows can only be appended"""
+    def __init__(self, path):
+        self.path = path
+        columns = ["Source TEXT"] + ["{} {}".format(_quote(column), "TEXT" if column in TEXT_COLUMNS else "REAL")
+                                    for column in RESULT_COLUMNS]
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS causal_results ({})".format(", ".join(columns)))
+            for column in ["Source"] + TEXT_COLUMNS:
+                connection.execute("CREATE INDEX IF NOT EXISTS causal_results_{0} ON causal_results ({1})".format(
+                    column.lower(), _quote(column)))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # generous timeout, concurrent workers wait for each other's writes
+        connection = sqlite3.connect(self.path, timeout=600)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def append(self, df, source=""):
+        """Appends the rows of a causal results DataFrame in one transaction"""
+        df = df.rename(columns=LEGACY_COLUMNS)
+        rows = [np.repeat(str(source), df.shape[0])]
+        for column in RESULT_COLUMNS:
+            if column in TEXT_COLUMNS:
+                rows.append(np.asarray(df[column]).astype(str))
+            else:
+                rows.append(np.asarray(df[column]).astype(float))
+        sql = "INSERT INTO causal_results (Source, {}) VALUES ({})".format(
+            ", ".join(_quote(column) for column in RESULT_COLUMNS), ", ".join(["?"] * (len(RESULT_COLUMNS) + 1)))
+        with self._connect() as connection:
+            connection.executemany(sql, [tuple(row) for row in zip(*[r.tolist() for r in rows])])
+
+    def query(self, where=None, mutation=None, regulator=None, source=None, columns=None):
+        """Rows matching all predicates, in insertion order and indexed by regulon
+
+        where is a list of (column, operator, value) predicates, mutation,
+        regulator and source select single values or lists of values.
+        """
+        where = list(where or [])
+        _checkPredicates(where)
+        columns = RESULT_COLUMNS if columns is None else list(columns)
+        clauses = []
+        params = []
+        for column, op, value in where:
+            clauses.append("{} {} ?".format(_quote(column), "=" if op == "==" else op))
+            params.append(value)
+        for column, values in (("Mutation", mutation), ("Regulator", regulator), ("Source", source)):
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            values = list(values)
+            clauses.append("{} IN ({})".format(_quote(column), ", ".join(["?"] * len(values))))
+            params.extend(str(value) for value in values)
+
+        sql = "SELECT {} FROM causal_results".format(", ".join(_quote(column) for column in ["Regulon"] + columns))
+        if len(clauses) > 0:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY rowid"
+        with self._connect() as connection:
+            df = pd.read_sql_query(sql, connection, params=params)
+        df.index = np.array(df.iloc[:, 0]).astype(str)
+        return df.iloc[:, 1:]
+
+    def mutations(self, source=None):
+        """Distinct events in the store"""
+        return list(self.query(source=source, columns=["Mutation"])["Mutation"].unique())
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM causal_results").fetchone()[0]
+
+
+def storePath(path):
+    """Path of the store for a store file or a directory that contains one, else None"""
+    if isinstance(path, CausalStore):
+        return path.path
+    if os.path.isfile(path) and not path.endswith(".csv"):
+        return path
+    if os.path.isfile(os.path.join(path, STORE_NAME)):
+        return os.path.join(path, STORE_NAME)
+    return None
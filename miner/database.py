@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Compiled, memory-mapped network dictionaries.
+
+The network dictionaries shipped in miner/data are pickled dicts that map a
+key (a gene, transcription factor, GO term, ...) to a list of names. They are
+compiled once into integer-coded vocabularies and CSR arrays stored as .npy
+files, which are memory-mapped on load. loadDatabase() keeps one instance
+per database and process, forked workers share the loaded instances and
+their pages.
+
+A NetworkDatabase can be used like the original dict of lists, and also
+offers set views per key and a sparse key x value matrix.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+from scipy import sparse
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SEARCH_DIRS = [os.path.join(DATA_DIR, "network_dictionaries"), DATA_DIR]
+FORMAT_VERSION = 1
+
+_DATABASES = {}
+_lock = threading.Lock()
+
+
+def cacheDirectory():
+    """Directory for compiled databases, can be set with MINER_DATABASE_CACHE"""
+    if "MINER_DATABASE_CACHE" in os.environ:
+        return os.environ["MINER_DATABASE_CACHE"]
+    return os.path.join(os.path.expanduser("~"), ".cache", "miner3", "databases")
+
+
+def databasePath(name):
+    """Returns the path of a database given as a path or a name in the package data
+
+    Names can be given with or without the .pkl suffix, e.g. "chea_seq".
+    """
+    if os.path.isfile(name):
+        return os.path.abspath(name)
+    for directory in SEARCH_DIRS:
+        for filename in (name, name + ".pkl", os.path.basename(name)):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                return path
+    raise FileNotFoundError("network dictionary '{}' not found".format(name))
+
+
+def compileDatabase(source, target):
+    """Compiles the pickled dict of lists in source into the directory target"""
+    with open(source, "rb") as f:
+        dict_ = pickle.load(f)
+
+    keys = [str(key) for key in dict_.keys()]
+    values = sorted(set(str(value) for members in dict_.values() for value in members))
+    valueIndex = {value: i for i, value in enumerate(values)}
+
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    indices = []
+    for i, members in enumerate(dict_.values()):
+        indices.extend(valueIndex[str(value)] for value in members)
+        indptr[i + 1] = len(indices)
+
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=".compile-")
+    np.save(os.path.join(tmpdir, "keys.npy"), np.array(keys, dtype=str))
+    np.save(os.path.join(tmpdir, "values.npy"), np.array(values, dtype=str))
+    np.save(os.path.join(tmpdir, "indptr.npy"), indptr)
+    np.save(os.path.join(tmpdir, "indices.npy"), np.array(indices, dtype=np.int32))
+    try:
+        os.rename(tmpdir, target)
+    except OSError:
+        # compiled concurrently by another process
+        for filename in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, filename))
+        os.rmdir(tmpdir)
+    return target
+
+
+def _compiledPath(source):
+    stat = os.stat(source)
+    fingerprint = "{}:{}:{}:{}".format(source, stat.st_size, stat.st_mtime_ns, FORMAT_VERSION)
+    digest = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return "{}-{}".format(name, digest)
+
+
+def _compile(source):
+    compiled = _compiledPath(source)
+    for directory in (cacheDirectory(), os.path.join(tempfile.gettempdir(), "miner3-databases")):
+        target = os.path.join(directory, compiled)
+        if os.path.isdir(target):
+            return target
+        try:
+            os.makedirs(directory, exist_ok=True)
+            return compileDatabase(source, target)
+        except OSError:
+            continue
+    raise OSError("no writable directory to compile network dictionary '{}'".format(source))
+
+
+def _load(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # empty arrays can not be memory-mapped
+        return np.load(path)
+
+
+class NetworkDatabase(Mapping):
+    """Read-only mapping from keys to lists of names backed by CSR arrays"""
+    def __init__(self, directory, source=None):
+        self.source = source
+        self.directory = directory
+        self._keys = _load(os.path.join(directory, "keys.npy"))
+        self._values = _load(os.path.join(directory, "values.npy"))
+        self.indptr = _load(os.path.join(directory, "indptr.npy"))
+        self.indices = _load(os.path.join(directory, "indices.npy"))
+        self._keyIndex = None
+        self._valueIndex = None
+        self._matrix = None
+
+    def __reduce__(self):
+        # workers load the database from their own registry
+        return (loadDatabase, (self.source,))
+
+    @property
+    def keyIndex(self):
+        """dict of key to row number"""
+        if self._keyIndex is None:
+            self._keyIndex = {key: i for i, key in enumerate(self._keys.tolist())}
+        return self._keyIndex
+
+    @property
+    def valueIndex(self):
+        """dict of value name to column number"""
+        if self._valueIndex is None:
+            self._valueIndex = {value: i for i, value in enumerate(self._values.tolist())}
+        return self._valueIndex
+
+    @property
+    def valueNames(self):
+        return self._values
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+    def __contains__(self, key):
+        return key in self.keyIndex
+
+    def __getitem__(self, key):
+        row = self.keyIndex[key]
+        return self._values[self.indices[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def get(self, key, default=None):
+        if key in self.keyIndex:
+            return self[key]
+        return default
+
+    def keys(self):
+        return self._keys.tolist()
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def set(self, key):
+        """Members of key as a frozenset, duplicates are dropped"""
+        return frozenset(self[key])
+
+    def codes(self, key):
+        """Column numbers of the members of key"""
+        row = self.keyIndex[key]
+        return np.asarray(self.indices[self.indptr[row]:self.indptr[row + 1]])
+
+    def sizes(self):
+        """Number of members of every key, in key order"""
+        return np.diff(np.asarray(self.indptr))
+
+    def matrix(self):
+        """Sparse key x value matrix, duplicated members count twice"""
+        if self._matrix is None:
+            data = np.ones(len(self.indices), dtype=np.int32)
+            matrix = sparse.csr_matrix((data, np.array(self.indices), np.array(self.indptr)),
+                                       shape=(len(self._keys), len(self._values)))
+            matrix.sum_duplicates()
+            self._matrix = matrix
+        return self._matrix
+
+    def toDict(self):
+        return {key: self[key] for key in self.keys()}
+
+
+def loadDatabase(name):
+    """Returns the NetworkDatabase for a database name or pickle path
+
+    The pickle is compiled on first use and the result is kept for the
+    lifetime of the process.
+    """
+    source = databasePath(name)
+    with _lock:
+        if source not in _DATABASES:
+            _DATABASES[source] = NetworkDatabase(_compile(source), source=source)
+        return _DATABASES[source]
@@ -6,8 +6,8 @@ Created on Wed Feb 20 13:20:40 2019
 @author: MattWall
 """
 import numpy as np
-from numpy.random import choice
 from scipy import stats
+from scipy import sparse
 from scipy.stats import rankdata
 from scipy.stats import chi2_contingency
 
@@ -15,9 +15,7 @@ import pandas as pd
 
 import sklearn
 from sklearn.decomposition import PCA
-from sklearn.metrics import roc_auc_score
 from sklearn.cluster import KMeans
-from sklearn.linear_model import Ridge
 from sklearn.manifold import TSNE
 from sklearn import metrics
 from sklearn.model_selection import train_test_split
@@ -35,11 +33,20 @@ import seaborn as sns
 import mygene #requires pip install beyond anaconda
 import pickle
 import json
+import hashlib
 import time
 import warnings
 import os
 import logging
 
+from .parallel import TaskData, resolveTaskData, splitTasks, mapTasks
+from .database import loadDatabase
+from .vocabulary import Vocabulary
+from .regulonindex import RegulonIndex
+from .stattests import tTest, chiSquare2x2, groupIndicator, pairedSpearman, pairedPearson, mannWhitneyAuc
+from .causalstore import CausalStore, storePath, applyPredicates
+from .survival import coxRegression, logRankTest
+
 
 # =============================================================================
 # Functions used for reading and writing files
@@ -198,20 +205,31 @@ def readExpressionFromGZipFiles(directory):
     expressionData = pd.concat(sample_dfs,axis=1)
     return expressionData
 
-def readCausalFiles(rootDir):
+def readCausalFiles(rootDir,where=None,**selection):
 
-    sample_dfs = []
-    for dirName, subdirList, fileList in os.walk(rootDir):
-        for fname in fileList:
-            #print('%s\t%s' % (dirName, fname))
-            extension = fname.split(".")[-1]
-            if extension == 'csv':
-                path = os.path.join(dirName,fname)
-                df = pd.read_csv(path, index_col=0,header=0)
-                df.index = np.array(df.index).astype(str)
-                sample_dfs.append(df)
+    # results store (a store file, or a directory containing one): predicates are evaluated by sqlite
+    store_path = storePath(rootDir)
+    if store_path is not None:
+        causalData = CausalStore(store_path).query(where,**selection)
+    else:
+        # one csv per mutation, as written by earlier versions
+        sample_dfs = []
+        for dirName, subdirList, fileList in os.walk(rootDir):
+            for fname in fileList:
+                #print('%s\t%s' % (dirName, fname))
+                extension = fname.split(".")[-1]
+                if extension == 'csv':
+                    path = os.path.join(dirName,fname)
+                    df = pd.read_csv(path, index_col=0,header=0)
+                    df.index = np.array(df.index).astype(str)
+                    sample_dfs.append(df)
+
+        causalData = applyPredicates(pd.concat(sample_dfs,axis=0),where)
+        if "mutation" in selection:
+            causalData = causalData[causalData.Mutation.isin(np.atleast_1d(selection["mutation"]))]
+        if "regulator" in selection:
+            causalData = causalData[causalData.Regulator.isin(np.atleast_1d(selection["regulator"]))]
 
-    causalData = pd.concat(sample_dfs,axis=0)
     renamed = [("-").join(["R",str(name)]) for name in causalData.Regulon]
     causalData.Regulon = renamed
     return causalData
@@ -508,33 +526,45 @@ def FrequencyMatrix(matrix,overExpThreshold = 1):
 def unmix(df,iterations=25,returnAll=False):
     frequencyClusters = []
 
+    # work on positions in the original matrix, the set operations on the
+    # labels are kept so that clusters come out in the same order
+    labels = np.empty(df.shape[0],dtype=object)
+    labels[:] = list(df.index)
+    position = {label:i for i, label in enumerate(labels)}
+    values = np.array(df)
+    current = np.arange(len(labels))
+
     for iteration in range(iterations):
-        sumDf1 = df.sum(axis=1)
-        maxSum = df.index[np.argmax(np.array(sumDf1))]
-        hits = np.where(df.loc[maxSum]>0)[0]
-        hitIndex = list(df.index[hits])
-        block = df.loc[hitIndex,hitIndex]
-        blockSum = block.sum(axis=1)
-        coreBlock = list(blockSum.index[np.where(blockSum>=np.median(blockSum))[0]])
-        remainder = list(set(df.index)-set(coreBlock))
+        subset = values[np.ix_(current,current)]
+        sumDf1 = subset.sum(axis=1)
+        maxSum = np.argmax(sumDf1)
+        hits = np.where(subset[maxSum]>0)[0]
+        blockSum = subset[np.ix_(hits,hits)].sum(axis=1)
+        coreBlock = list(labels[current[hits[np.where(blockSum>=np.median(blockSum))[0]]]])
+        remainder = list(set(labels[current])-set(coreBlock))
         frequencyClusters.append(coreBlock)
         if len(remainder)==0:
             return frequencyClusters
         if len(coreBlock)==1:
             return frequencyClusters
-        df = df.loc[remainder,remainder]
+        current = np.array([position[label] for label in remainder])
     if returnAll is True:
         frequencyClusters.append(remainder)
     return frequencyClusters
 
 def remix(df,frequencyClusters):
     finalClusters = []
+    columns = np.empty(df.shape[1],dtype=object)
+    columns[:] = list(df.columns)
+    rowPosition = {label:i for i, label in enumerate(df.index)}
+    columnPosition = {label:i for i, label in enumerate(columns)}
+    values = np.array(df)
     for cluster in frequencyClusters:
-        sliceDf = df.loc[cluster,:]
-        sumSlice = sliceDf.sum(axis=0)
-        cut = min(0.8,np.percentile(sumSlice.loc[cluster]/float(len(cluster)),90))
+        sumSlice = values[[rowPosition[label] for label in cluster],:].sum(axis=0)
+        clusterSum = sumSlice[[columnPosition[label] for label in cluster]]
+        cut = min(0.8,np.percentile(clusterSum/float(len(cluster)),90))
         minGenes = max(4,cut*len(cluster))
-        keepers = list(sliceDf.columns[np.where(sumSlice>=minGenes)[0]])
+        keepers = list(columns[np.where(sumSlice>=minGenes)[0]])
         keepers = list(set(keepers)|set(cluster))
         finalClusters.append(keepers)
         finalClusters.sort(key = lambda s: -len(s))
@@ -738,12 +768,17 @@ def backgroundDf(expressionData):
 def assignMembership(geneset,background,p=0.05):
 
     cluster = np.array(background.loc[geneset,:])
-    classNeg1 = len(geneset)-np.count_nonzero(cluster+1,axis=0)
-    class0 = len(geneset)-np.count_nonzero(cluster,axis=0)
-    class1 = len(geneset)-np.count_nonzero(cluster-1,axis=0)
+    return membershipClasses(cluster,p)
+
+
+def membershipClasses(cluster,p=0.05):
+    # assignMembership of the background rows of a gene set
+    classNeg1 = len(cluster)-np.count_nonzero(cluster+1,axis=0)
+    class0 = len(cluster)-np.count_nonzero(cluster,axis=0)
+    class1 = len(cluster)-np.count_nonzero(cluster-1,axis=0)
     observations = zipper([classNeg1,class0,class1])
 
-    highpass = stats.binom.ppf(1-p/3.0,len(geneset),1./3)
+    highpass = stats.binom.ppf(1-p/3.0,len(cluster),1./3)
     classes = []
     for i in range(len(observations)):
         check = np.where(np.array(observations[i])>=highpass)[0]
@@ -777,66 +812,102 @@ def filterCoexpressionDict(coexpressionDict,clusterScores,threshold=0.01):
     return filteredDict
 
 
-def biclusterMembershipDictionary(revisedClusters,background,label=2,p=0.05):
+def geneRows(modules,df,genes=None):
+    # sorted rows of df of the genes of every module, modules hold gene codes when genes is given
+    if genes is None:
+        genes = Vocabulary(df.index)
+        moduleCodes = genes.encodeSets(modules,missing="drop")
+    else:
+        moduleCodes = modules
+    positions = genes.positions(df.index)
+    rows = {}
+    for key in moduleCodes:
+        moduleRows = positions[np.asarray(moduleCodes[key],dtype=np.int64)]
+        rows[key] = np.unique(moduleRows[moduleRows>=0])
+    return rows
+
+
+def biclusterMembershipDictionary(revisedClusters,background,label=2,p=0.05,genes=None,samples=None):
     """This is a very suspicious function !!!!"""
-    background_genes = set(background.index)
+    # with gene and sample Vocabularies the clusters hold gene codes and the
+    # members are returned as sample codes
+    clusterRows = geneRows(revisedClusters,background,genes)
+    values = np.array(background)
+    if samples is None:
+        columns = np.array(background.columns)
+    else:
+        columns = samples.encode(background.columns)
     """WW: textual labels are never used !!!! we should remove that because it's just
     confusing"""
     if label == "excluded":
         members = {}
         for key in list(revisedClusters.keys()):
-            tmp_genes = list(set(revisedClusters[key])&background_genes)
-            if len(tmp_genes)>1:
-                assignments = assignMembership(tmp_genes,background,p=p)
+            tmp_rows = clusterRows[key]
+            if len(tmp_rows)>1:
+                assignments = membershipClasses(values[tmp_rows],p=p)
             else:
                 assignments = [np.array([]) for i in range(background.shape[1])]
             nonMembers = np.array([i for i in range(len(assignments)) if len(assignments[i])==0])
             if len(nonMembers) == 0:
-                members[key] = []
+                members[key] = memberList(columns[:0],samples)
                 continue
-            members[key] = list(background.columns[nonMembers])
+            members[key] = memberList(columns[nonMembers],samples)
         return members
 
     if label == "included":
         members = {}
         for key in list(revisedClusters.keys()):
-            tmp_genes = list(set(revisedClusters[key])&background_genes)
-            if len(tmp_genes)>1:
-                assignments = assignMembership(tmp_genes,background,p=p)
+            tmp_rows = clusterRows[key]
+            if len(tmp_rows)>1:
+                assignments = membershipClasses(values[tmp_rows],p=p)
             else:
                 assignments = [np.array([]) for i in range(background.shape[1])]
             included = np.array([i for i in range(len(assignments)) if len(assignments[i])!=0])
             if len(included) == 0:
-                members[key] = []
+                members[key] = memberList(columns[:0],samples)
                 continue
-            members[key] = list(background.columns[included])
+            members[key] = memberList(columns[included],samples)
         return members
 
     members = {}
     for key in list(revisedClusters.keys()):
-        tmp_genes = list(set(revisedClusters[key])&background_genes)
-        if len(tmp_genes)>1:
-            assignments = assignMembership(tmp_genes,background,p=p)
+        tmp_rows = clusterRows[key]
+        if len(tmp_rows)>1:
+            assignments = membershipClasses(values[tmp_rows],p=p)
         else:
-            members[key] = []
+            members[key] = memberList(columns[:0],samples)
             continue
         overExpMembers = np.array([i for i in range(len(assignments)) if label in assignments[i]])
         if len(overExpMembers) ==0:
-            members[key] = []
+            members[key] = memberList(columns[:0],samples)
             continue
-        members[key] = list(background.columns[overExpMembers])
+        members[key] = memberList(columns[overExpMembers],samples)
     return members
 
 
-def membershipToIncidence(membershipDictionary,expressionData):
+def memberList(members,samples=None):
+    # sample names as a list, sample codes as an int32 array
+    if samples is None:
+        return list(members)
+    return members
+
 
-    incidence = np.zeros((len(membershipDictionary),expressionData.shape[1]))
+def membershipToIncidence(membershipDictionary,expressionData,samples=None):
+    # with a sample Vocabulary the members are sample codes, e.g. from biclusterMembershipDictionary
+    if samples is None:
+        samples = Vocabulary(expressionData.columns)
+        memberCodes = samples.encodeSets(membershipDictionary)
+    else:
+        memberCodes = membershipDictionary
+    rows = np.repeat(np.arange(len(memberCodes)),[len(memberCodes[key]) for key in memberCodes])
+    incidence = np.zeros((len(memberCodes),expressionData.shape[1]))
+    if len(rows) > 0:
+        # members that are not samples of expressionData are left out
+        columns = samples.positions(expressionData.columns)[np.concatenate([np.asarray(memberCodes[key],dtype=np.int64) for key in memberCodes])]
+        incidence[rows[columns>=0],columns[columns>=0]] = 1
     incidence = pd.DataFrame(incidence)
     incidence.index = membershipDictionary.keys()
     incidence.columns = expressionData.columns
-    for key in list(membershipDictionary.keys()):
-        samples = membershipDictionary[key]
-        incidence.loc[key,samples] = 1
 
     try:
         orderIndex = np.array(incidence.index).astype(int)
@@ -880,17 +951,23 @@ def reviseInitialClusters(clusterList,expressionData,threshold=0.925):
 # =============================================================================
 
 
-def regulonDictionary(regulons):
+def regulonDictionary(regulons,genes=None):
+    # with a gene Vocabulary the regulons hold gene codes, the modules keep them
+    # as int32 arrays and the genes of the regulon table are decoded to names
     regulonModules = {}
     df_list = []
 
     for tf in list(regulons.keys()):
         for key in list(regulons[tf].keys()):
-            genes = regulons[tf][key]
             id_ = str(len(regulonModules))
-            regulonModules[id_] = regulons[tf][key]
-            for gene in genes:
-                df_list.append([id_,tf,gene])
+            if genes is None:
+                regulonModules[id_] = regulons[tf][key]
+                for gene in regulons[tf][key]:
+                    df_list.append([id_,tf,gene])
+            else:
+                regulonModules[id_] = np.asarray(regulons[tf][key],dtype=np.int32)
+                for gene in genes.decode(regulonModules[id_]):
+                    df_list.append([id_,tf,gene])
 
     array = np.vstack(df_list)
     df = pd.DataFrame(array)
@@ -902,30 +979,21 @@ def regulonIdToRegulator(regulonDf):
 
     idIndexedRegulonDf = regulonDf.copy()
     idIndexedRegulonDf.index = regulonDf["Regulon_ID"]
-    reg_index = idIndexedRegulonDf.index
-    unique_ids = []
-    unique_indices = []
-    for i in range(idIndexedRegulonDf.shape[0]):
-        tmp_ix = reg_index[i]
-        if tmp_ix not in unique_ids:
-            unique_ids.append(tmp_ix)
-            unique_indices.append(i)
+    firstRows = RegulonIndex.fromDataFrame(regulonDf).firstRows
 
     regulonIDtoRegulator = idIndexedRegulonDf.loc[:,"Regulator"]
-    regulonIDtoRegulator = pd.DataFrame(regulonIDtoRegulator.iloc[unique_indices])
+    regulonIDtoRegulator = pd.DataFrame(regulonIDtoRegulator.iloc[firstRows])
 
     return(regulonIDtoRegulator)
 
 
 def regulonDictToDf(expandedRegulons,regulonIDtoRegulator):
-    df_list = []
-    for id_ in list(expandedRegulons.keys()):
-        genes = expandedRegulons[id_]
-        tf = regulonIDtoRegulator.loc[id_,"Regulator"]
-        for gene in genes:
-            df_list.append([id_,tf,gene])
+    ids = list(expandedRegulons.keys())
+    sizes = [len(expandedRegulons[id_]) for id_ in ids]
+    tfs = np.array(regulonIDtoRegulator.loc[ids,"Regulator"])
+    genes = np.concatenate([np.array(expandedRegulons[id_],dtype=object) for id_ in ids])
 
-    array = np.vstack(df_list)
+    array = np.column_stack([np.repeat(ids,sizes),np.repeat(tfs,sizes),genes]).astype(str)
     df = pd.DataFrame(array)
     df.columns = ["Regulon_ID","Regulator","Gene"]
     return df
@@ -933,80 +1001,103 @@ def regulonDictToDf(expandedRegulons,regulonIDtoRegulator):
 
 def regulonExpansion(task):
     start, stop = task[0]
-    eigengenes,regulonModules,regulonDf,expressionData,tfbsdbGenes,overExpressedMembersMatrix,corrThreshold,auc_threshold = task[1]
-    eigenarray = np.array(eigengenes)
-    regulonIDtoRegulator = regulonIdToRegulator(regulonDf)
+    genes,geneExpression,eigenTerms,regulonIds,regulonTfs,geneTfs,overX,corrThreshold,auc_threshold = resolveTaskData(task[1])
+
+    # genes are processed in batches, correlations with all eigengenes and the
+    # aucs of all candidate (gene, regulon) pairs are computed as matrix products
+    batchSize = 256
+    expanded = {}
+    for batchStart in range(start,stop,batchSize):
+        rows = np.arange(batchStart,min(batchStart+batchSize,stop))
+        values = geneExpression[rows,:]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            terms = (values-values.mean(axis=1)[:,np.newaxis])/np.std(values,axis=1,ddof=1)[:,np.newaxis]
+            correlation = np.dot(terms,eigenTerms.T)
+            candidates = (correlation>corrThreshold)&(geneTfs[rows].toarray()[:,regulonTfs]>0)
+
+        hitRegulons = np.where(candidates.any(axis=0))[0]
+        if len(hitRegulons) == 0:
+            continue
+        labels = overX[hitRegulons,:]
+        aucs = mannWhitneyAuc(values,labels)
+        aucs[:,labels.sum(axis=1)==0] = 0
+        with np.errstate(invalid='ignore'):
+            accepted = candidates[:,hitRegulons]&(aucs>=auc_threshold)
 
-    reference_index = np.array(eigengenes.index).astype(str)
-    expanded_modules = {key:regulonModules[key] for key in regulonModules.keys()}
-    ct = -1
-    for gene in list(set(list(tfbsdbGenes.keys()))&set(expressionData.index))[start:stop]:
-        ct+=1
-        if ct%1000 == 0:
-            logging.info("Completed {:d} of {:d} iterations".format(ct,stop-start))
-        pa = pearson_array(eigenarray,np.array(expressionData.loc[gene,:]))
-        tfbs = tfbsdbGenes[gene]
-        hits = np.where(pa>corrThreshold)[0]
-        regulon_hits = reference_index[hits]
-        tf_hits = regulonIDtoRegulator.loc[regulon_hits,"Regulator"]
-        tf_hits_overlap = list(set(tf_hits)&set(tfbs))
-
-        regulon_id_hits = []
-        for i in regulon_hits:
-            if regulonIDtoRegulator.loc[i,"Regulator"] in tf_hits_overlap:
-                regulon_id_hits.append(i)
-
-        tmp_overX = overExpressedMembersMatrix.loc[np.array(regulon_id_hits).astype(str),:]
-
-        gene_array = np.array(expressionData.loc[gene,:])
-        for i in tmp_overX.index:
-            class_labels = np.array(tmp_overX.loc[i,:])
-            sum_ = sum(class_labels)
-            auc = 0
-            if sum_ > 0:
-                auc = roc_auc_score(np.array(tmp_overX.loc[i,:]),gene_array)
-            if auc >= auc_threshold:
-                expanded_modules[i].append(gene)
-
-    return expanded_modules
-
-
-def parallelRegulonExpansion(eigengenes,regulonModules,regulonDf,expressionData,tfbsdbGenes_file,overExpressedMembersMatrix,corrThreshold = 0.25,auc_threshold = 0.70,numCores=5):
-
-    tfbsdbGenes = read_pkl(tfbsdbGenes_file)
-    genes = list(set(list(tfbsdbGenes.keys()))&set(expressionData.index))
-    taskSplit = splitForMultiprocessing(genes,numCores)
-    taskData = (eigengenes, regulonModules, regulonDf, expressionData, tfbsdbGenes, overExpressedMembersMatrix,corrThreshold,auc_threshold)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    output = multiprocess(regulonExpansion,tasks)
-    expandedRegulons = condenseOutput(output)
+        for geneIx, regulonIx in zip(*np.where(accepted)):
+            expanded.setdefault(regulonIds[hitRegulons[regulonIx]],[]).append(genes[rows[geneIx]])
+
+        logging.info("Completed {:d} of {:d} iterations".format(rows[-1]+1-start,stop-start))
+
+    return expanded
+
+
+def parallelRegulonExpansion(eigengenes,regulonModules,regulonDf,expressionData,tfbsdbGenes_file,overExpressedMembersMatrix,corrThreshold = 0.25,auc_threshold = 0.70,numCores=None):
+
+    tfbsdbGenes = loadDatabase(tfbsdbGenes_file)
+    genes = sorted(set(tfbsdbGenes.keys())&set(expressionData.index))
+    geneExpression = np.array(expressionData.loc[genes,:],dtype=float)
+
+    # eigengenes standardized once, so that a product with standardized gene
+    # expression gives the pearson correlations
+    eigenarray = np.array(eigengenes,dtype=float)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        eigenTerms = (eigenarray-eigenarray.mean(axis=1)[:,np.newaxis])/np.std(eigenarray,axis=1,ddof=1)[:,np.newaxis]
+    eigenTerms = eigenTerms/float(eigenarray.shape[1]-1)
+
+    # tfbs membership as a sparse gene x tf matrix, the extra last column is
+    # empty and used for regulators without binding sites
+    regulonIds = np.array(eigengenes.index).astype(str)
+    regulonIDtoRegulator = regulonIdToRegulator(regulonDf)
+    regulators = regulonIDtoRegulator.reindex(regulonIds).iloc[:,0]
+    geneTfs = tfbsdbGenes.matrix()[[tfbsdbGenes.keyIndex[gene] for gene in genes],:]
+    geneTfs = sparse.hstack([geneTfs,sparse.csr_matrix((len(genes),1))]).tocsr()
+    numTfs = len(tfbsdbGenes.valueIndex)
+    regulonTfs = np.array([tfbsdbGenes.valueIndex.get(tf,numTfs) for tf in regulators])
+
+    overX = overExpressedMembersMatrix.copy()
+    overX.index = np.array(overX.index).astype(str)
+    overX = np.nan_to_num(np.array(overX.reindex(regulonIds),dtype=float))
+
+    taskSplit = splitTasks(len(genes),numCores)
+    taskData = (genes,geneExpression,eigenTerms,regulonIds,regulonTfs,geneTfs,overX,corrThreshold,auc_threshold)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        output = multiprocess(regulonExpansion,tasks,numCores)
+
+    expandedRegulons = {key:list(regulonModules[key]) for key in regulonModules.keys()}
+    for expanded in output:
+        for key in expanded.keys():
+            if key in expandedRegulons:
+                expandedRegulons[key].extend(expanded[key])
     expandedRegulons = {key:list(set(expandedRegulons[key])) for key in expandedRegulons.keys()}
     return expandedRegulons
 
-def principalDf(dict_,expressionData,regulons=None,subkey='genes',minNumberGenes=8,random_state=12):
+
+def principalDf(dict_,expressionData,regulons=None,subkey='genes',minNumberGenes=8,random_state=12,genes=None):
+    # with a gene Vocabulary the modules hold gene codes
     pcDfs = []
-    setIndex = set(expressionData.index)
 
     if regulons is not None:
-        dict_, df = regulonDictionary(regulons)
+        dict_, df = regulonDictionary(regulons,genes)
+    if subkey is not None:
+        moduleRows = geneRows({i:dict_[i][subkey] for i in dict_},expressionData,genes)
+    elif subkey is None:
+        moduleRows = geneRows(dict_,expressionData,genes)
+    values = np.array(expressionData)
     for i in list(dict_.keys()):
-        if subkey is not None:
-            genes = list(set(dict_[i][subkey])&setIndex)
-            if len(genes) < minNumberGenes:
-                continue
-        elif subkey is None:
-            genes = list(set(dict_[i])&setIndex)
-            if len(genes) < minNumberGenes:
-                continue
+        moduleValues = values[moduleRows[i]]
+        if len(moduleValues) < minNumberGenes:
+            continue
 
         pca = PCA(1,random_state=random_state)
-        principalComponents = pca.fit_transform(expressionData.loc[genes,:].T)
+        principalComponents = pca.fit_transform(moduleValues.T)
         principalDf = pd.DataFrame(principalComponents)
         principalDf.index = expressionData.columns
         principalDf.columns = [str(i)]
 
         normPC = np.linalg.norm(np.array(principalDf.iloc[:,0]))
-        pearson = stats.pearsonr(principalDf.iloc[:,0],np.median(expressionData.loc[genes,:],axis=0))
+        pearson = stats.pearsonr(principalDf.iloc[:,0],np.median(moduleValues,axis=0))
         signCorrection = pearson[0]/np.abs(pearson[0])
 
         principalDf = signCorrection*principalDf/normPC
@@ -1017,32 +1108,60 @@ def principalDf(dict_,expressionData,regulons=None,subkey='genes',minNumberGenes
     return principalMatrix
 
 
-def axisTfs(axesDf,tfList,expressionData,correlationThreshold=0.3):
-    axesArray = np.array(axesDf.T)
-    if correlationThreshold > 0:
-        tfArray = np.array(expressionData.reindex(tfList))
-    axes = np.array(axesDf.columns)
-    tfDict = {}
+def tfAxisCorrelation(axesDf,tfList,expressionData):
+    # pearson correlation of every tf with every axis as one matrix product
+    tfArray = np.array(expressionData.reindex(list(tfList)),dtype=float)
+    axesArray = np.array(axesDf.T,dtype=float)
+    n = axesArray.shape[1]
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        tfTerms = (tfArray-tfArray.mean(axis=1)[:,np.newaxis])/np.std(tfArray,axis=1,ddof=1)[:,np.newaxis]
+        axisTerms = (axesArray-axesArray.mean(axis=1)[:,np.newaxis])/np.std(axesArray,axis=1,ddof=1)[:,np.newaxis]
+    tfTerms[~np.isfinite(tfTerms)] = np.nan
+    axisTerms[~np.isfinite(axisTerms)] = np.nan
+
+    correlation = np.dot(tfTerms,axisTerms.T)/float(n-1)
+    return pd.DataFrame(correlation,index=list(tfList),columns=axesDf.columns)
+
+
+def axisTfs(axesDf,tfList,expressionData,correlationThreshold=0.3,tfCorrelation=None):
+    # correlationThreshold can be a list of thresholds, the tf maps are then
+    # returned in a dictionary keyed by threshold
+    thresholds = correlationThreshold
+    if type(correlationThreshold) not in (list,tuple,np.ndarray):
+        thresholds = [correlationThreshold]
+
+    if tfCorrelation is None:
+        if max(thresholds) > 0 or min(thresholds) < 0:
+            tfCorrelation = tfAxisCorrelation(axesDf,tfList,expressionData)
+        axes = np.array(axesDf.columns)
+    else:
+        axes = np.array(tfCorrelation.columns)
 
     if type(tfList) is list:
         tfs = np.array(tfList)
     elif type(tfList) is not list:
         tfs = np.array(list(tfList))
 
-    if correlationThreshold == 0:
-        for axis in range(axesArray.shape[0]):
-            tfDict[axes[axis]] = tfs
-
-        return tfDict
+    tfMaps = {}
+    for threshold in thresholds:
+        tfDict = {}
+        if threshold == 0:
+            for axis in range(len(axes)):
+                tfDict[axes[axis]] = tfs
+            tfMaps[threshold] = tfDict
+            continue
 
-    for axis in range(axesArray.shape[0]):
-        tfDict_key = axes[axis]
-        tfCorrelation = pearson_array(tfArray,axesArray[axis,:])
-        # This comparison throws a RuntimeWarning if tfCorrelation contains
-        # nan's. Ignoring them for now.
-        tfDict[tfDict_key] = tfs[np.where(np.abs(tfCorrelation)>=correlationThreshold)[0]]
+        correlation = np.abs(np.array(tfCorrelation.reindex(index=tfs,columns=axes)))
+        with np.errstate(invalid='ignore'):
+            hits = correlation >= threshold
+        for axis in range(len(axes)):
+            tfDict[axes[axis]] = tfs[np.where(hits[:,axis])[0]]
+        tfMaps[threshold] = tfDict
 
-    return tfDict
+    if type(correlationThreshold) not in (list,tuple,np.ndarray):
+        return tfMaps[correlationThreshold]
+    return tfMaps
 
 
 def zipper(ls):
@@ -1055,6 +1174,7 @@ def zipper(ls):
     return zipped
 
 def splitForMultiprocessing(vector,cores):
+    cores = max(min(cores,len(vector)),1)
     partition = int(len(vector)/cores)
     remainder = len(vector) - cores*partition
     starts = np.arange(0,len(vector),partition)[0:cores]
@@ -1068,12 +1188,8 @@ def splitForMultiprocessing(vector,cores):
     zipped = zipper([starts,stops])
     return zipped
 
-def multiprocess(function,tasks):
-    hydra=multiprocessing.pool.Pool(len(tasks))
-    output=hydra.map(function,tasks)
-    hydra.close()
-    hydra.join()
-    return output
+def multiprocess(function,tasks,numCores=None):
+    return mapTasks(function,tasks,numCores)
 
 
 def hyper(population,set1,set2,overlap):
@@ -1100,60 +1216,92 @@ def condenseOutput(output,output_type = dict):
 
 
 def tfbsdbEnrichment(task):
+    # genes are int32 codes of a shared Vocabulary, overlaps are returned as codes
     start, stop = task[0]
-    allGenes,revisedClusters,tfMap,tfToGenes,p = task[1]
-    keys = list(revisedClusters.keys())[start:stop]
-
-    if len(allGenes) == 1:
-        population_size = int(allGenes[0])
-        clusterTfs = {}
-        for key in keys:
-            for tf in tfMap[str(key)]:
-                hits0TfTargets = tfToGenes[tf]
-                hits0clusterGenes = revisedClusters[key]
-                overlapCluster = list(set(hits0TfTargets)&set(hits0clusterGenes))
-                if len(overlapCluster) <= 1:
-                    continue
-                pHyper = hyper(population_size,len(hits0TfTargets),len(hits0clusterGenes),len(overlapCluster))
-                if pHyper < p:
-                    if key not in list(clusterTfs.keys()):
-                        clusterTfs[key] = {}
-                    clusterTfs[key][tf] = [pHyper,overlapCluster]
-    elif len(allGenes) > 1:
-        population_size = len(allGenes)
-        clusterTfs = {}
-        for key in keys:
-            for tf in tfMap[str(key)]:
-                hits0TfTargets = list(set(tfToGenes[tf])&set(allGenes))
-                hits0clusterGenes = revisedClusters[key]
-                overlapCluster = list(set(hits0TfTargets)&set(hits0clusterGenes))
-                if len(overlapCluster) <= 1:
-                    continue
-                pHyper = hyper(population_size,len(hits0TfTargets),len(hits0clusterGenes),len(overlapCluster))
-                if pHyper < p:
-                    if key not in list(clusterTfs.keys()):
-                        clusterTfs[key] = {}
-                    clusterTfs[key][tf] = [pHyper,overlapCluster]
-
+    populationSize,expressed,restrict,clusterCodes,tfMap,tfToGenes,geneCodes,p = resolveTaskData(task[1])
+    keys = list(clusterCodes.keys())[start:stop]
+
+    tfTargets = {}
+    position = np.full(len(expressed),-1,dtype=np.int64)
+    pairs = []
+    overlaps = []
+    sizes = []
+    for key in keys:
+        clusterGenes = clusterCodes[key]
+        position[clusterGenes[::-1]] = np.arange(len(clusterGenes))[::-1]
+        for tf in tfMap[str(key)]:
+            if tf not in tfTargets:
+                targets = geneCodes[tfToGenes.codes(tf)]
+                if restrict:
+                    targets = np.unique(targets[expressed[targets]])
+                tfTargets[tf] = targets
+            targets = tfTargets[tf]
+            hits = position[targets]
+            overlapCluster = clusterGenes[np.unique(hits[hits>=0])]
+            if len(overlapCluster) <= 1:
+                continue
+            pairs.append((key,tf))
+            overlaps.append(overlapCluster)
+            sizes.append((len(targets),len(clusterGenes),len(overlapCluster)))
+        position[clusterGenes] = -1
+
+    clusterTfs = {}
+    if len(pairs) == 0:
+        return clusterTfs
+    sizes = np.array(sizes)
+    pHyper = stats.hypergeom.sf(sizes[:,2]-1,populationSize,sizes[:,0],sizes[:,1])
+    for i, (key,tf) in enumerate(pairs):
+        if pHyper[i] < p:
+            if key not in clusterTfs:
+                clusterTfs[key] = {}
+            clusterTfs[key][tf] = [pHyper[i],overlaps[i]]
     return clusterTfs
 
-def mechanisticInference(axes,revisedClusters,expressionData,correlationThreshold=0.3,numCores=5,p=0.05, database_path=None):
+def mechanisticInference(axes,revisedClusters,expressionData,correlationThreshold=0.3,numCores=None,p=0.05, database_path=None, tfCorrelation=None, genes=None):
+    # correlationThreshold can be a list of thresholds, the tf-axis correlations
+    # are then computed once and the outputs are returned keyed by threshold.
+    # With a gene Vocabulary the clusters hold gene codes and the overlap genes
+    # of the output are int32 codes, database genes are added to the Vocabulary
     logging.info('Running mechanistic inference')
-    tfToGenes = read_pkl(database_path)
+    tfToGenes = loadDatabase(database_path)
 
-    if correlationThreshold <= 0:
-        allGenes = [int(len(expressionData.index))]
-    elif correlationThreshold > 0:
-        allGenes = list(expressionData.index)
+    thresholds = correlationThreshold
+    if type(correlationThreshold) not in (list,tuple,np.ndarray):
+        thresholds = [correlationThreshold]
 
     tfs = sorted(tfToGenes.keys())
-    tfMap = axisTfs(axes,tfs,expressionData,correlationThreshold=correlationThreshold)
-    taskSplit = splitForMultiprocessing(sorted(revisedClusters.keys()),numCores)
-    tasks = [[taskSplit[i],(allGenes,revisedClusters,tfMap,tfToGenes,p)] for i in range(len(taskSplit))]
-    tfbsdbOutput = multiprocess(tfbsdbEnrichment,tasks)
-    mechanisticOutput = condenseOutput(tfbsdbOutput)
+    tfMaps = axisTfs(axes,tfs,expressionData,correlationThreshold=list(thresholds),tfCorrelation=tfCorrelation)
 
-    return mechanisticOutput
+    decode = genes is None
+    if decode:
+        genes = Vocabulary(expressionData.index)
+        clusterCodes = genes.encodeSets(revisedClusters,missing="add")
+    else:
+        clusterCodes = {key: np.asarray(revisedClusters[key],dtype=np.int32) for key in revisedClusters}
+    geneCodes = genes.encode(tfToGenes.valueNames.tolist(),missing="add")
+    expressed = genes.positions(expressionData.index) >= 0
+
+    outputs = {}
+    for threshold in thresholds:
+        # with a positive threshold tf targets are restricted to expressed genes
+        taskData = (len(expressionData.index),expressed,threshold > 0,clusterCodes,tfMaps[threshold],tfToGenes,geneCodes,p)
+
+        taskSplit = splitTasks(len(revisedClusters),numCores)
+        with TaskData(taskData) as sharedData:
+            tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+            tfbsdbOutput = multiprocess(tfbsdbEnrichment,tasks,numCores)
+        outputs[threshold] = condenseOutput(tfbsdbOutput)
+        if decode:
+            outputs[threshold] = decodeMechanisticOutput(outputs[threshold],genes)
+
+    if type(correlationThreshold) not in (list,tuple,np.ndarray):
+        return outputs[correlationThreshold]
+    return outputs
+
+def decodeMechanisticOutput(mechanisticOutput,genes):
+    # overlap gene codes of a mechanisticInference output to names, e.g. to write it as json
+    return {key: {tf: [mechanisticOutput[key][tf][0],genes.decode(mechanisticOutput[key][tf][1])]
+                  for tf in mechanisticOutput[key]} for key in mechanisticOutput}
 
 def coincidenceMatrix(coregulationModules,key,freqThreshold = 0.333):
 
@@ -1161,16 +1309,24 @@ def coincidenceMatrix(coregulationModules,key,freqThreshold = 0.333):
     subRegulons = coregulationModules[tf]
     srGenes = list(set(np.hstack([subRegulons[i] for i in subRegulons.keys()])))
 
-    template = pd.DataFrame(np.zeros((len(srGenes),len(srGenes))))
-    template.index = srGenes
-    template.columns = srGenes
-    for key in list(subRegulons.keys()):
-        genes = subRegulons[key]
-        template.loc[genes,genes]+=1
-    trace = np.array([template.iloc[i,i] for i in range(template.shape[0])]).astype(float)
-    normDf = ((template.T)/trace).T
-    normDf[normDf<freqThreshold]=0
-    normDf[normDf>0]=1
+    # co-membership counts from a sparse subregulon x gene incidence matrix
+    geneIndex = {gene:i for i, gene in enumerate(srGenes)}
+    rows = []
+    cols = []
+    for i, key in enumerate(subRegulons.keys()):
+        members = sorted(set(geneIndex[gene] for gene in subRegulons[key]))
+        rows.extend([i]*len(members))
+        cols.extend(members)
+    incidence = sparse.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(len(subRegulons),len(srGenes)))
+    counts = np.asarray((incidence.T*incidence).todense())
+
+    trace = counts.diagonal().astype(float)
+    normArray = counts/trace[:,np.newaxis]
+    normArray[normArray<freqThreshold]=0
+    normArray[normArray>0]=1
+    normDf = pd.DataFrame(normArray)
+    normDf.index = srGenes
+    normDf.columns = srGenes
     return normDf
 
 
@@ -1185,13 +1341,14 @@ def getCoregulationModules(mechanisticOutput):
     return coregulationModules
 
 
-#Changed > to >= in minNumberGenes
-def getRegulons(coregulationModules, minNumberGenes=5, freqThreshold=0.333):
-    """Returns dictionary: {<tf>: {<regulon_id>: [<genes>]}}
-    """
-    regulons = {}
+def regulonTask(task):
+    start, stop = task[0]
+    coregulationModules,minNumberGenes,freqThreshold = resolveTaskData(task[1])
     keys = sorted(coregulationModules.keys())
-    for i, tf in enumerate(keys):
+
+    regulons = {}
+    for i in range(start,stop):
+        tf = keys[i]
         normDf = coincidenceMatrix(coregulationModules, key=i, freqThreshold=freqThreshold)
         unmixed = unmix(normDf)
         remixed = remix(normDf,unmixed)
@@ -1204,6 +1361,18 @@ def getRegulons(coregulationModules, minNumberGenes=5, freqThreshold=0.333):
     return regulons
 
 
+#Changed > to >= in minNumberGenes
+def getRegulons(coregulationModules, minNumberGenes=5, freqThreshold=0.333, numCores=None):
+    """Returns dictionary: {<tf>: {<regulon_id>: [<genes>]}}
+    """
+    taskSplit = splitTasks(len(coregulationModules),numCores)
+    with TaskData((coregulationModules,minNumberGenes,freqThreshold)) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        output = multiprocess(regulonTask,tasks,numCores)
+    regulons = condenseOutput(output)
+    return regulons
+
+
 def getCoexpressionModules(mechanisticOutput):
     coexpressionModules = {}
     for i in list(mechanisticOutput.keys()):
@@ -1766,41 +1935,27 @@ def cluster_features(dfr,clusterList,minClusterSize_x = 5,minClusterSize_y = 5,
 def intersect(x,y):
     return list(set(x)&set(y))
 
-def setdiff(x,y):
-    return list(set(x)-set(y))
-
-def sample(x,n,replace=True):
-    return choice(x,n,replace=replace)
-
-def train_test(x,y,names=None):
-
-    # identify class labels
-    class_0 = np.where(y==0)[0]
-    class_1 = np.where(y==1)[0]
-
-    # define class lengths
-    n_class_0 = len(class_0)
-    n_class_1 = len(class_1)
-
-    # bootstrap class labels
-    bootstrap_train_0 = list(set(sample(class_0,n_class_0,replace = True)))
-    bootstrap_test_0 = setdiff(class_0,bootstrap_train_0)
-    if len(bootstrap_test_0) == 0:
-        bootstrap_train_0 = list(set(sample(class_0,n_class_0,replace = True)))
-        bootstrap_test_0 = setdiff(class_0,bootstrap_train_0)
+def bootstrapSplit(y,seed=None):
+    # in-bag and out-of-bag columns of a bootstrap sample drawn within each class,
+    # a class whose sample covers all of its columns is drawn once more
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    train_rows = []
+    test_rows = []
+    for label in (0,1):
+        members = np.where(y==label)[0]
+        for attempt in range(2):
+            inbag = np.zeros(len(members),dtype=bool)
+            inbag[rng.randint(0,len(members),len(members))] = True
+            if not inbag.all():
+                break
+        train_rows.append(members[inbag])
+        test_rows.append(members[~inbag])
+    return np.hstack(train_rows), np.hstack(test_rows)
 
-    bootstrap_train_1 = list(set(sample(class_1,n_class_1,replace = True)))
-    bootstrap_test_1 = setdiff(class_1,bootstrap_train_1)
-    if len(bootstrap_test_1) == 0:
-        bootstrap_train_1 = list(set(sample(class_1,n_class_1,replace = True)))
-        bootstrap_test_1 = setdiff(class_1,bootstrap_train_1)
+def train_test(x,y,names=None,seed=None):
 
     # prepare bootstrap training and test sets
-    train_rows = np.hstack([bootstrap_train_0,
-                    bootstrap_train_1])
-
-    test_rows = np.hstack([bootstrap_test_0,
-                   bootstrap_test_1])
+    train_rows, test_rows = bootstrapSplit(y,seed)
 
     x_train = x[:,train_rows]
     x_test = x[:,test_rows]
@@ -1827,7 +1982,7 @@ def train_test(x,y,names=None):
     return split
 
 
-def univariate_comparison(subtypes,srv,expressionData,network_activity_diff,n_iter = 500,hr_prop = 0.30,lr_prop = 0.70, results_directory = None):
+def univariate_comparison(subtypes,srv,expressionData,network_activity_diff,n_iter = 500,hr_prop = 0.30,lr_prop = 0.70, results_directory = None, numCores = None, seed = None):
     # Instantiate results dictionary
     boxplot_data = {name:{"expression":[],"activity":[]} for name in subtypes.keys()}
 
@@ -1864,11 +2019,13 @@ def univariate_comparison(subtypes,srv,expressionData,network_activity_diff,n_it
 
         # Bootstrap analysis using ROC AUC of individual features (gene expression)
         results_expression = univariate_predictor(x_expression,y,names,
-                                            n_iter=n_iter,gene_labels=network_activity_diff.index)
+                                            n_iter=n_iter,gene_labels=network_activity_diff.index,
+                                            numCores=numCores,seed=seed)
 
         # Bootstrap analysis using ROC AUC of individual features (network activity)
         results_activity = univariate_predictor(x_activity,y,names,
-                                            n_iter=n_iter,gene_labels=network_activity_diff.index)
+                                            n_iter=n_iter,gene_labels=network_activity_diff.index,
+                                            numCores=numCores,seed=seed)
 
         # Expression AUCs
         expression_aucs = np.array(results_expression["AUC"]).astype(float)
@@ -2121,7 +2278,44 @@ def optimize_survival_parameters(univariate_comparison_dict,
     return optimized_survival_parameters
 
 
-def optimize_parameters_ridge(x,y,names,srv,n_iter=10,show=True,results_directory=None):
+def ridgePathScores(x_train,y_train,x_test,alphas):
+    # test set predictions of Ridge(alpha,fit_intercept=True) for every alpha from one SVD
+    # of the centered training matrix, without the intercept, which does not change the AUCs
+    center = x_train.mean(axis=0)
+    U, s, Vt = np.linalg.svd(x_train-center,full_matrices=False)
+    keep = s > 1e-15
+    U, s, Vt = U[:,keep], s[keep], Vt[keep,:]
+    projected = np.dot(x_test-center,Vt.T)
+    weights = (np.dot(U.T,y_train-y_train.mean())*s)[:,np.newaxis]/(s[:,np.newaxis]**2+np.asarray(alphas,dtype=float))
+    return np.dot(projected,weights).T
+
+def ridgePathTask(task):
+    start, stop = task[0]
+    x,y,guan_scores,alphas,seeds = resolveTaskData(task[1])
+
+    aucs = []
+    for seed in seeds[start:stop]:
+        train_rows, test_rows = bootstrapSplit(y,seed)
+        scores = ridgePathScores(x[:,train_rows].T,guan_scores[train_rows],x[:,test_rows].T,alphas)
+        aucs.append(mannWhitneyAuc(scores,y[test_rows])[:,0])
+
+    return aucs
+
+def ridgePathAucs(x,y,names,srv,alphas,n_iter,numCores=None,seed=None):
+    # test set AUCs of Ridge regressions of the GuanScore, one row per bootstrap split and one column per alpha
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    seeds = rng.randint(0,2**31-1,n_iter)
+    guan_scores = np.array(srv.loc[names,"GuanScore"],dtype=float)
+
+    taskSplit = splitTasks(n_iter,numCores)
+    taskData = (np.asarray(x,dtype=float),np.asarray(y),guan_scores,np.asarray(alphas,dtype=float),seeds)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        output = multiprocess(ridgePathTask,tasks,numCores)
+
+    return np.vstack([aucs for results in output for aucs in results])
+
+def optimize_parameters_ridge(x,y,names,srv,n_iter=10,show=True,results_directory=None,numCores=None,seed=None):
     """
     Function to test a range of regularization parameters for Ridge regression.
     """
@@ -2130,32 +2324,13 @@ def optimize_parameters_ridge(x,y,names,srv,n_iter=10,show=True,results_director
               np.array(list(range(1,502,10))),
               np.arange(0.001,1.002,0.02)
              ]
-    means = []
-    stds = []
-    for ar in range(len(ranges)):
-        a_range = ranges[ar]
-
-        logging.info("Iteration {:d} of {:d}".format(ar+1,len(ranges)))
-        all_curves = []
-        for iteration in range(n_iter):
-            train_test_dict = train_test(x,y,names)
-            curve_mmrf = []
-            for a in a_range:
-
-                X = train_test_dict["x_train"].T
-                y_gs = np.array(srv.loc[train_test_dict["names_train"],"GuanScore"])
-                clf = Ridge(random_state=0,alpha=a,fit_intercept=True)
-                clf.fit(X, y_gs)
-
-                y_ = train_test_dict["y_test"]
-                decision_function_score = clf.predict(train_test_dict["x_test"].T)
-                curve_mmrf.append(roc_auc_score(y_,decision_function_score))
 
-            all_curves.append(curve_mmrf)
-
-        ac_array = np.vstack(all_curves)
-        means.append(np.mean(ac_array,axis=0))
-        stds.append(np.std(ac_array,axis=0))
+    # every bootstrap split evaluates the alphas of all ranges
+    logging.info("Evaluating {:d} parameters on {:d} bootstrap splits".format(sum(len(a_range) for a_range in ranges),n_iter))
+    ac_array = ridgePathAucs(x,y,names,srv,np.hstack(ranges),n_iter,numCores=numCores,seed=seed)
+    bounds = np.cumsum([0]+[len(a_range) for a_range in ranges])
+    means = [np.mean(ac_array[:,bounds[ar]:bounds[ar+1]],axis=0) for ar in range(len(ranges))]
+    stds = [np.std(ac_array[:,bounds[ar]:bounds[ar+1]],axis=0) for ar in range(len(ranges))]
 
     naive_opt = [max(means[i]) for i in range(len(means))]
     max_arg = np.argsort(naive_opt)[-1]
@@ -2185,23 +2360,12 @@ def optimize_parameters_ridge(x,y,names,srv,n_iter=10,show=True,results_director
     logging.info("Optimized parameter: a = {:.3f}\nMean AUC with optimized parameter: {:.3f}".format(par_opt,max_max))
     return par_opt, max_max, means, stds
 
-def ridge(x,y,names,lambda_min,srv,n_iter = 100,plot_label = "Ridge",results_directory = None):
+def ridge(x,y,names,lambda_min,srv,n_iter = 100,plot_label = "Ridge",results_directory = None,numCores = None,seed = None):
     """
     Return random test set aucs of n_iter bootstraps using Ridge regression.
     """
-    aucs = []
-    for iteration in range(n_iter):
-        if iteration%50 == 0:
-            logging.info("Iteration {:d} of {:d}".format(iteration,n_iter))
-        train_test_dict = train_test(x,y,names)
-        X = train_test_dict["x_train"].T
-        y_gs = np.array(srv.loc[train_test_dict["names_train"],"GuanScore"])
-        clf = Ridge(random_state=0,alpha=lambda_min,fit_intercept=True) #C=15 MMRF, C=0.5 GSE24080UAMS, C=0.3 GSE19784HOVON65, C=2.5 EMTAB4032
-        clf.fit(X, y_gs)
-
-        y_ = train_test_dict["y_test"]
-        decision_function_score = clf.predict(train_test_dict["x_test"].T)
-        aucs.append(roc_auc_score(y_,decision_function_score))
+    #C=15 MMRF, C=0.5 GSE24080UAMS, C=0.3 GSE19784HOVON65, C=2.5 EMTAB4032
+    aucs = list(ridgePathAucs(x,y,names,srv,[lambda_min],n_iter,numCores=numCores,seed=seed)[:,0])
 
     plt.figure(figsize=(4,4))
     plt.boxplot(aucs)
@@ -2215,33 +2379,27 @@ def ridge(x,y,names,lambda_min,srv,n_iter = 100,plot_label = "Ridge",results_dir
 
 def gene_aucs(x,y):
     if len(x.shape) == 1:
-        auc = roc_auc_score(y,x)
+        auc = mannWhitneyAuc(x,y)[0,0]
         return  auc, 0
 
     # t-test sorting
-    t, p = stats.ttest_ind(x[:,np.where(y==1)[0]], x[:,np.where(y==0)[0]],axis=1,equal_var=False)
+    t, p = tTest(x,(y==1),(y==0))
     args = np.argsort(t)
     if len(args) > 100:
         args = args[-100:]
 
     # ROC AUC
-    aucs = []
-    for i in args:
-        aucs.append(roc_auc_score(y,x[i,:]))
+    aucs = mannWhitneyAuc(x[args,:],y)[:,0]
 
     return max(aucs), args[np.argmax(aucs)]
 
-def univariate_predictor(x,y,names,n_iter=200,gene_labels=None):
-    """
-    Return results using single features to predict response.
-    """
-    if gene_labels is None:
-        gene_labels = np.arange(x.shape[0])
+def univariatePredictorTask(task):
+    start, stop = task[0]
+    x,y,seeds = resolveTaskData(task[1])
 
-    auc_tests = []
-    gene_test = []
-    for iteration in range(n_iter):
-        train_test_dict = train_test(x,y,names)
+    results = []
+    for seed in seeds[start:stop]:
+        train_test_dict = train_test(x,y,seed=seed)
 
         x_train = train_test_dict["x_train"]
         x_test = train_test_dict["x_test"]
@@ -2250,9 +2408,30 @@ def univariate_predictor(x,y,names,n_iter=200,gene_labels=None):
 
         auc_train, ix_train = gene_aucs(x_train,y_train)
         auc_test, ix_test = gene_aucs(x_test[ix_train,:],y_test)
+        results.append((auc_test,ix_train))
+
+    return results
+
+def univariate_predictor(x,y,names,n_iter=200,gene_labels=None,numCores=None,seed=None):
+    """
+    Return results using single features to predict response.
+    """
+    if gene_labels is None:
+        gene_labels = np.arange(x.shape[0])
 
-        auc_tests.append(auc_test)
-        gene_test.append(gene_labels[ix_train])
+    # every iteration draws its split from its own seed, results do not depend on the number of cores
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    seeds = rng.randint(0,2**31-1,n_iter)
+
+    taskSplit = splitTasks(n_iter,numCores)
+    taskData = (np.asarray(x,dtype=float),np.asarray(y),seeds)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        output = multiprocess(univariatePredictorTask,tasks,numCores)
+    iterations = [result for results in output for result in results]
+
+    auc_tests = [auc_test for auc_test, ix_train in iterations]
+    gene_test = [gene_labels[ix_train] for auc_test, ix_train in iterations]
 
     results = pd.DataFrame(np.vstack([auc_tests,gene_test]).T)
     results.columns = ["AUC","Gene"]
@@ -2348,7 +2527,8 @@ def getStratifyingRegulons(states_list_1,states_list_2,reference_matrix,p=0.05,p
     matrix1 = reference_matrix.loc[:,np.hstack(states_list_1)]
     matrix2 = reference_matrix.loc[:,np.hstack(states_list_2)]
 
-    ttest = stats.ttest_ind(matrix1,matrix2,axis=1,equal_var=False)
+    groups = np.concatenate([np.ones(matrix1.shape[1]),np.zeros(matrix2.shape[1])])
+    ttest = tTest(np.hstack([matrix1,matrix2]),groups)
 
     if min(ttest[1]) > p:
         logging.info("No hits detected. Cutoff p-value is too strict")
@@ -2453,8 +2633,8 @@ def inferSubtypes(referenceMatrix,primaryMatrix,secondaryMatrix,primaryDictionar
 # Functions used for cluster analysis
 # =============================================================================
 
-def getEigengenes(coexpressionModules,expressionData,regulon_dict=None,saveFolder=None):
-    eigengenes = principalDf(coexpressionModules,expressionData,subkey=None,regulons=regulon_dict,minNumberGenes=1)
+def getEigengenes(coexpressionModules,expressionData,regulon_dict=None,saveFolder=None,genes=None):
+    eigengenes = principalDf(coexpressionModules,expressionData,subkey=None,regulons=regulon_dict,minNumberGenes=1,genes=genes)
     eigengenes = eigengenes.T
     index = np.sort(np.array(eigengenes.index).astype(int))
     eigengenes = eigengenes.loc[index.astype(str),:]
@@ -2463,65 +2643,67 @@ def getEigengenes(coexpressionModules,expressionData,regulon_dict=None,saveFolde
     return eigengenes
 
 
-def parallelEnrichment(task):
-    partition = task[0]
-    test_keys, dict_, reference_dict, reciprocal_dict, population_len, threshold = task[1]
-    test_keys = test_keys[partition[0]:partition[1]]
-
-    results_dict = {}
-    for ix in test_keys:
-        basline_ps = {k:1 for k in reference_dict.keys()}
-        genes_interrogated = dict_[ix]
-        genes_overlapping = list(set(genes_interrogated)&set(reciprocal_dict))
-        count_overlapping = Counter(np.hstack([reciprocal_dict[i] for i in genes_overlapping]))
-        rank_overlapping = count_overlapping.most_common()
-
-        for h in range(len(rank_overlapping)):
-            ct = rank_overlapping[h][1]
-            if ct==1:
-                break
-            key = rank_overlapping[h][0]
-            basline_ps[key] = hyper(population_len,len(reference_dict[key]),len(genes_interrogated),rank_overlapping[h][1]) 
-
-        above_basline_ps = {key:basline_ps[key] for key in list(basline_ps.keys()) if basline_ps[key]<threshold}
-        results_dict[ix] = above_basline_ps
+def enrichmentDatabase(name,resultsDirectory=None):
+    # databases are resolved in the package data, the data directory next to
+    # resultsDirectory is still searched first for compatibility
+    if resultsDirectory is not None:
+        path = os.path.join(resultsDirectory,"..","data","network_dictionaries",name)
+        if os.path.isfile(path):
+            return loadDatabase(path)
+    return loadDatabase(name)
 
-    return results_dict
 
-def enrichmentAnalysis(dict_,reference_dict,reciprocal_dict,genes_with_expression,resultsDirectory,numCores=5,min_overlap = 3,threshold = 0.05):
+def enrichmentAnalysis(dict_,reference_dict,reciprocal_dict,genes_with_expression,resultsDirectory=None,numCores=None,min_overlap = 3,threshold = 0.05):
+    # reference_dict maps terms to genes and reciprocal_dict genes to terms, both
+    # are database names (e.g. "hallmarks", "hallmarks_reciprocal") or pickle paths.
+    # Overlaps of all modules with all terms are computed as one sparse product.
+    # numCores is no longer used and only kept for compatibility.
     t1 = time.time()
     logging.info('initializing enrichment analysis')
 
-    os.chdir(os.path.join(resultsDirectory,"..","data","network_dictionaries"))
-    reference_dict = read_pkl(reference_dict)
-    reciprocal_dict = read_pkl(reciprocal_dict)
-    os.chdir(os.path.join(resultsDirectory,"..","src"))
+    reference_dict = enrichmentDatabase(reference_dict,resultsDirectory)
+    reciprocal_dict = enrichmentDatabase(reciprocal_dict,resultsDirectory)
 
-    genes_in_reference_dict = reciprocal_dict.keys()
-    population_len = len(set(genes_with_expression)&set(genes_in_reference_dict))
+    geneIndex = reciprocal_dict.keyIndex
+    population_len = len(set(genes_with_expression)&set(geneIndex))
 
-    reciprocal_keys = set(reciprocal_dict.keys())
-    test_keys = []
-    for key in list(dict_.keys()):
-        genes_interrogated = dict_[key]
-        genes_overlapping = list(set(genes_interrogated)&reciprocal_keys)
-        if len(genes_overlapping) < min_overlap:
-            continue
-        count_overlapping = Counter(np.hstack([reciprocal_dict[i] for i in genes_overlapping]))
-        rank_overlapping = count_overlapping.most_common()
-        if rank_overlapping[0][1] < min_overlap:
-            continue
-
-        test_keys.append(key)
-
-    try:
-        taskSplit = splitForMultiprocessing(test_keys,numCores)
-        taskData = (test_keys, dict_, reference_dict, reciprocal_dict, population_len,threshold)
-        tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-        enrichmentOutput = multiprocess(parallelEnrichment,tasks)
-        combinedResults = condenseOutput(enrichmentOutput)
-    except:
-        combinedResults = {}
+    # modules x genes incidence, genes are counted once per module
+    modules = list(dict_.keys())
+    rows = []
+    cols = []
+    for i, key in enumerate(modules):
+        members = set(geneIndex[gene] for gene in dict_[key] if gene in geneIndex)
+        rows.extend([i]*len(members))
+        cols.extend(members)
+    incidence = sparse.csr_matrix((np.ones(len(rows),dtype=np.int32),(rows,cols)),shape=(len(modules),len(geneIndex)))
+
+    # overlaps count genes that list a term twice twice, as the term lists do
+    overlap = sparse.csr_matrix(incidence*reciprocal_dict.matrix())
+    numGenes = np.asarray(incidence.sum(axis=1)).ravel()
+    maxOverlap = np.zeros(len(modules))
+    if overlap.nnz > 0:
+        maxOverlap = overlap.max(axis=1).toarray().ravel()
+    tested = np.where((numGenes>=min_overlap)&(maxOverlap>=min_overlap))[0]
+
+    # column position of every term in the reference database
+    termNames = reciprocal_dict.valueNames.tolist()
+    termOrder = np.array([reference_dict.keyIndex.get(term,-1) for term in termNames])
+    termSizes = np.where(termOrder>=0,reference_dict.sizes()[termOrder],0)
+    moduleSizes = np.array([len(dict_[key]) for key in modules])
+
+    overlap = overlap[tested,:].tocoo()
+    hits = (overlap.data>=2)&(termOrder[overlap.col]>=0)
+    moduleIx = overlap.row[hits]
+    termIx = overlap.col[hits]
+    counts = overlap.data[hits]
+    with np.errstate(invalid='ignore'):
+        pvalues = stats.hypergeom.sf(counts-1,population_len,termSizes[termIx],moduleSizes[tested[moduleIx]])
+        significant = pvalues<threshold
+
+    combinedResults = {modules[i]:{} for i in tested}
+    order = np.lexsort((termOrder[termIx],moduleIx))
+    for j in order[significant[order]]:
+        combinedResults[modules[tested[moduleIx[j]]]][termNames[termIx[j]]] = pvalues[j]
 
     t2 = time.time()
     logging.info('completed enrichment analysis in {:.2f} seconds'.format(t2-t1))
@@ -2610,16 +2792,11 @@ def kmAnalysis(survivalDf,durationCol,statusCol,saveFile=None):
     survivalDf = survivalDf.sort_values(by=durationCol)
     ttpfs = np.array(survivalDf.loc[:,durationCol])
     survTime = np.array(survFunc.index)
-    survProb = []
+    survValues = np.array(survFunc.iloc[:,0])
 
-    for i in range(len(ttpfs)):
-        date = ttpfs[i]
-        if date in survTime:
-            survProb.append(survFunc.loc[date,"KM_estimate"])
-        elif date not in survTime:
-            lbix = np.where(np.array(survFunc.index)<date)[0][-1]
-            est = 0.5*(survFunc.iloc[lbix,0]+survFunc.iloc[lbix+1,0])
-            survProb.append(est)
+    # estimate at each duration, half way between the neighbouring estimates for durations off the timeline
+    upper = np.minimum(np.searchsorted(survTime,ttpfs),len(survTime)-1)
+    survProb = np.where(survTime[upper]==ttpfs,survValues[upper],0.5*(survValues[upper-1]+survValues[upper]))
 
     kmEstimate = pd.DataFrame(survProb)
     kmEstimate.columns = ["kmEstimate"]
@@ -2632,54 +2809,86 @@ def kmAnalysis(survivalDf,durationCol,statusCol,saveFile=None):
 
     return pfsDf
 
-def guanRank(kmSurvival,saveFile=None):
-
-    gScore = []
-    for A in range(kmSurvival.shape[0]):
-        aScore = 0
-        aPfs = kmSurvival.iloc[A,0]
-        aStatus = kmSurvival.iloc[A,1]
-        aProbPFS = kmSurvival.iloc[A,2]
-        if aStatus == 1:
-            for B in range(kmSurvival.shape[0]):
-                if B == A:
-                    continue
-                bPfs = kmSurvival.iloc[B,0]
-                bStatus = kmSurvival.iloc[B,1]
-                bProbPFS = kmSurvival.iloc[B,2]
-                if bPfs > aPfs:
-                    aScore+=1
-                if bPfs <= aPfs:
-                    if bStatus == 0:
-                        aScore+=aProbPFS/bProbPFS
-                if bPfs == aPfs:
-                    if bStatus == 1:
-                        aScore+=0.5
-        elif aStatus == 0:
-            for B in range(kmSurvival.shape[0]):
-                if B == A:
-                    continue
-                bPfs = kmSurvival.iloc[B,0]
-                bStatus = kmSurvival.iloc[B,1]
-                bProbPFS = kmSurvival.iloc[B,2]
-                if bPfs >= aPfs:
-                    if bStatus == 0:
-                        tmp = 1-0.5*bProbPFS/aProbPFS
-                        aScore += tmp
-                    elif bStatus == 1:
-                        tmp = 1-bProbPFS/aProbPFS
-                        aScore += tmp
-                if bPfs < aPfs:
-                    if bStatus == 0:
-                        aScore+=0.5*aProbPFS/bProbPFS
-        gScore.append(aScore)
-
-    GuanScore = pd.DataFrame(gScore)
-    GuanScore = GuanScore/float(max(gScore))
-    GuanScore.index = kmSurvival.index
-    GuanScore.columns = ["GuanScore"]
-    survivalData = pd.concat([kmSurvival,GuanScore],axis=1)
-    survivalData.sort_values(by="GuanScore",ascending=False,inplace=True)
+_GUANRANKS = {}
+
+def frameFingerprint(df):
+    # content hash of a DataFrame including its labels
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(df,index=True).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(pd.Series(np.array(df.columns).astype(str)),index=False).values.tobytes())
+    return digest.hexdigest()
+
+def guanScores(durations,status,kmEstimates):
+    # GuanRank score of every patient from counts and sums over the patients sorted by duration,
+    # status 1 is an event and 0 is censored
+    durations = np.asarray(durations,dtype=float)
+    status = np.asarray(status)
+    kmEstimates = np.asarray(kmEstimates,dtype=float)
+    observed = status==1
+    censored = status==0
+
+    allSorted = np.sort(durations)
+    order0 = np.argsort(durations[censored],kind="stable")
+    order1 = np.argsort(durations[observed],kind="stable")
+    d0 = durations[censored][order0]
+    d1 = durations[observed][order1]
+    p0 = kmEstimates[censored][order0]
+    p1 = kmEstimates[observed][order1]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        inverse0 = np.concatenate([[0],np.cumsum(1./p0)])
+    sum0 = np.concatenate([[0],np.cumsum(p0)])
+    sum1 = np.concatenate([[0],np.cumsum(p1)])
+
+    scores = np.zeros(len(durations))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        # events: every later patient, censored patients up to the event weighted by their
+        # survival ratio and half of the ties with other events
+        d, p = durations[observed], kmEstimates[observed]
+        later = len(allSorted)-np.searchsorted(allSorted,d,side="right")
+        censoredBefore = inverse0[np.searchsorted(d0,d,side="right")]
+        ties = np.searchsorted(d1,d,side="right")-np.searchsorted(d1,d,side="left")-1
+        scores[observed] = later+p*censoredBefore+0.5*ties
+
+        # censored: other patients from the same time on and earlier censored patients
+        d, p = durations[censored], kmEstimates[censored]
+        start0 = np.searchsorted(d0,d,side="left")
+        start1 = np.searchsorted(d1,d,side="left")
+        censoredAfter = (len(d0)-start0-1)-0.5*(sum0[-1]-sum0[start0]-p)/p
+        observedAfter = (len(d1)-start1)-(sum1[-1]-sum1[start1])/p
+        censoredBefore = 0.5*p*inverse0[start0]
+        scores[censored] = censoredAfter+observedAfter+censoredBefore
+    return scores
+
+def guanRank(kmSurvival,saveFile=None,cacheFolder=None):
+    # results are cached by the content of kmSurvival, on disk as well if cacheFolder is given
+    key = frameFingerprint(kmSurvival)
+    cacheFile = None
+    if cacheFolder is not None:
+        cacheFile = os.path.join(cacheFolder,("").join(["guanRank_",key,".pkl"]))
+    if key not in _GUANRANKS and cacheFile is not None and os.path.isfile(cacheFile):
+        _GUANRANKS[key] = pd.read_pickle(cacheFile)
+
+    if key in _GUANRANKS:
+        survivalData = _GUANRANKS[key].copy()
+    else:
+        gScore = guanScores(kmSurvival.iloc[:,0],kmSurvival.iloc[:,1],kmSurvival.iloc[:,2])
+
+        GuanScore = pd.DataFrame(gScore)
+        GuanScore = GuanScore/float(max(gScore))
+        GuanScore.index = kmSurvival.index
+        GuanScore.columns = ["GuanScore"]
+        survivalData = pd.concat([kmSurvival,GuanScore],axis=1)
+        # tied patients keep their order
+        survivalData.sort_values(by="GuanScore",ascending=False,inplace=True,kind="mergesort")
+
+        if len(_GUANRANKS) >= 4:
+            _GUANRANKS.pop(next(iter(_GUANRANKS)))
+        _GUANRANKS[key] = survivalData.copy()
+
+    if cacheFile is not None and not os.path.isfile(cacheFile):
+        if not os.path.isdir(cacheFolder):
+            os.makedirs(cacheFolder)
+        survivalData.to_pickle(cacheFile)
 
     if saveFile is not None:
         survivalData.to_csv(saveFile)
@@ -2690,8 +2899,14 @@ def survivalMedianAnalysisDirect(median_df,SurvivalDf):
     k = median_df.columns[0]
     combinedSurvival = pd.concat([SurvivalDf,median_df],axis=1)
 
+    coxResults = {}
+    if median_df.shape[1] == 1 and SurvivalDf.shape[1] == 2:
+        z, p = coxRegression(combinedSurvival.loc[:,[k]].T,combinedSurvival.iloc[:,0],combinedSurvival.iloc[:,1])
+        coxResults[k] = (z[0], p[0])
+        return coxResults
+
+    # further survival columns are covariates of a multivariate model
     try:
-        coxResults = {}
         cph = CoxPHFitter()
         cph.fit(combinedSurvival, duration_col=SurvivalDf.columns[0], event_col=SurvivalDf.columns[1])
         tmpcph = cph.summary
@@ -2707,52 +2922,41 @@ def survivalMedianAnalysisDirect(median_df,SurvivalDf):
 
 def survivalMedianAnalysis(task):
     start, stop = task[0]
-    referenceDictionary,expressionData,SurvivalDf = task[1]
+    referenceDictionary,expressionData,SurvivalDf = resolveTaskData(task[1])
 
     overlapPatients = list(set(expressionData.columns)&set(SurvivalDf.index))
     Survival = SurvivalDf.loc[overlapPatients,SurvivalDf.columns[0:2]]
-    Survival.sort_values(by=Survival.columns[0],inplace=True)
-    sorted_patients = Survival.index
 
-    cox_regulons = []
-    cox_keys = []
     keys = list(referenceDictionary.keys())[start:stop]
-    for i in range(len(keys)):
-        if i % 100 == 0:
-            logging.info("Completed {:d} of {:d} iterations".format(i,len(keys)))
-        key = keys[i]
-        cluster = np.array(expressionData.loc[referenceDictionary[key],sorted_patients])
-        median_ = np.mean(cluster,axis=0)
-        median_df = pd.DataFrame(median_)
-        median_df.index = sorted_patients
-        median_df.columns = [key]
-
-        cox_results_ = survivalMedianAnalysisDirect(median_df,Survival)
-        cox_keys.append(key)
-        cox_regulons.append([cox_results_[key][0],cox_results_[key][1]])
-
-    cox_regulons_output = pd.DataFrame(np.vstack(cox_regulons))
-    cox_regulons_output.index = cox_keys
+    medians = np.vstack([np.mean(np.array(expressionData.loc[referenceDictionary[key],overlapPatients]),axis=0)
+                         for key in keys])
+    z, p = coxRegression(medians,Survival.iloc[:,0],Survival.iloc[:,1])
+
+    cox_regulons_output = pd.DataFrame(np.column_stack([z,p]))
+    cox_regulons_output.index = keys
     cox_regulons_output.columns = ['HR','p-value']
 
     return cox_regulons_output
 
-def parallelMedianSurvivalAnalysis(referenceDictionary,expressionDf,survivalData,numCores=5):
+def parallelMedianSurvivalAnalysis(referenceDictionary,expressionDf,survivalData,numCores=None):
 
-    taskSplit = splitForMultiprocessing(list(referenceDictionary.keys()),numCores)
+    taskSplit = splitTasks(len(referenceDictionary),numCores)
     taskData = (referenceDictionary,expressionDf,survivalData)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    coxOutput = multiprocess(survivalMedianAnalysis,tasks)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        coxOutput = multiprocess(survivalMedianAnalysis,tasks,numCores)
     survivalAnalysis = condenseOutput(coxOutput,output_type="df")
 
     return survivalAnalysis
 
 
+SURVIVAL_TESTS = {"cox":coxRegression,"logrank":logRankTest}
+
 def survivalMembershipAnalysis(task):
 
 
     start, stop = task[0]
-    membershipDf,SurvivalDf = task[1]
+    membershipDf,SurvivalDf,method = resolveTaskData(task[1])
 
     overlapPatients = list(set(membershipDf.columns)&set(SurvivalDf.index))
     if len(overlapPatients) == 0:
@@ -2760,27 +2964,9 @@ def survivalMembershipAnalysis(task):
         return
     Survival = SurvivalDf.loc[overlapPatients,SurvivalDf.columns[0:2]]
 
-    coxResults = {}
     keys = membershipDf.index[start:stop]
-    ct=0
-    for key in keys:
-        ct+=1
-        if ct % 100 == 0:
-            logging.info("completed {:d} iterations on thread".format(ct))
-        try:
-            memberVector = pd.DataFrame(membershipDf.loc[key,overlapPatients])
-            Survival2 = pd.concat([Survival,memberVector],axis=1)
-            Survival2.sort_values(by=Survival2.columns[0],inplace=True)
-
-            cph = CoxPHFitter()
-            cph.fit(Survival2, duration_col=Survival2.columns[0], event_col=Survival2.columns[1])
-            tmpcph = cph.summary
-
-            cox_hr = tmpcph.loc[key,"z"]
-            cox_p = tmpcph.loc[key,"p"]
-            coxResults[key] = (cox_hr, cox_p)
-        except:
-            coxResults[key] = (0, 1)
+    z, p = SURVIVAL_TESTS[method](membershipDf.iloc[start:stop].loc[:,overlapPatients],Survival.iloc[:,0],Survival.iloc[:,1])
+    coxResults = {key:(z[i], p[i]) for i, key in enumerate(keys)}
     return coxResults
 
 
@@ -2789,8 +2975,13 @@ def survivalMembershipAnalysisDirect(membership_df,SurvivalDf):
     survival_patients = list(set(membership_df.index)&set(SurvivalDf.index))
     combinedSurvival = pd.concat([SurvivalDf.loc[survival_patients,SurvivalDf.columns[0:2]],
                                   membership_df.loc[survival_patients,:]],axis=1)
-    combinedSurvival.sort_values(by=combinedSurvival.columns[0],inplace=True)
 
+    if membership_df.shape[1] == 1:
+        z, p = coxRegression(combinedSurvival.loc[:,[k]].T,combinedSurvival.iloc[:,0],combinedSurvival.iloc[:,1])
+        return z[0], p[0]
+
+    # further membership columns are covariates of a multivariate model
+    combinedSurvival.sort_values(by=combinedSurvival.columns[0],inplace=True)
     try:
         cph = CoxPHFitter()
         cph.fit(combinedSurvival, duration_col=combinedSurvival.columns[0], event_col=combinedSurvival.columns[1])
@@ -2803,65 +2994,75 @@ def survivalMembershipAnalysisDirect(membership_df,SurvivalDf):
 
     return cox_hr, cox_p
 
-def parallelMemberSurvivalAnalysis(membershipDf,numCores=5,survivalPath=None,survivalData=None):
+def parallelMemberSurvivalAnalysis(membershipDf,numCores=None,survivalPath=None,survivalData=None,method="cox"):
+    # method "logrank" screens binary memberships with log-rank tests instead of Cox regressions
+    if method not in SURVIVAL_TESTS:
+        raise ValueError("unknown survival test '{}', expected one of {}".format(method,", ".join(SURVIVAL_TESTS)))
     if survivalData is None:
         survivalData = pd.read_csv(survivalPath,index_col=0,header=0)
-    taskSplit = splitForMultiprocessing(membershipDf.index,numCores)
-    taskData = (membershipDf,survivalData)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    coxOutput = multiprocess(survivalMembershipAnalysis,tasks)
+    taskSplit = splitTasks(len(membershipDf.index),numCores)
+    taskData = (membershipDf,survivalData,method)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        coxOutput = multiprocess(survivalMembershipAnalysis,tasks,numCores)
     survivalAnalysis = condenseOutput(coxOutput)
 
     return survivalAnalysis
 
 def survivalAnalysis(task):
     start, stop = task[0]
-    expressionDf,SurvivalDf = task[1]
+    expressionDf,SurvivalDf = resolveTaskData(task[1])
 
     overlapPatients = list(set(expressionDf.columns)&set(SurvivalDf.index))
     Survival = SurvivalDf.loc[overlapPatients,SurvivalDf.columns[0:2]]
 
-    coxResults = {}
     keys = expressionDf.index[start:stop]
-
-    for key in keys:
-        values = np.array(expressionDf.loc[key,overlapPatients])
-        try:
-            medianDf = pd.DataFrame(values)
-            medianDf.index = overlapPatients
-            medianDf.columns = ["value"]
-            Survival2 = pd.concat([Survival,medianDf],axis=1)
-            Survival2.sort_values(by=Survival2.columns[0],inplace=True)
-
-            cph = CoxPHFitter()
-            cph.fit(Survival2, duration_col=Survival2.columns[0], event_col=Survival2.columns[1])
-            tmpcph = cph.summary
-
-            cox_hr = tmpcph.loc["value","z"]
-            cox_p = tmpcph.loc["value","p"]
-            coxResults[key] = (cox_hr, cox_p)
-        except:
-            coxResults[key] = (0, 1)
+    z, p = coxRegression(expressionDf.iloc[start:stop].loc[:,overlapPatients],Survival.iloc[:,0],Survival.iloc[:,1])
+    coxResults = {key:(z[i], p[i]) for i, key in enumerate(keys)}
 
     return coxResults
 
 
-def parallelSurvivalAnalysis(expressionDf,survivalData,numCores=5):
-    taskSplit = splitForMultiprocessing(expressionDf.index,numCores)
+def parallelSurvivalAnalysis(expressionDf,survivalData,numCores=None):
+    taskSplit = splitTasks(len(expressionDf.index),numCores)
     taskData = (expressionDf,survivalData)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    coxOutput = multiprocess(survivalAnalysis,tasks)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        coxOutput = multiprocess(survivalAnalysis,tasks,numCores)
     survivalResults = condenseOutput(coxOutput)
     return survivalResults
 
+def kmCurves(survivalDf,groups,durationCol="duration",statusCol="observed"):
+    # Kaplan-Meier estimates of many groups of patients in one pass, computed as lifelines does:
+    # one row per group and one column per distinct duration in survivalDf
+    durations = np.array(survivalDf.loc[:,durationCol],dtype=float)
+    observed = np.array(survivalDf.loc[:,statusCol]==1,dtype=float)
+    times, timeIndex = np.unique(durations,return_inverse=True)
+    positions = {patient:i for i, patient in enumerate(survivalDf.index)}
+
+    membership = np.zeros((len(groups),len(durations)))
+    for g, group in enumerate(groups):
+        membership[g,[positions[patient] for patient in set(group) if patient in positions]] = 1
+
+    atTime = sparse.csr_matrix((np.ones(len(durations)),(np.arange(len(durations)),timeIndex)),
+                               shape=(len(durations),len(times)))
+    deaths = np.asarray(atTime.T.dot((membership*observed).T).T)
+    # patients at risk are those with durations from the time on
+    atRisk = np.cumsum(np.asarray(atTime.T.dot(membership.T).T)[:,::-1],axis=1)[:,::-1]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        terms = np.where(deaths > 0,np.log(atRisk-deaths)-np.log(atRisk),0)
+    return pd.DataFrame(np.exp(np.cumsum(terms,axis=1)),columns=times)
+
 def kmplot(srv,groups,labels,xlim_=None,filename=None,color=None,lw=1,alpha=1,fs=20,subplots=False):
+    curves = kmCurves(srv,groups)
+    times = np.array(curves.columns)
     for i in range(len(groups)):
         group = groups[i]
         patients = list(set(srv.index)&set(group))
-        kmDf = kmAnalysis(survivalDf=srv.loc[patients,["duration","observed"]],durationCol="duration",statusCol="observed")
-        subset = kmDf[kmDf.loc[:,"observed"]==1]
-        duration = np.concatenate([np.array([0]),np.array(subset.loc[:,"duration"])])
-        kme = np.concatenate([np.array([1]),np.array(subset.loc[:,"kmEstimate"])])
+        subset = srv.loc[patients,:]
+        events = np.sort(np.array(subset.loc[subset.loc[:,"observed"]==1,"duration"],dtype=float))
+        duration = np.concatenate([np.array([0]),events])
+        kme = np.concatenate([np.array([1]),np.array(curves.iloc[i,:])[np.searchsorted(times,events)]])
         if color is not None:
             if subplots is True:
                 ax = plt.gca()
@@ -2933,198 +3134,196 @@ def combinedStates(groups,ranked_groups,survivalDf,minSamples=4,maxStates=7):
 # Functions used for causal inference
 # =============================================================================
 
-def causalNetworkAnalysis(regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,
-                          resultsDirectory,minRegulons=1,
-                          significance_threshold=0.05,
-                          causalFolder="causal_results"):
-    if not os.path.isdir(resultsDirectory):
-        os.mkdir(resultsDirectory)
-    # create results directory
-    causal_path = os.path.join(resultsDirectory,causalFolder)
-    if not os.path.isdir(causal_path):
-        os.mkdir(causal_path)
+def regulonTfCorrelation(regulon_matrix,expression_matrix,reference_matrix,regulonIndex=None):
+    # Spearman correlation of every regulon eigengene with the expression of its
+    # regulator, for all regulons at once from standardized ranks. Regulators
+    # that are not expressed get r = 0 and p = 1.
+    if regulonIndex is None:
+        regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
+    regulons = list(regulonIndex.regulons)
+    tfs = np.array(regulonIndex.regulators.decode(regulonIndex.regulonRegulator),dtype=object)
+    expressed = np.array([tf in expression_matrix.index for tf in tfs],dtype=bool)
+
+    rs = np.zeros(len(regulons))
+    ps = np.ones(len(regulons))
+    if expressed.any():
+        tf_exp = np.asarray(expression_matrix.loc[list(tfs[expressed]),reference_matrix.columns],dtype=float)
+        e_genes = np.asarray(reference_matrix.loc[list(np.array(regulons)[expressed]),:],dtype=float)
+        rs[expressed], ps[expressed] = pairedSpearman(tf_exp,e_genes)
+
+    correlation_df_bcindex = pd.DataFrame({"Regulator":tfs,"Regulon_ID":regulons,"Spearman_R":rs,"Spearman_p":ps})
+    correlation_df_bcindex.index = np.array(regulons).astype(str)
+
+    return correlation_df_bcindex
+
+def readRegulonTfCorrelation(filename):
+    # regulonTfCorrelation table written with to_csv by an earlier run, regulon IDs are read as strings
+    correlation_df_bcindex = pd.read_csv(filename,index_col=0,header=0,dtype={"Regulator":str,"Regulon_ID":str})
+    correlation_df_bcindex.index = np.array(correlation_df_bcindex.index).astype(str)
+    return correlation_df_bcindex
+
+def mutationCausalResults(mutation_name,regulon_ttests,mutant,wildtype,regulonIndex,expression_matrix,reference_matrix,
+                          correlation_df_bcindex,minRegulons=1,significance_threshold=0.05):
+    # causal flows of one event, regulon_ttests holds its regulon t-tests, mutant and wildtype its sample groups
+    result_dfs = []
+    mean_ts = []
+    mean_significance = []
 
-    t1 = time.time()
-    ###
-    regulon_df_bcindex = regulon_matrix.copy()
-    regulon_df_bcindex.index = np.array(regulon_df_bcindex["Regulon_ID"]).astype(str)
-
-    regulon_df_gene_index = regulon_matrix.copy()
-    regulon_df_gene_index.index = regulon_df_gene_index["Gene"]
-
-    tf_name = []
-    bc_name = []
-    rs_1 = []
-    ps_1 = []
-    index_1 = []
-
-    missing_tfs = list(set(regulon_df_bcindex.loc[:,"Regulator"])-set(expression_matrix.index))
-    for key in list(set(regulon_df_bcindex.index)):
-        e_gene = reference_matrix.loc[str(key),:]
-        tf = list(regulon_df_bcindex.loc[key,"Regulator"])[0]
-        if tf not in missing_tfs:
-            tf_exp = expression_matrix.loc[tf,reference_matrix.columns]
-            r, p = stats.spearmanr(tf_exp, e_gene)
-        else:
-            r, p = (0,1)
-        tf_name.append(tf)
-        bc_name.append(key)
-        rs_1.append(r)
-        ps_1.append(p)
-        index_1.append(key)
+    upstream_regulators = set(regulonIndex.regulators)-set(regulonIndex.genes)
+    for regulator_ in [r for r in regulonIndex.regulators if r in regulonIndex.genes]: # analyze all regulators in regulon_matrix
 
-    correlation_df_bcindex = pd.DataFrame(np.vstack([tf_name,bc_name,rs_1,ps_1]).T) # Table
-    correlation_df_bcindex.columns = ["Regulator","Regulon_ID","Spearman_R","Spearman_p"]
-    correlation_df_bcindex.index = np.array(index_1).astype(str)
+        if regulator_ not in upstream_regulators:
+            regulons_ = regulonIndex.regulonsOfGene(regulator_)
 
-    correlation_df_regulator_index = correlation_df_bcindex.copy() # Table
-    correlation_df_regulator_index.index = correlation_df_regulator_index["Regulator"]
+            neglogps = []
+            ts = []
 
-    ###
-    for mut_ix in range(mutation_matrix.shape[0]):
+            for regulon_ in regulons_:
+                t, p = list(regulon_ttests.loc[regulon_,:])
+                tmp_neglogp = -np.log10(p)
+                neglogps.append(tmp_neglogp)
+                ts.append(t)
 
-        mutation_name = mutation_matrix.index[mut_ix]
+            mean_ts = np.mean(ts)
+            mean_significance = np.mean(neglogps)
 
-        phenotype_2 = mutation_matrix.columns[mutation_matrix.loc[mutation_name,:]==1]
-        phenotype_1 = list(set(mutation_matrix.columns)-set(phenotype_2))
-        phenotype_2 = list(set(phenotype_2)&set(reference_matrix.columns))
-        phenotype_1 = list(set(phenotype_1)&set(reference_matrix.columns))
+        else:
+            xt, xp = tTest(expression_matrix.loc[[regulator_],reference_matrix.columns],mutant,wildtype)
+            mean_ts = xt[0]
+            mean_significance = -np.log10(xp[0])
 
-        regulon_ttests = pd.DataFrame(
-            np.vstack(
-                stats.ttest_ind(reference_matrix.loc[:,phenotype_2],reference_matrix.loc[:,phenotype_1],equal_var=False,axis=1)
-            ).T
-        )
+        if mean_significance >= -np.log10(significance_threshold):
+            downstream_regulons = regulonIndex.regulonsOfRegulator(regulator_)
 
-        regulon_ttests.index = reference_matrix.index
-        regulon_ttests.columns = ["Regulon_t-test_t","Regulon_t-test_p"] # Table1: eigengenes ttests
+            if len(downstream_regulons)<minRegulons:
+                continue
 
-        result_dfs = []
-        mean_ts = []
-        mean_significance = []
+            d_neglogps = []
+            d_ts = []
+            for downstream_regulon_ in downstream_regulons:
+                dt, dp = list(regulon_ttests.loc[downstream_regulon_,:])
+                tmp_neglogp = -np.log10(dp)
+                d_neglogps.append(tmp_neglogp)
+                d_ts.append(dt)
 
-        upstream_regulators = list(set(regulon_matrix.Regulator)-set(regulon_df_gene_index.index))
-        for regulator_ in list(set(regulon_matrix.Regulator)&set(regulon_df_gene_index.index)): # analyze all regulators in regulon_matrix
+            d_neglogps = np.array(d_neglogps)
+            d_ts = np.array(d_ts)
 
-            if regulator_ not in upstream_regulators:
-                tmp = regulon_df_gene_index.loc[regulator_,"Regulon_ID"]
-                if type(tmp) is not pd.core.series.Series:
-                    regulons_ = [str(tmp)]
-                elif type(tmp) is pd.core.series.Series:
-                    regulons_ = list(np.array(tmp).astype(str))
+            mask = np.where(d_neglogps >= -np.log10(significance_threshold))[0]
+            if len(mask) == 0:
+                continue
 
-                neglogps = []
-                ts = []
+            significant_regulons = np.array(downstream_regulons)[mask]
+            significant_regulon_ts = d_ts[mask]
+            significant_regulon_ps = d_neglogps[mask]
 
-                for regulon_ in regulons_:
-                    t, p = list(regulon_ttests.loc[regulon_,:])
-                    tmp_neglogp = -np.log10(p)
-                    neglogps.append(tmp_neglogp)
-                    ts.append(t)
+            significant_Rs = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_R"]).astype(float)
+            significant_ps = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_p"]).astype(float)
 
-                mean_ts = np.mean(ts)
-                mean_significance = np.mean(neglogps)
+            assignment_values = mean_ts*significant_Rs*significant_regulon_ts
+            #assignments = assignment_values/np.abs(assignment_values)
+            alignment_mask = np.where(assignment_values>0)[0]
 
-            else:
-                xt, xp = stats.ttest_ind(expression_matrix.loc[regulator_,phenotype_2],expression_matrix.loc[regulator_,phenotype_1],equal_var=False)
-                mean_ts = xt
-                mean_significance = -np.log10(xp)
+            if len(alignment_mask) == 0:
+                continue
 
-            if mean_significance >= -np.log10(significance_threshold):
-                downstream_tmp = correlation_df_regulator_index.loc[regulator_,"Regulon_ID"]
-                if type(downstream_tmp) is not pd.core.series.Series:
-                    downstream_regulons = [str(downstream_tmp)]
-                elif type(downstream_tmp) is pd.core.series.Series:
-                    downstream_regulons = list(np.array(downstream_tmp).astype(str))
+            mutation_list = np.array([mutation_name for i in range(len(alignment_mask))])
+            regulator_list = np.array([regulator_ for i in range(len(alignment_mask))])
+            bicluster_list = significant_regulons[alignment_mask]
+            mutation_regulator_edge_direction = np.array([mean_ts/np.abs(mean_ts) for i in range(len(alignment_mask))])
+            mutation_regulator_edge_ps = np.array([mean_significance for i in range(len(alignment_mask))])
+            regulator_bicluster_rs = significant_Rs[alignment_mask]
+            regulator_bicluster_ps = significant_ps[alignment_mask]
+            bicluster_ts = significant_regulon_ts[alignment_mask]
+            bicluster_ps = significant_regulon_ps[alignment_mask]
+            fraction_aligned = np.array([len(alignment_mask)/float(len(mask)) for i in range(len(alignment_mask))])
+
+
+            results_ = pd.DataFrame(
+                np.vstack(
+                    [
+                        mutation_list,
+                        regulator_list,
+                        bicluster_list,
+                        mutation_regulator_edge_direction,
+                        mutation_regulator_edge_ps,
+                        regulator_bicluster_rs,
+                        regulator_bicluster_ps,
+                        bicluster_ts,
+                        bicluster_ps,
+                        fraction_aligned
+                    ]
+                ).T
+            )
+
+            results_.columns = [
+                "Mutation",
+                "Regulator",
+                "Regulon",
+                "MutationRegulatorEdge",
+                "-log10(p)_MutationRegulatorEdge",
+                "RegulatorRegulon_Spearman_R",
+                "RegulatorRegulon_Spearman_p-value",
+                "Regulon_stratification_t-statistic",
+                "-log10(p)_Regulon_stratification",
+                "Fraction_of_edges_correctly_aligned"
+            ]
+
+            results_.index = bicluster_list
+
+            result_dfs.append(results_)
+
+        elif mean_significance < -np.log10(significance_threshold):
+            continue
 
-                if len(downstream_regulons)<minRegulons:
-                    continue
+    if len(result_dfs) == 0:
+        return None
+    return pd.concat(result_dfs,axis=0)
 
-                d_neglogps = []
-                d_ts = []
-                for downstream_regulon_ in downstream_regulons:
-                    dt, dp = list(regulon_ttests.loc[downstream_regulon_,:])
-                    tmp_neglogp = -np.log10(dp)
-                    d_neglogps.append(tmp_neglogp)
-                    d_ts.append(dt)
+def causalNetworkAnalysis(regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,
+                          resultsDirectory,minRegulons=1,
+                          significance_threshold=0.05,
+                          causalFolder="causal_results",store=None,correlation_df_bcindex=None):
+    # correlation_df_bcindex is the regulonTfCorrelation table, pass it to reuse it across event matrices
+    if not os.path.isdir(resultsDirectory):
+        os.mkdir(resultsDirectory)
+    # create results directory, unless results are appended to a CausalStore (or its path)
+    causal_path = os.path.join(resultsDirectory,causalFolder)
+    if store is None and not os.path.isdir(causal_path):
+        os.mkdir(causal_path)
+    elif store is not None and not isinstance(store,CausalStore):
+        store = CausalStore(store)
 
-                d_neglogps = np.array(d_neglogps)
-                d_ts = np.array(d_ts)
+    t1 = time.time()
+    ###
+    regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
 
-                mask = np.where(d_neglogps >= -np.log10(significance_threshold))[0]
-                if len(mask) == 0:
-                    continue
+    if correlation_df_bcindex is None:
+        correlation_df_bcindex = regulonTfCorrelation(regulon_matrix,expression_matrix,reference_matrix,regulonIndex) # Table
 
-                significant_regulons = np.array(downstream_regulons)[mask]
-                significant_regulon_ts = d_ts[mask]
-                significant_regulon_ps = d_neglogps[mask]
+    ###
+    # Welch t-tests of every regulon for all mutations at once
+    mutant, wildtype = mutationGroups(mutation_matrix,reference_matrix.columns)
+    regulon_t, regulon_p = tTest(reference_matrix,mutant,wildtype)
 
-                significant_Rs = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_R"]).astype(float)
-                significant_ps = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_p"]).astype(float)
+    for mut_ix in range(mutation_matrix.shape[0]):
 
-                assignment_values = mean_ts*significant_Rs*significant_regulon_ts
-                #assignments = assignment_values/np.abs(assignment_values)
-                alignment_mask = np.where(assignment_values>0)[0]
+        mutation_name = mutation_matrix.index[mut_ix]
 
-                if len(alignment_mask) == 0:
-                    continue
+        regulon_ttests = pd.DataFrame(np.vstack([regulon_t[:,mut_ix],regulon_p[:,mut_ix]]).T)
 
-                mutation_list = np.array([mutation_name for i in range(len(alignment_mask))])
-                regulator_list = np.array([regulator_ for i in range(len(alignment_mask))])
-                bicluster_list = significant_regulons[alignment_mask]
-                mutation_regulator_edge_direction = np.array([mean_ts/np.abs(mean_ts) for i in range(len(alignment_mask))])
-                mutation_regulator_edge_ps = np.array([mean_significance for i in range(len(alignment_mask))])
-                regulator_bicluster_rs = significant_Rs[alignment_mask]
-                regulator_bicluster_ps = significant_ps[alignment_mask]
-                bicluster_ts = significant_regulon_ts[alignment_mask]
-                bicluster_ps = significant_regulon_ps[alignment_mask]
-                fraction_aligned = np.array([len(alignment_mask)/float(len(mask)) for i in range(len(alignment_mask))])
-
-
-                results_ = pd.DataFrame(
-                    np.vstack(
-                        [
-                            mutation_list,
-                            regulator_list,
-                            bicluster_list,
-                            mutation_regulator_edge_direction,
-                            mutation_regulator_edge_ps,
-                            regulator_bicluster_rs,
-                            regulator_bicluster_ps,
-                            bicluster_ts,
-                            bicluster_ps,
-                            fraction_aligned
-                        ]
-                    ).T
-                )
-
-                results_.columns = [
-                    "Mutation",
-                    "Regulator",
-                    "Regulon",
-                    "MutationRegulatorEdge",
-                    "-log10(p)_MutationRegulatorEdge",
-                    "RegulatorRegulon_Spearman_R",
-                    "RegulatorRegulon_Spearman_p-value",
-                    "Regulon_stratification_t-statistic",
-                    "-log10(p)_Regulon_stratification",
-                    "Fraction_of_edges_correctly_aligned"
-                ]
-
-                results_.index = bicluster_list
-
-                result_dfs.append(results_)
-
-            elif mean_significance < -np.log10(significance_threshold):
-                continue
+        regulon_ttests.index = reference_matrix.index
+        regulon_ttests.columns = ["Regulon_t-test_t","Regulon_t-test_p"] # Table1: eigengenes ttests
 
-        if len(result_dfs) == 0:
+        causal_output = mutationCausalResults(mutation_name,regulon_ttests,mutant[mut_ix],wildtype[mut_ix],regulonIndex,
+                                              expression_matrix,reference_matrix,correlation_df_bcindex,
+                                              minRegulons,significance_threshold)
+        if causal_output is None:
             continue
-        elif len(result_dfs) == 1:
-            causal_output = result_dfs[0]
-        if len(result_dfs) > 1:
-            causal_output = pd.concat(result_dfs,axis=0)
 
+        if store is not None:
+            store.append(causal_output,source=causalFolder)
+            continue
         output_file = ("").join([mutation_name,"_causal_results",".csv"])
         causal_output.to_csv(os.path.join(causal_path,output_file))
 
@@ -3140,28 +3339,26 @@ def causalNetworkImpact(target_genes,regulon_matrix,expression_matrix,reference_
         os.mkdir(causal_path)
 
     ###
-    regulon_df_bcindex = regulon_matrix.copy()
-    regulon_df_bcindex.index = np.array(regulon_df_bcindex["Regulon_ID"]).astype(str)
-
-    regulon_df_gene_index = regulon_matrix.copy()
-    regulon_df_gene_index.index = regulon_df_gene_index["Gene"]
+    regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
 
     dfs = []
     ###
+    # Welch t-tests of every regulon for all mutations at once
+    mutant, wildtype = mutationGroups(mutation_matrix,reference_matrix.columns)
+    regulon_t, regulon_p = tTest(reference_matrix,mutant,wildtype)
+
+    target_genes = list(set(target_genes)&set(expression_matrix.index))
+    target_genes_in_network = list(set(target_genes)&set(regulonIndex.genes))
+    # target genes outside of the network are tested on their own expression
+    target_genes_off_network = [gene for gene in target_genes if gene not in regulonIndex.genes]
+    expression_t, expression_p = tTest(expression_matrix.loc[target_genes_off_network,reference_matrix.columns],mutant,wildtype)
+    off_network_index = {gene:i for i, gene in enumerate(target_genes_off_network)}
+
     for mut_ix in range(mutation_matrix.shape[0]):
         rows = []
         mutation_name = mutation_matrix.index[mut_ix]
 
-        phenotype_2 = mutation_matrix.columns[mutation_matrix.loc[mutation_name,:]==1]
-        phenotype_1 = list(set(mutation_matrix.columns)-set(phenotype_2))
-        phenotype_2 = list(set(phenotype_2)&set(reference_matrix.columns))
-        phenotype_1 = list(set(phenotype_1)&set(reference_matrix.columns))
-
-        regulon_ttests = pd.DataFrame(
-            np.vstack(
-                stats.ttest_ind(reference_matrix.loc[:,phenotype_2],reference_matrix.loc[:,phenotype_1],equal_var=False,axis=1)
-            ).T
-        )
+        regulon_ttests = pd.DataFrame(np.vstack([regulon_t[:,mut_ix],regulon_p[:,mut_ix]]).T)
 
         regulon_ttests.index = reference_matrix.index
         regulon_ttests.columns = ["Regulon_t-test_t","Regulon_t-test_p"] # Table1: eigengenes ttests
@@ -3169,16 +3366,10 @@ def causalNetworkImpact(target_genes,regulon_matrix,expression_matrix,reference_
         mean_ts = []
         mean_significance = []
 
-        target_genes = list(set(target_genes)&set(expression_matrix.index))
-        target_genes_in_network = list(set(target_genes)&set(regulon_df_gene_index.index))
         for regulator_ in target_genes: # analyze all target_genes in expression_matrix
 
             if regulator_ in target_genes_in_network:
-                tmp = regulon_df_gene_index.loc[regulator_,"Regulon_ID"]
-                if type(tmp) is not pd.core.series.Series:
-                    regulons_ = [str(tmp)]
-                elif type(tmp) is pd.core.series.Series:
-                    regulons_ = list(np.array(tmp).astype(str))
+                regulons_ = regulonIndex.regulonsOfGene(regulator_)
 
                 neglogps = []
                 ts = []
@@ -3194,9 +3385,8 @@ def causalNetworkImpact(target_genes,regulon_matrix,expression_matrix,reference_
                 pp = 10**(-1*mean_significance)
 
             else:
-                xt, xp = stats.ttest_ind(expression_matrix.loc[regulator_,phenotype_2],expression_matrix.loc[regulator_,phenotype_1],equal_var=False)
-                mean_ts = xt
-                mean_significance = -np.log10(xp)
+                mean_ts = expression_t[off_network_index[regulator_],mut_ix]
+                mean_significance = -np.log10(expression_p[off_network_index[regulator_],mut_ix])
                 pp = 10**(-1*mean_significance)
 
             if mean_significance >= -np.log10(significance_threshold):
@@ -3236,251 +3426,118 @@ def viewSelectedCausalResults(causalDf,selected_mutation,minimum_fraction_correc
 
 def causalNetworkAnalysisTask(task):
     start, stop = task[0]
-    regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,minRegulons,significance_threshold,causal_path = task[1]
+    regulon_matrix,expression_matrix,reference_matrix,mutant,wildtype,event_names,event_folders,minRegulons,significance_threshold,resultsDirectory,correlation_df_bcindex,store_path = resolveTaskData(task[1])
     ###
-    regulon_df_bcindex = regulon_matrix.copy()
-    regulon_df_bcindex.index = np.array(regulon_df_bcindex["Regulon_ID"]).astype(str)
-
-    regulon_df_gene_index = regulon_matrix.copy()
-    regulon_df_gene_index.index = regulon_df_gene_index["Gene"]
-
-    tf_name = []
-    bc_name = []
-    rs_1 = []
-    ps_1 = []
-    index_1 = []
-    for key in list(set(regulon_df_bcindex.index)):
-        e_gene = reference_matrix.loc[str(key),:]
-        tf = list(regulon_df_bcindex.loc[key,"Regulator"])[0]
-        tf_exp = expression_matrix.loc[tf,reference_matrix.columns]
-        r, p = stats.spearmanr(tf_exp, e_gene)
-        tf_name.append(tf)
-        bc_name.append(key)
-        rs_1.append(r)
-        ps_1.append(p)
-        index_1.append(key)
-
-    correlation_df_bcindex = pd.DataFrame(np.vstack([tf_name,bc_name,rs_1,ps_1]).T) # Table
-    correlation_df_bcindex.columns = ["Regulator","Regulon_ID","Spearman_R","Spearman_p"]
-    correlation_df_bcindex.index = np.array(index_1).astype(str)
-
-    correlation_df_regulator_index = correlation_df_bcindex.copy() # Table
-    correlation_df_regulator_index.index = correlation_df_regulator_index["Regulator"]
+    regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
 
     ###
-    for mut_ix in range(start,stop):
+    # Welch t-tests of every regulon for the events of this task at once
+    regulon_t, regulon_p = tTest(reference_matrix,mutant[start:stop],wildtype[start:stop])
 
-        mutation_name = mutation_matrix.index[mut_ix]
+    for mut_ix in range(start,stop):
 
-        phenotype_2 = mutation_matrix.columns[mutation_matrix.loc[mutation_name,:]==1]
-        phenotype_1 = list(set(mutation_matrix.columns)-set(phenotype_2))
+        mutation_name = event_names[mut_ix]
 
-        regulon_ttests = pd.DataFrame(
-            np.vstack(
-                stats.ttest_ind(reference_matrix.loc[:,phenotype_2],reference_matrix.loc[:,phenotype_1],equal_var=False,axis=1)
-            ).T
-        )
+        regulon_ttests = pd.DataFrame(np.vstack([regulon_t[:,mut_ix-start],regulon_p[:,mut_ix-start]]).T)
 
         regulon_ttests.index = reference_matrix.index
         regulon_ttests.columns = ["Regulon_t-test_t","Regulon_t-test_p"] # Table1: eigengenes ttests
 
-        result_dfs = []
-        mean_ts = []
-        mean_significance = []
-
-        upstream_regulators = list(set(regulon_matrix.Regulator)-set(regulon_df_gene_index.index))
-        for regulator_ in list(set(regulon_matrix.Regulator)&set(regulon_df_gene_index.index)): # analyze all regulators in regulon_matrix
-
-            if regulator_ not in upstream_regulators:
-                tmp = regulon_df_gene_index.loc[regulator_,"Regulon_ID"]
-                if type(tmp) is not pd.core.series.Series:
-                    regulons_ = [str(tmp)]
-                elif type(tmp) is pd.core.series.Series:
-                    regulons_ = list(np.array(tmp).astype(str))
-
-                neglogps = []
-                ts = []
-
-                for regulon_ in regulons_:
-                    t, p = list(regulon_ttests.loc[regulon_,:])
-                    tmp_neglogp = -np.log10(p)
-                    neglogps.append(tmp_neglogp)
-                    ts.append(t)
-
-                mean_ts = np.mean(ts)
-                mean_significance = np.mean(neglogps)
-
-            else:
-                xt, xp = stats.ttest_ind(expression_matrix.loc[regulator_,phenotype_2],expression_matrix.loc[regulator_,phenotype_1],equal_var=False)
-                mean_ts = xt
-                mean_significance = -np.log10(xp)
-
-            if mean_significance >= -np.log10(significance_threshold):
-                downstream_tmp = correlation_df_regulator_index.loc[regulator_,"Regulon_ID"]
-                if type(downstream_tmp) is not pd.core.series.Series:
-                    downstream_regulons = [str(downstream_tmp)]
-                elif type(downstream_tmp) is pd.core.series.Series:
-                    downstream_regulons = list(np.array(downstream_tmp).astype(str))
-
-                if len(downstream_regulons)<minRegulons:
-                    continue
-
-                d_neglogps = []
-                d_ts = []
-                for downstream_regulon_ in downstream_regulons:
-                    dt, dp = list(regulon_ttests.loc[downstream_regulon_,:])
-                    tmp_neglogp = -np.log10(dp)
-                    d_neglogps.append(tmp_neglogp)
-                    d_ts.append(dt)
-
-                d_neglogps = np.array(d_neglogps)
-                d_ts = np.array(d_ts)
-
-                mask = np.where(d_neglogps >= -np.log10(significance_threshold))[0]
-                if len(mask) == 0:
-                    continue
-
-                significant_regulons = np.array(downstream_regulons)[mask]
-                significant_regulon_ts = d_ts[mask]
-                significant_regulon_ps = d_neglogps[mask]
-
-                significant_Rs = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_R"]).astype(float)
-                significant_ps = np.array(correlation_df_bcindex.loc[significant_regulons,"Spearman_p"]).astype(float)
-
-                assignment_values = mean_ts*significant_Rs*significant_regulon_ts
-                #assignments = assignment_values/np.abs(assignment_values)
-                alignment_mask = np.where(assignment_values>0)[0]
-
-                if len(alignment_mask) == 0:
-                    continue
-
-                mutation_list = np.array([mutation_name for i in range(len(alignment_mask))])
-                regulator_list = np.array([regulator_ for i in range(len(alignment_mask))])
-                bicluster_list = significant_regulons[alignment_mask]
-                mutation_regulator_edge_direction = np.array([mean_ts/np.abs(mean_ts) for i in range(len(alignment_mask))])
-                mutation_regulator_edge_ps = np.array([mean_significance for i in range(len(alignment_mask))])
-                regulator_bicluster_rs = significant_Rs[alignment_mask]
-                regulator_bicluster_ps = significant_ps[alignment_mask]
-                bicluster_ts = significant_regulon_ts[alignment_mask]
-                bicluster_ps = significant_regulon_ps[alignment_mask]
-                fraction_aligned = np.array([len(alignment_mask)/float(len(mask)) for i in range(len(alignment_mask))])
-
-                results_ = pd.DataFrame(
-                    np.vstack(
-                        [
-                            mutation_list,
-                            regulator_list,
-                            bicluster_list,
-                            mutation_regulator_edge_direction,
-                            mutation_regulator_edge_ps,
-                            regulator_bicluster_rs,
-                            regulator_bicluster_ps,
-                            bicluster_ts,
-                            bicluster_ps,
-                            fraction_aligned
-                        ]
-                    ).T
-                )
-
-                results_.columns = [
-                    "Mutation",
-                    "Regulator",
-                    "Regulon",
-                    "MutationRegulatorEdge",
-                    "-log10(p)_MutationRegulatorEdge",
-                    "RegulatorRegulon_Spearman_R",
-                    "RegulatorRegulon_Spearman_p-value",
-                    "Regulon_stratification_t-statistic",
-                    "Regulon_stratification_p-value",
-                    "Fraction_of_edges_correctly_aligned"
-                ]
-
-                results_.index = bicluster_list
-
-                result_dfs.append(results_)
-
-            elif mean_significance < -np.log10(significance_threshold):
-                continue
+        causal_output = mutationCausalResults(mutation_name,regulon_ttests,mutant[mut_ix],wildtype[mut_ix],regulonIndex,
+                                              expression_matrix,reference_matrix,correlation_df_bcindex,
+                                              minRegulons,significance_threshold)
+        if causal_output is None:
+            continue
 
-        causal_output = pd.concat(result_dfs,axis=0)
+        if store_path is not None:
+            # workers append to the shared store, sqlite serializes the writes
+            CausalStore(store_path).append(causal_output,source=event_folders[mut_ix])
+            continue
         output_file = ("").join([mutation_name,"_causal_results",".csv"])
-        causal_output.to_csv(os.path.join(causal_path,output_file))
+        causal_output.to_csv(os.path.join(resultsDirectory,event_folders[mut_ix],output_file))
 
     return
 
-def parallelCausalNetworkAnalysis(regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,causal_path,numCores,minRegulons=1,significance_threshold=0.05):
-
-    # create results directory
-    if not os.path.isdir(causal_path):
-        os.mkdir(causal_path)
+def parallelCausalEventAnalysis(regulon_matrix,expression_matrix,reference_matrix,event_matrices,resultsDirectory,numCores,
+                                minRegulons=1,significance_threshold=0.05,store=None,correlation_df_bcindex=None):
+    # event_matrices maps a results folder (e.g. "causal_results_translocations") to its event matrix,
+    # the events of all matrices are analysed in a single work queue. correlation_df_bcindex is the
+    # regulonTfCorrelation table of the network, e.g. read back with readRegulonTfCorrelation
+    if not os.path.isdir(resultsDirectory):
+        os.mkdir(resultsDirectory)
+    # create results directories, unless results are appended to a CausalStore (or its path)
+    store_path = storePath(store) if isinstance(store,CausalStore) else store
+    if store_path is None:
+        for causalFolder in event_matrices:
+            if not os.path.isdir(os.path.join(resultsDirectory,causalFolder)):
+                os.mkdir(os.path.join(resultsDirectory,causalFolder))
+    else:
+        # creates the table before the workers start appending
+        CausalStore(store_path)
 
     t1 = time.time()
-    taskSplit = splitForMultiprocessing(mutation_matrix.index,numCores)
-    taskData = (regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,minRegulons,significance_threshold,causal_path)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    multiprocess(causalNetworkAnalysisTask,tasks)
+    # the regulator-regulon correlations are computed once for all workers
+    if correlation_df_bcindex is None:
+        correlation_df_bcindex = regulonTfCorrelation(regulon_matrix,expression_matrix,reference_matrix)
+
+    groups = [mutationGroups(mutation_matrix,reference_matrix.columns) for mutation_matrix in event_matrices.values()]
+    mutant = np.vstack([group[0] for group in groups])
+    wildtype = np.vstack([group[1] for group in groups])
+    event_names = np.concatenate([np.array(mutation_matrix.index).astype(str) for mutation_matrix in event_matrices.values()])
+    event_folders = np.concatenate([np.repeat(causalFolder,mutation_matrix.shape[0])
+                                    for causalFolder, mutation_matrix in event_matrices.items()])
+    logging.info('causal network analysis of {:d} events'.format(len(event_names)))
+
+    taskSplit = splitTasks(len(event_names),numCores)
+    taskData = (regulon_matrix,expression_matrix,reference_matrix,mutant,wildtype,event_names,event_folders,
+                minRegulons,significance_threshold,resultsDirectory,correlation_df_bcindex,store_path)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        multiprocess(causalNetworkAnalysisTask,tasks,numCores)
 
     t2 = time.time()
     logging.info('completed causal analysis in {:.2f} minutes'.format((t2-t1)/60.))
 
+def parallelCausalNetworkAnalysis(regulon_matrix,expression_matrix,reference_matrix,mutation_matrix,causal_path,numCores,minRegulons=1,significance_threshold=0.05,store=None,correlation_df_bcindex=None):
+    causal_path = os.path.normpath(causal_path)
+    parallelCausalEventAnalysis(regulon_matrix,expression_matrix,reference_matrix,
+                                {os.path.basename(causal_path):mutation_matrix},os.path.dirname(causal_path) or ".",numCores,
+                                minRegulons=minRegulons,significance_threshold=significance_threshold,store=store,
+                                correlation_df_bcindex=correlation_df_bcindex)
+
+
+def wiringDiagram(causal_results,regulonModules,coherent_samples_matrix,include_genes=False,savefile=None,where=None,genes=None):
+    # causal_results is a DataFrame or a CausalStore, where holds (column, operator, value) predicates,
+    # regulonModules hold gene codes when a gene Vocabulary is given
+    if isinstance(causal_results,CausalStore):
+        causal_results = causal_results.query(where)
+    elif where is not None:
+        causal_results = applyPredicates(causal_results,where)
+    # one edge per row of causal_results, genes and samples are condensed once per regulon
+    regulons = list(causal_results.index)
+    edge1 = np.where(np.array(causal_results.iloc[:,3]).astype(float)>0,"up-regulates","down-regulates")
+    edge2 = np.where(np.array(causal_results.iloc[:,5]).astype(float)>0,"activates","represses")
+    cytoscape_output = [np.array(causal_results.iloc[:,0]),edge1,np.array(causal_results.iloc[:,1]),edge2,regulons]
 
-def wiringDiagram(causal_results,regulonModules,coherent_samples_matrix,include_genes=False,savefile=None):
-    cytoscape_output = []
-    for regulon in list(set(causal_results.index)):
-
-        genes = regulonModules[regulon]
-        samples = coherent_samples_matrix.columns[coherent_samples_matrix.loc[int(regulon),:]==1]
-        condensed_genes = (";").join(genes)
-        condensed_samples = (";").join(samples)
-        causal_info = causal_results.loc[regulon,:]
-        if type(causal_info) is pd.core.frame.DataFrame:
-            for i in range(causal_info.shape[0]):
-                mutation = causal_info.iloc[i,0]
-                reg = causal_info.iloc[i,1]
-                tmp_edge1 = causal_info.iloc[i,3]
-                if tmp_edge1 >0:
-                    edge1 = "up-regulates"
-                elif tmp_edge1 <0:
-                    edge1 = "down-regulates"
-                tmp_edge2 = causal_info.iloc[i,5]
-                if tmp_edge2 >0:
-                    edge2 = "activates"
-                elif tmp_edge2 <0:
-                    edge2 = "represses"
-
-                if include_genes is True:
-                    cytoscape_output.append([mutation,edge1,reg,edge2,regulon,condensed_genes,condensed_samples])
-                elif include_genes is False:
-                    cytoscape_output.append([mutation,edge1,reg,edge2,regulon])
-
-        elif type(causal_info) is pd.core.series.Series:
-            for i in range(causal_info.shape[0]):
-                mutation = causal_info[0]
-                reg = causal_info[1]
-                tmp_edge1 = causal_info[3]
-                if tmp_edge1 >0:
-                    edge1 = "up-regulates"
-                elif tmp_edge1 <0:
-                    edge1 = "down-regulates"
-                tmp_edge2 = causal_info[5]
-                if tmp_edge2 >0:
-                    edge2 = "activates"
-                elif tmp_edge2 <0:
-                    edge2 = "represses"
-
-                if include_genes is True:
-                    cytoscape_output.append([mutation,edge1,reg,edge2,regulon,condensed_genes,condensed_samples])
-                elif include_genes is False:
-                    cytoscape_output.append([mutation,edge1,reg,edge2,regulon])
-
-    cytoscapeDf = pd.DataFrame(np.vstack(cytoscape_output))
+    if include_genes is True:
+        condensed_genes = {}
+        condensed_samples = {}
+        for regulon in set(regulons):
+            regulonGenes = regulonModules[regulon] if genes is None else genes.decode(regulonModules[regulon])
+            condensed_genes[regulon] = (";").join(regulonGenes)
+            samples = coherent_samples_matrix.columns[coherent_samples_matrix.loc[int(regulon),:]==1]
+            condensed_samples[regulon] = (";").join(samples)
+        cytoscape_output.append([condensed_genes[regulon] for regulon in regulons])
+        cytoscape_output.append([condensed_samples[regulon] for regulon in regulons])
+
+    cytoscapeDf = pd.DataFrame(np.column_stack(cytoscape_output).astype(str))
 
     if include_genes is True:
         cytoscapeDf.columns = ["mutation","mutation-regulator_edge","regulator","regulator-regulon_edge","regulon","genes","samples"]
     elif include_genes is False:
         cytoscapeDf.columns = ["mutation","mutation-regulator_edge","regulator","regulator-regulon_edge","regulon"]
 
-    sort_by_regulon = np.argsort(np.array(cytoscapeDf["regulon"]).astype(int))
+    sort_by_regulon = np.argsort(np.array(cytoscapeDf["regulon"]).astype(int),kind="stable")
     cytoscapeDf = cytoscapeDf.iloc[sort_by_regulon,:]
     cytoscapeDf.index = cytoscapeDf["regulon"]
     rename = [("-").join(["R",name]) for name in cytoscapeDf.index]
@@ -3541,7 +3598,7 @@ def biclusterTfIncidence(mechanisticOutput,regulons=None):
 
 def tfExpression(expressionData,motifPath=os.path.join("..","data","all_tfs_to_motifs.pkl")):
 
-    allTfsToMotifs = read_pkl(motifPath)
+    allTfsToMotifs = loadDatabase(motifPath)
     tfs = list(set(allTfsToMotifs.keys())&set(expressionData.index))
     tfExp = expressionData.loc[tfs,:]
     return tfExp
@@ -3570,32 +3627,43 @@ def mutationMatrix(mutationFiles, minNumMutations=None):
 def getMutations(mutationString,mutationMatrix):
     return mutationMatrix.columns[np.where(mutationMatrix.loc[mutationString,:]>0)[0]]
 
-def mutationRegulatorStratification(mutationDf,tfDf,threshold=0.05,dictionary_=False):
-    incidence = pd.DataFrame(np.zeros((tfDf.shape[0],mutationDf.shape[0])))
-    incidence.index = tfDf.index
-    incidence.columns = mutationDf.index
-
-    stratification = {}
-    tfCols = set(tfDf.columns)
-    mutCols = set(mutationDf.columns)
-    for mutation in mutationDf.index:
-        mut = getMutations(mutation,mutationDf)
-        wt = list(mutCols-set(mut))
-        mut = list(set(mut)&tfCols)
-        wt = list(set(wt)&tfCols)
-        tmpMut = tfDf.loc[:,mut]
-        tmpWt = tfDf.loc[:,wt]
-        ttest = stats.ttest_ind(tmpMut,tmpWt,axis=1,equal_var=False)
-        significant = np.where(ttest[1]<=threshold)[0]
-        hits = list(tfDf.index[significant])
-        if len(hits) > 0:
-            incidence.loc[hits,mutation] = 1
-            if dictionary_ is not False:
-                stratification[mutation] = {}
-                for i in range(len(hits)):
-                    stratification[mutation][hits[i]] = [ttest[0][significant[i]],ttest[1][significant[i]]]
+def mutationGroups(mutation_matrix,columns):
+    # mutant (==1) and wild-type indicators of every mutation over columns, samples missing
+    # from the mutation matrix belong to neither group, NaN entries of its samples are wild-type
+    aligned = mutation_matrix.reindex(columns=columns)
+    mutant = np.asarray(aligned==1,dtype=float)
+    wildtype = np.asarray(aligned.columns.isin(mutation_matrix.columns)&(aligned!=1),dtype=float)
+    return mutant, wildtype
+
+def mutationRegulatorStratificationTask(task):
+    start, stop = task[0]
+    tfValues,mutant,wildtype = resolveTaskData(task[1])
+    return tTest(tfValues,mutant[start:stop],wildtype[start:stop])
+
+def mutationRegulatorStratification(mutationDf,tfDf,threshold=0.05,dictionary_=False,numCores=None):
+    # mutant (>0) and wild-type samples of every mutation over the columns of tfDf,
+    # wild-type samples are all other samples of the mutation matrix
+    mutant = np.asarray(mutationDf.reindex(columns=tfDf.columns)>0,dtype=float)
+    wildtype = np.asarray(tfDf.columns.isin(mutationDf.columns),dtype=float)*(1-mutant)
+
+    # Welch t-tests of every regulator against blocks of mutations
+    taskSplit = splitTasks(mutationDf.shape[0],numCores)
+    taskData = (np.asarray(tfDf,dtype=float),mutant,wildtype)
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        output = multiprocess(mutationRegulatorStratificationTask,tasks,numCores)
+    t = np.hstack([np.zeros((tfDf.shape[0],0))]+[block[0] for block in output])
+    p = np.hstack([np.zeros((tfDf.shape[0],0))]+[block[1] for block in output])
+
+    with np.errstate(invalid="ignore"):
+        significant = p<=threshold
+    incidence = pd.DataFrame(significant,index=tfDf.index,columns=mutationDf.index)
 
     if dictionary_ is not False:
+        # (t, p) of the significant regulators of every mutation
+        stratification = {}
+        for j, i in zip(*np.nonzero(significant.T)):
+            stratification.setdefault(mutationDf.index[j],{})[tfDf.index[i]] = [t[i,j],p[i,j]]
         return incidence, stratification
     return incidence
 
@@ -3628,7 +3696,8 @@ def generateCausalInputs(expressionData,
                          saveFolder,
                          dataFolder,
                          mutationFile="filteredMutationsIA12.csv",
-                         regulon_dict=None):
+                         regulon_dict=None,
+                         numCores=None):
     #bcTfIncidence
     bcTfIncidence = biclusterTfIncidence(mechanisticOutput,regulons=regulon_dict)
     bcTfIncidence.to_csv(os.path.join(saveFolder,"bcTfIncidence.csv"))
@@ -3652,14 +3721,27 @@ def generateCausalInputs(expressionData,
 
     #regStratAll
     tfStratMutations = mutationRegulatorStratification(filteredMutations, tfDf=tfExp,
-                                                       threshold=0.01)
-    keepers = list(set(np.arange(tfStratMutations.shape[1])) -
-                   set(np.where(np.sum(tfStratMutations, axis=0) == 0)[0]))
-    tfStratMutations = tfStratMutations.iloc[:,keepers]
-    tfStratMutations.to_csv(os.path.join(saveFolder,"regStratAll.csv"))
-
-
-def processCausalResults(causalPath=os.path.join("..","results","causal"),causalDictionary=False):
+                                                       threshold=0.01, numCores=numCores)
+    # mutations that stratify at least one regulator, written as 0/1 for NEO
+    tfStratMutations = tfStratMutations.loc[:,tfStratMutations.any(axis=0)]
+    tfStratMutations.astype(float).to_csv(os.path.join(saveFolder,"regStratAll.csv"))
+
+
+def readNeoResults(csv):
+    # (Bicluster, Regulator, Mutation, Score) rows of a NEO output file, up to the first score < 1
+    tmpcsv = pd.read_csv(csv,index_col=False,header=None,dtype=str).iloc[1:,:]
+    score = np.array(tmpcsv.iloc[:,-2]).astype(float)
+    below = np.where(score < 1)[0]
+    if len(below) > 0:
+        tmpcsv = tmpcsv.iloc[:below[0],:]
+        score = score[:below[0]]
+    return pd.DataFrame({
+        "Bicluster":tmpcsv.iloc[:,-3].str.rsplit(":",n=1).str[-1].str.rsplit("_",n=1).str[-1].astype(int).values,
+        "Regulator":tmpcsv.iloc[:,-5].str.rsplit(":",n=1).str[-1].values,
+        "Mutation":tmpcsv.iloc[:,1].str.rsplit(":",n=1).str[-1].values,
+        "Score":score})
+
+def processCausalResults(causalPath=os.path.join("..","results","causal"),causalDictionary=False,flat=False):
     causalFiles = []
     for root, dirs, files in os.walk(causalPath, topdown=True):
        for name in files:
@@ -3667,108 +3749,136 @@ def processCausalResults(causalPath=os.path.join("..","results","causal"),causal
               continue
           causalFiles.append(os.path.join(root, name))
 
+    tables = [readNeoResults(csv) for csv in causalFiles]
+    if len(tables) == 0:
+        tables = [pd.DataFrame({"Bicluster":np.array([],dtype=int),"Regulator":[],"Mutation":[],"Score":[]})]
+    causalTable = pd.concat(tables,axis=0,ignore_index=True)
+    # flat=True returns one row per (bicluster, regulator, mutation) with its first score
+    causalTable = causalTable.drop_duplicates(subset=["Bicluster","Regulator","Mutation"]).reset_index(drop=True)
+    if flat is True:
+        return causalTable
+
     if causalDictionary is False:
         causalDictionary = {}
-    for csv in causalFiles:
-        tmpcsv = pd.read_csv(csv,index_col=False,header=None)
-        for i in range(1,tmpcsv.shape[0]):
-            score = float(tmpcsv.iloc[i,-2])
-            if score <1:
-                break
-            bicluster = int(tmpcsv.iloc[i,-3].split(":")[-1].split("_")[-1])
-            if bicluster not in list(causalDictionary.keys()):
-                causalDictionary[bicluster] = {}
-            regulator = tmpcsv.iloc[i,-5].split(":")[-1]
-            if regulator not in list(causalDictionary[bicluster].keys()):
-                causalDictionary[bicluster][regulator] = []
-            mutation = tmpcsv.iloc[i,1].split(":")[-1]
-            if mutation not in causalDictionary[bicluster][regulator]:
-                causalDictionary[bicluster][regulator].append(mutation)
+    # groups come in order of first appearance, as the biclusters, regulators and mutations in the files
+    for (bicluster, regulator), mutations in causalTable.groupby(["Bicluster","Regulator"],sort=False)["Mutation"]:
+        regulatorMutations = causalDictionary.setdefault(int(bicluster),{}).setdefault(regulator,[])
+        regulatorMutations.extend(mutation for mutation in mutations if mutation not in regulatorMutations)
     return causalDictionary
 
 
+def causalResultStatistics(preProcessedCausalResults,filteredMutations,tfExp,eigengenes):
+    # regulator x mutation and bicluster x mutation t-tests of every pair in the causal results,
+    # expression values <= -4.01 are treated as not expressed and left out of the tests
+    tfs = list(dict.fromkeys(tf for bc in preProcessedCausalResults for tf in preProcessedCausalResults[bc]))
+    bcs = list(preProcessedCausalResults.keys())
+    mutations = list(dict.fromkeys(mutation for bc in preProcessedCausalResults
+                                   for tf in preProcessedCausalResults[bc]
+                                   for mutation in preProcessedCausalResults[bc][tf]))
+    patients = filteredMutations.columns
+
+    mutant = (np.array(filteredMutations.loc[mutations,:]) > 0).astype(float)
+    tfValues = np.array(tfExp.loc[tfs,patients],dtype=float)
+    tfValues[~(tfValues > -4.01)] = np.nan
+    bcValues = np.array(eigengenes.loc[bcs,patients],dtype=float)
+    bcValues[~(bcValues > -4.01)] = np.nan
+
+    tfTests = np.stack(tTest(tfValues,mutant,1-mutant,nan_policy="omit")+(np.dot(~np.isnan(tfValues),mutant.T),))
+    bcTests = np.stack(tTest(bcValues,mutant,1-mutant,nan_policy="omit")+(np.dot(~np.isnan(bcValues),mutant.T),))
+    frequency = mutant.sum(axis=1)/float(filteredMutations.shape[1])
+    positions = ({tf:i for i, tf in enumerate(tfs)},{bc:i for i, bc in enumerate(bcs)},
+                 {mutation:i for i, mutation in enumerate(mutations)},frequency)
+    return tfValues,bcValues,mutant,tfTests,bcTests,positions
+
 def analyzeCausalResults(task):
 
     start, stop = task[0]
-    preProcessedCausalResults,mechanisticOutput,filteredMutations,tfExp,eigengenes = task[1]
+    preProcessedCausalResults,mechanisticOutput,tfValues,bcValues,mutant,tfTests,bcTests,positions = resolveTaskData(task[1])
+    tfPositions, bcPositions, mutationPositions, frequency = positions
     postProcessed = {}
     if mechanisticOutput is not None:
         mechOutKeyType = type(list(mechanisticOutput.keys())[0])
-    allPatients = set(filteredMutations.columns)
     keys = list(preProcessedCausalResults.keys())[start:stop]
+
+    # look up the pair statistics of every (bicluster, regulator, mutation) triple
+    triples = [(bc,tf,mutation) for bc in keys for tf in preProcessedCausalResults[bc]
+               for mutation in preProcessedCausalResults[bc][tf]]
+    bc_ix = np.array([bcPositions[triple[0]] for triple in triples],dtype=int)
+    tf_ix = np.array([tfPositions[triple[1]] for triple in triples],dtype=int)
+    mut_ix = np.array([mutationPositions[triple[2]] for triple in triples],dtype=int)
+    mutTfCounts = tfTests[2,tf_ix,mut_ix]
+    mutBcCounts = bcTests[2,bc_ix,mut_ix]
+
+    # regulator-bicluster correlations in the mutant patients that express both
+    correlated = (mutBcCounts > 1)&(mutTfCounts > 2)
+    mutCorrRs = np.zeros(len(triples))
+    mutCorrPs = np.ones(len(triples))
+    rows = np.where(correlated)[0]
+    for chunk in range(0,len(rows),1024):
+        chunkRows = rows[chunk:chunk+1024]
+        mutTfValues = np.where(mutant[mut_ix[chunkRows]] > 0,tfValues[tf_ix[chunkRows]],np.nan)
+        mutCorrRs[chunkRows], mutCorrPs[chunkRows] = pairedPearson(mutTfValues,bcValues[bc_ix[chunkRows]])
+
     ct=-1
     for bc in keys:
         ct+=1
         if ct%10 == 0:
             logging.info(ct)
         postProcessed[bc] = {}
-        for tf in list(preProcessedCausalResults[bc].keys()):
-            for mutation in preProcessedCausalResults[bc][tf]:
-                mut = getMutations(mutation,filteredMutations)
-                wt = list(allPatients-set(mut))
-                mutTfs = tfExp.loc[tf,mut][tfExp.loc[tf,mut]>-4.01]
-                if len(mutTfs) <=1:
-                    mutRegT = 0
-                    mutRegP = 1
-                elif len(mutTfs) >1:
-                    wtTfs = tfExp.loc[tf,wt][tfExp.loc[tf,wt]>-4.01]
-                    mutRegT, mutRegP = stats.ttest_ind(list(mutTfs),list(wtTfs),equal_var=False)
-                mutBc = eigengenes.loc[bc,mut][eigengenes.loc[bc,mut]>-4.01]
-                if len(mutBc) <=1:
-                    mutBcT = 0
-                    mutBcP = 1
-                    mutCorrR = 0
-                    mutCorrP = 1
-                elif len(mutBc) >1:
-                    wtBc = eigengenes.loc[bc,wt][eigengenes.loc[bc,wt]>-4.01]
-                    mutBcT, mutBcP = stats.ttest_ind(list(mutBc),list(wtBc),equal_var=False)
-                    if len(mutTfs) <=2:
-                        mutCorrR = 0
-                        mutCorrP = 1
-                    elif len(mutTfs) >2:
-                        nonzeroPatients = list(set(np.array(mut)[tfExp.loc[tf,mut]>-4.01])&set(np.array(mut)[eigengenes.loc[bc,mut]>-4.01]))
-                        mutCorrR, mutCorrP = stats.pearsonr(list(tfExp.loc[tf,nonzeroPatients]),list(eigengenes.loc[bc,nonzeroPatients]))
-                signMutTf = 1
-                if mutRegT < 0:
-                    signMutTf = -1
-                elif mutRegT == 0:
-                    signMutTf = 0
-                signTfBc = 1
-                if mutCorrR < 0:
-                    signTfBc = -1
-                elif mutCorrR == 0:
-                    signTfBc = 0
-                if mechanisticOutput is not None:
-                    if mechOutKeyType is int:
-                        phyper = mechanisticOutput[bc][tf][0]
-                    elif mechOutKeyType is not int:
-                        phyper = mechanisticOutput[str(bc)][tf][0]
-                elif mechanisticOutput is None:
-                    phyper = 1e-10
-                pMutRegBc = 10**-((-np.log10(mutRegP)-np.log10(mutBcP)-np.log10(mutCorrP)-np.log10(phyper))/4.)
-                pWeightedTfBc = 10**-((-np.log10(mutCorrP)-np.log10(phyper))/2.)
-                mutFrequency = len(mut)/float(filteredMutations.shape[1])
-                postProcessed[bc][tf] = {}
-                postProcessed[bc][tf]["regBcWeightedPValue"] = pWeightedTfBc
-                postProcessed[bc][tf]["edgeRegBc"] = signTfBc
-                postProcessed[bc][tf]["regBcHyperPValue"] = phyper
-                if "mutations" not in list(postProcessed[bc][tf].keys()):
-                    postProcessed[bc][tf]["mutations"] = {}
-                postProcessed[bc][tf]["mutations"][mutation] = {}
-                postProcessed[bc][tf]["mutations"][mutation]["mutationFrequency"] = mutFrequency
-                postProcessed[bc][tf]["mutations"][mutation]["mutRegBcWeightedPValue"] = pMutRegBc
-                postProcessed[bc][tf]["mutations"][mutation]["edgeMutReg"] = signMutTf
-                postProcessed[bc][tf]["mutations"][mutation]["mutRegPValue"] = mutRegP
-                postProcessed[bc][tf]["mutations"][mutation]["mutBcPValue"] = mutBcP
-                postProcessed[bc][tf]["mutations"][mutation]["regBcCorrPValue"] = mutCorrP
-                postProcessed[bc][tf]["mutations"][mutation]["regBcCorrR"] = mutCorrR
+    for i, (bc, tf, mutation) in enumerate(triples):
+        mutRegT, mutRegP = 0, 1
+        if mutTfCounts[i] > 1:
+            mutRegT, mutRegP = tfTests[0,tf_ix[i],mut_ix[i]], tfTests[1,tf_ix[i],mut_ix[i]]
+        mutBcP = 1
+        mutCorrR, mutCorrP = 0, 1
+        if mutBcCounts[i] > 1:
+            mutBcP = bcTests[1,bc_ix[i],mut_ix[i]]
+            if correlated[i]:
+                mutCorrR, mutCorrP = mutCorrRs[i], mutCorrPs[i]
+        signMutTf = 1
+        if mutRegT < 0:
+            signMutTf = -1
+        elif mutRegT == 0:
+            signMutTf = 0
+        signTfBc = 1
+        if mutCorrR < 0:
+            signTfBc = -1
+        elif mutCorrR == 0:
+            signTfBc = 0
+        if mechanisticOutput is not None:
+            if mechOutKeyType is int:
+                phyper = mechanisticOutput[bc][tf][0]
+            elif mechOutKeyType is not int:
+                phyper = mechanisticOutput[str(bc)][tf][0]
+        elif mechanisticOutput is None:
+            phyper = 1e-10
+        pMutRegBc = 10**-((-np.log10(mutRegP)-np.log10(mutBcP)-np.log10(mutCorrP)-np.log10(phyper))/4.)
+        pWeightedTfBc = 10**-((-np.log10(mutCorrP)-np.log10(phyper))/2.)
+        mutFrequency = frequency[mut_ix[i]]
+        postProcessed[bc][tf] = {}
+        postProcessed[bc][tf]["regBcWeightedPValue"] = pWeightedTfBc
+        postProcessed[bc][tf]["edgeRegBc"] = signTfBc
+        postProcessed[bc][tf]["regBcHyperPValue"] = phyper
+        if "mutations" not in list(postProcessed[bc][tf].keys()):
+            postProcessed[bc][tf]["mutations"] = {}
+        postProcessed[bc][tf]["mutations"][mutation] = {}
+        postProcessed[bc][tf]["mutations"][mutation]["mutationFrequency"] = mutFrequency
+        postProcessed[bc][tf]["mutations"][mutation]["mutRegBcWeightedPValue"] = pMutRegBc
+        postProcessed[bc][tf]["mutations"][mutation]["edgeMutReg"] = signMutTf
+        postProcessed[bc][tf]["mutations"][mutation]["mutRegPValue"] = mutRegP
+        postProcessed[bc][tf]["mutations"][mutation]["mutBcPValue"] = mutBcP
+        postProcessed[bc][tf]["mutations"][mutation]["regBcCorrPValue"] = mutCorrP
+        postProcessed[bc][tf]["mutations"][mutation]["regBcCorrR"] = mutCorrR
     return postProcessed
 
-def postProcessCausalResults(preProcessedCausalResults,filteredMutations,tfExp,eigengenes,mechanisticOutput=None,numCores=5):
-    taskSplit = splitForMultiprocessing(preProcessedCausalResults.keys(),numCores)
-    taskData = (preProcessedCausalResults,mechanisticOutput,filteredMutations,tfExp,eigengenes)
-    tasks = [[taskSplit[i],taskData] for i in range(len(taskSplit))]
-    Output = multiprocess(analyzeCausalResults,tasks)
+def postProcessCausalResults(preProcessedCausalResults,filteredMutations,tfExp,eigengenes,mechanisticOutput=None,numCores=None):
+    # the pair statistics are computed once, tasks assemble the triples of their biclusters
+    statistics = causalResultStatistics(preProcessedCausalResults,filteredMutations,tfExp,eigengenes)
+    taskSplit = splitTasks(len(preProcessedCausalResults),numCores)
+    taskData = (preProcessedCausalResults,mechanisticOutput)+statistics
+    with TaskData(taskData) as sharedData:
+        tasks = [[taskSplit[i],sharedData] for i in range(len(taskSplit))]
+        Output = multiprocess(analyzeCausalResults,tasks,numCores)
     postProcessedAnalysis = condenseOutput(Output)
 
     return postProcessedAnalysis
@@ -4569,72 +4679,56 @@ def differentialActivity(regulon_matrix,reference_matrix,baseline_patients,relap
 
     reference_matrix.index = np.array(reference_matrix.index).astype(str)
 
-    genes = []
-    mean_baseline_frequency = []
-    mean_relapse_frequency = []
-    mean_significance = []
-    skipped = []
-
     t1 = time.time()
-    for gene in list(set(regulon_matrix["Gene"])):
-        regulons_ = np.array(regulon_matrix[regulon_matrix.Gene==gene]["Regulon_ID"]).astype(str)
-        if len(regulons_)<minRegulons:
-            skipped.append(gene)
-            continue
-
-        baseline_freq = []
-        relapse_freq = []
-        neglogps = []
-
-        for regulon_ in regulons_:
-
-            baseline_values = reference_matrix.loc[regulon_,baseline_patients]
-            relapse_values = reference_matrix.loc[regulon_,relapse_patients]
-
-            indicator = len(set(reference_matrix.iloc[0,:]))
-
-            if indicator > 2:
-                t, p = stats.ttest_ind(relapse_values,baseline_values)
-            elif indicator ==2:
-                # chi square
-                rpos = np.sum(relapse_values)
-                if np.sum(rpos) == 0:
-                    continue
-                rneg = len(relapse_values)-rpos
-
-                bpos = np.sum(baseline_values)
-                if np.sum(bpos) == 0:
-                    continue
-                bneg = len(baseline_values)-bpos
-
-                obs = np.array([[rpos,rneg],[bpos,bneg]])
-                chi2, p, dof, ex = stats.chi2_contingency(obs, correction=False)
-
-            if useAllRegulons is True:
-                neglogps.append(-np.log10(p))
-                baseline_freq.append(np.mean(baseline_values))
-                relapse_freq.append(np.mean(relapse_values))
-
-            elif useAllRegulons is False:
-                if len(neglogps)<=maxRegulons:
-                    neglogps.append(-np.log10(p))
-                    baseline_freq.append(np.mean(baseline_values))
-                    relapse_freq.append(np.mean(relapse_values))
-
-                if len(neglogps)>maxRegulons:
-                    tmp_nlp = -np.log10(p)
-                    if min(neglogps) < tmp_nlp:
-                        argmin = np.argmin(neglogps)
-                        neglogps[argmin] = tmp_nlp
-                        tmp_baseline = np.mean(baseline_values)
-                        baseline_freq[argmin] = tmp_baseline
-                        tmp_relapse = np.mean(relapse_values)
-                        relapse_freq[argmin] = tmp_relapse
-
-        mean_relapse_frequency.append(np.mean(relapse_freq))
-        mean_baseline_frequency.append(np.mean(baseline_freq))
-        mean_significance.append(np.mean(neglogps))
-        genes.append(gene)
+    regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
+    regulons = list(regulonIndex.regulons)
+    baseline_values = np.asarray(reference_matrix.loc[regulons,baseline_patients],dtype=float)
+    relapse_values = np.asarray(reference_matrix.loc[regulons,relapse_patients],dtype=float)
+    baseline_freq = baseline_values.mean(axis=1)
+    relapse_freq = relapse_values.mean(axis=1)
+
+    # differential statistics are computed once per regulon
+    values = np.hstack([relapse_values,baseline_values])
+    in_relapse = np.concatenate([np.ones(relapse_values.shape[1]),np.zeros(baseline_values.shape[1])])
+    indicator = len(set(reference_matrix.iloc[0,:]))
+    if indicator > 2:
+        t, p = tTest(values,in_relapse,equal_var=True)
+        tested = np.ones(len(regulons),dtype=bool)
+    else:
+        # chi square, regulons without positive samples in a group are skipped
+        tested = (relapse_values.sum(axis=1)>0)&(baseline_values.sum(axis=1)>0)
+        chi2, p = chiSquare2x2(values,in_relapse)
+    neglogps = -np.log10(p)
+
+    # gene -> regulon entries of the genes with at least minRegulons regulons
+    indptr, indices = regulonIndex.geneRegulons
+    counts = np.diff(indptr)
+    keep = counts >= minRegulons
+    skipped = list(regulonIndex.genes.names[~keep])
+    entry_genes = np.repeat(np.arange(len(counts)),counts)
+    entries = keep[entry_genes]&tested[indices]
+    entry_genes = entry_genes[entries]
+    entry_regulons = indices[entries]
+
+    if useAllRegulons is False:
+        # the maxRegulons most significant regulons of every gene, ties keep the first
+        order = np.lexsort((-neglogps[entry_regulons],entry_genes))
+        sorted_genes = entry_genes[order]
+        rank = np.arange(len(order))-np.searchsorted(sorted_genes,sorted_genes,side="left")
+        selected = np.sort(order[rank<maxRegulons])
+        entry_genes = entry_genes[selected]
+        entry_regulons = entry_regulons[selected]
+
+    # per gene means as a normalized gene x regulon matrix times the regulon statistics
+    num_selected = np.bincount(entry_genes,minlength=len(counts))
+    selection = sparse.csr_matrix((1./num_selected[entry_genes],(entry_genes,entry_regulons)),shape=(len(counts),len(regulons)))
+    gene_means = selection.dot(np.column_stack([baseline_freq,relapse_freq,neglogps]))
+    gene_means[num_selected==0,:] = np.nan
+    gene_means = gene_means[keep,:]
+    genes = list(regulonIndex.genes.names[keep])
+    mean_baseline_frequency = gene_means[:,0]
+    mean_relapse_frequency = gene_means[:,1]
+    mean_significance = gene_means[:,2]
 
     relapse_over_baseline = np.log2(np.array(mean_relapse_frequency).astype(float)/np.array(mean_baseline_frequency))
     volcano_data_ = pd.DataFrame(np.vstack([mean_baseline_frequency,mean_relapse_frequency,relapse_over_baseline,mean_significance]).T)
@@ -4680,29 +4774,32 @@ def differentialActivity(regulon_matrix,reference_matrix,baseline_patients,relap
     return volcano_data_
 
 def chiSquareTest(risk_status,membership_array):
-    ps = []
-    for i in range(membership_array.shape[0]):
+    risk_status = np.asarray(risk_status)
+    membership_array = np.asarray(membership_array)
+    labels = risk_status==np.unique(risk_status)[-1]
+    incidence = membership_array==membership_array.max(axis=1)[:,np.newaxis]
+    chi2, ps = chiSquare2x2(incidence,labels)
+
+    # the 2x2 kernel only covers binary rows and labels, e.g. -1/0/1 activity rows get the r x c test
+    levels = 1 + (np.diff(np.sort(membership_array,axis=1),axis=1) != 0).sum(axis=1)
+    general = np.flatnonzero(levels > 2) if len(np.unique(risk_status)) <= 2 else range(len(ps))
+    for i in general:
         obs = pd.crosstab(risk_status,membership_array[i,:])
-        chi2, p, dof, ex = chi2_contingency(obs, correction=False)
-        ps.append(p)
-    return ps
+        chi2, ps[i], dof, ex = chi2_contingency(obs, correction=False)
+    return list(ps)
 
 def networkActivity(reference_matrix,regulon_matrix,minRegulons = 2):
     reference_columns = reference_matrix.columns
-    reference_regulonDf = regulon_matrix.copy()
-    reference_regulonDf.index = list(regulon_matrix.loc[:,"Regulon_ID"])
-
-    genes = []
-    activities = []
-    for gene in reference_regulonDf.Gene.unique():
-        regulon_list = np.array(reference_regulonDf[reference_regulonDf.Gene==gene]["Regulon_ID"])
-        if len(regulon_list) >= minRegulons:
-            activity = list(reference_matrix.loc[regulon_list.astype(str),:].mean(axis=0))
-            genes.append(gene)
-            activities.append(activity)
-
-    activity_df = pd.DataFrame(np.vstack(activities))
-    activity_df.index = genes
+    regulonIndex = RegulonIndex.fromDataFrame(regulon_matrix)
+    counts = regulonIndex.regulonCounts()
+    keep = np.where(counts >= minRegulons)[0]
+
+    # gene activity as the row-normalized gene x regulon matrix times the regulon activity
+    incidence = sparse.diags(1./counts[keep]).dot(regulonIndex.incidence()[keep,:])
+    activity = incidence.dot(np.asarray(reference_matrix.loc[list(regulonIndex.regulons),:],dtype=float))
+
+    activity_df = pd.DataFrame(activity)
+    activity_df.index = list(regulonIndex.genes.names[keep])
     activity_df.columns = reference_columns
 
     return activity_df
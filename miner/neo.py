@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Parallel driver for the miner3-neo R script.
+
+miner3-neo orients the edges of every mutation in regStratAll.csv, one
+mutation after the other in a single R process. The driver splits the
+mutations into shards, runs an independent Rscript worker per shard from
+the local worker pool and merges the shard outputs into a single results
+directory with the layout processCausalResults() expects:
+
+    outdir/causal_<mutation>/sm.nonsilent_somatic.<mutation>_<regulator>.csv
+
+Failed shards are retried with a clean output directory.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import parallel
+
+
+REGULATOR_FILE = "regStratAll.csv"
+SHARED_INPUTS = ["bcTfIncidence.csv", "eigengenes.csv", "tfExpression.csv", "filteredMutations.csv"]
+
+
+def neoCommand(rscript="Rscript", neo=None):
+    """Command line that runs miner3-neo, by default the script installed next to the driver"""
+    if neo is None:
+        neo = shutil.which("miner3-neo") or "miner3-neo"
+    return [rscript, neo]
+
+
+def shardNeoInput(indir, workdir, numShards):
+    """Splits the mutations of regStratAll.csv into shard input directories
+
+    Mutations are assigned largest first to the shard with the fewest
+    regulators so far, the other input files are linked into every shard.
+    Returns the shard directories.
+    """
+    # read as text, the shards are written with the original labels and values
+    regulators = pd.read_csv(os.path.join(indir, REGULATOR_FILE), index_col=0, header=0, dtype=str)
+    costs = (regulators.apply(pd.to_numeric, errors="coerce") == 1).sum(axis=0).values
+    numShards = max(min(int(numShards), regulators.shape[1]), 1)
+
+    loads = np.zeros(numShards)
+    assignment = np.zeros(regulators.shape[1], dtype=int)
+    for i in np.argsort(-costs, kind="stable"):
+        shard = np.argmin(loads)
+        assignment[i] = shard
+        loads[shard] += max(costs[i], 1)
+
+    shards = []
+    for shard in range(numShards):
+        columns = np.where(assignment == shard)[0]
+        if len(columns) == 0:
+            continue
+        shardDir = os.path.join(workdir, "shard_{:04d}".format(shard))
+        inputDir = os.path.join(shardDir, "input")
+        os.makedirs(inputDir)
+        regulators.iloc[:, columns].to_csv(os.path.join(inputDir, REGULATOR_FILE))
+        for name in SHARED_INPUTS:
+            source = os.path.abspath(os.path.join(indir, name))
+            try:
+                os.symlink(source, os.path.join(inputDir, name))
+            except OSError:
+                shutil.copy(source, os.path.join(inputDir, name))
+        shards.append(shardDir)
+    return shards
+
+
+def runNeoShard(task):
+    """Runs NEO on one shard, retrying failed runs from a clean output directory
+
+    task is (shardDir, command, retries), returns (shardDir, attempts, success).
+    """
+    shardDir, command, retries = task
+    inputDir = os.path.join(shardDir, "input")
+    outputDir = os.path.join(shardDir, "output")
+    for attempt in range(1, retries + 2):
+        shutil.rmtree(outputDir, ignore_errors=True)
+        # the log is rewritten on every attempt, so it shows the last one
+        with open(os.path.join(shardDir, "neo.log"), "w") as log:
+            returncode = subprocess.call(list(command) + ["--indir", inputDir, "--outdir", outputDir, "--cores", "1"],
+                                         stdout=log, stderr=subprocess.STDOUT)
+        if returncode == 0:
+            return shardDir, attempt, True
+        logging.warning("NEO shard %s failed with exit code %d (attempt %d of %d)",
+                        shardDir, returncode, attempt, retries + 1)
+    return shardDir, retries + 1, False
+
+
+def mergeNeoOutputs(shardDirs, outdir):
+    """Moves the result files of all shards into outdir, keeping their relative paths"""
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    for shardDir in shardDirs:
+        outputDir = os.path.join(shardDir, "output")
+        for root, dirs, files in os.walk(outputDir):
+            target = os.path.join(outdir, os.path.relpath(root, outputDir))
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name in files:
+                os.replace(os.path.join(root, name), os.path.join(target, name))
+
+
+def runNeo(indir, outdir, cores=None, numShards=None, retries=2, command=None, workdir=None):
+    """Runs miner3-neo on the inputs in indir with parallel workers and merges the results into outdir
+
+    numShards defaults to parallel.CHUNKS_PER_CORE shards per core. The shard
+    directories are created in workdir, or a temporary directory next to
+    outdir, and removed once all shards succeeded. Raises a RuntimeError
+    naming the failed shards otherwise, the results of the others are
+    merged into outdir.
+    """
+    cores = parallel.numCores(cores)
+    if numShards is None:
+        numShards = cores * parallel.CHUNKS_PER_CORE
+    if command is None:
+        command = neoCommand()
+    if workdir is None:
+        parent = os.path.dirname(os.path.abspath(outdir))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        # outside of outdir, processCausalResults reads every file in outdir
+        workdir = tempfile.mkdtemp(prefix="neo_shards_", dir=parent)
+
+    shardDirs = shardNeoInput(indir, workdir, numShards)
+    logging.info("running NEO on %d shards with %d workers", len(shardDirs), cores)
+    results = parallel.mapTasks(runNeoShard, [(shardDir, command, retries) for shardDir in shardDirs], cores)
+
+    failed = [shardDir for shardDir, attempts, success in results if not success]
+    mergeNeoOutputs([shardDir for shardDir, attempts, success in results if success], outdir)
+    if len(failed) > 0:
+        raise RuntimeError("NEO failed on {:d} shards, see the neo.log files in {}".format(
+            len(failed), ", ".join(failed)))
+    shutil.rmtree(workdir)
+    return outdir
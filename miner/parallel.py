@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Process-wide executor and helpers for handing large, read-only task data
+to worker processes.
+
+The executor is configured once per run, either with configure() or
+through the MINER_CORES and MINER_BACKEND environment variables, and keeps
+a single worker pool alive for all parallel steps. Work is split into
+small chunks that idle workers pick up as they finish, so a few large
+clusters no longer determine the wall time.
+
+Task data is published once into named shared memory blocks and workers
+receive only a small handle that they resolve on first use. Numeric
+arrays and DataFrames are mapped into the workers without copying, all
+other objects are pickled a single time instead of once per task.
+"""
+import atexit
+import logging
+import os
+import pickle
+import threading
+import uuid
+import multiprocessing, multiprocessing.pool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_CORES = 5
+BACKENDS = ("serial", "thread", "process")
+CHUNKS_PER_CORE = 4
+
+_settings = {"cores": None, "backend": None}
+_pool = None
+_poolKey = None
+_poolLock = threading.Lock()
+
+# per-process cache of resolved task data, keyed by handle id
+_RESOLVED = {}
+_MAX_RESOLVED = 4
+
+
+def _createBlock(size):
+    name = "miner_" + uuid.uuid4().hex[:16]
+    return shared_memory.SharedMemory(name=name, create=True, size=max(int(size), 1))
+
+
+class SharedArray(object):
+    """Handle to a numpy array stored in shared memory"""
+    def __init__(self, array, blocks):
+        array = np.ascontiguousarray(array)
+        block = _createBlock(array.nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        self.name = block.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+
+    def attach(self, blocks):
+        block = shared_memory.SharedMemory(name=self.name)
+        blocks.append(block)
+        array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf)
+        array.flags.writeable = False
+        return array
+
+
+class SharedObject(object):
+    """Handle to an arbitrary object pickled into shared memory"""
+    def __init__(self, obj, blocks):
+        payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        block = _createBlock(len(payload))
+        block.buf[:len(payload)] = payload
+        blocks.append(block)
+        self.name = block.name
+        self.size = len(payload)
+
+    def attach(self, blocks):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return pickle.loads(bytes(block.buf[:self.size]))
+        finally:
+            block.close()
+
+
+class SharedFrame(object):
+    """Handle to a DataFrame with a single numeric dtype, values are not copied"""
+    def __init__(self, df, blocks):
+        self.values = SharedArray(df.values, blocks)
+        self.labels = SharedObject((df.index, df.columns), blocks)
+
+    def attach(self, blocks):
+        index, columns = self.labels.attach(blocks)
+        return pd.DataFrame(self.values.attach(blocks), index=index, columns=columns, copy=False)
+
+
+def _isNumericFrame(obj):
+    if type(obj) is not pd.DataFrame or obj.shape[1] == 0:
+        return False
+    dtypes = set(obj.dtypes)
+    return len(dtypes) == 1 and np.issubdtype(list(dtypes)[0], np.number)
+
+
+def _share(obj, blocks):
+    if type(obj) is np.ndarray and obj.dtype != object:
+        return SharedArray(obj, blocks)
+    if _isNumericFrame(obj):
+        return SharedFrame(obj, blocks)
+    return SharedObject(obj, blocks)
+
+
+class TaskData(object):
+    """Publishes task data for the lifetime of a with-block.
+
+    Instances pickle down to the shared memory handles, so they can be put
+    into every task tuple at almost no cost. The data is only copied into
+    shared memory the first time the handle is pickled, the serial and
+    thread backends work on the original objects. Tuples are published
+    element by element so that each matrix in the tuple is shared without
+    copying. Use resolveTaskData() inside the task function to get the
+    data back.
+    """
+    def __init__(self, taskData):
+        self.id = uuid.uuid4().hex
+        self._local = taskData
+        self._blocks = []
+        self._handles = None
+        self._lock = threading.Lock()
+
+    def publish(self):
+        with self._lock:
+            if self._handles is None:
+                if type(self._local) is tuple:
+                    self._handles = tuple(_share(item, self._blocks) for item in self._local)
+                else:
+                    self._handles = _share(self._local, self._blocks)
+        return self._handles
+
+    def __getstate__(self):
+        return {"id": self.id, "_handles": self.publish()}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = None
+        self._blocks = []
+        self._lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        self._handles = None
+
+    def resolve(self):
+        if self._local is not None:
+            return self._local
+        if self.id in _RESOLVED:
+            return _RESOLVED[self.id][1]
+
+        blocks = []
+        if type(self._handles) is tuple:
+            data = tuple(handle.attach(blocks) for handle in self._handles)
+        else:
+            data = self._handles.attach(blocks)
+
+        while len(_RESOLVED) >= _MAX_RESOLVED:
+            del _RESOLVED[next(iter(_RESOLVED))]
+        # blocks go first so the views into them are released before the blocks
+        _RESOLVED[self.id] = (blocks, data)
+        return data
+
+
+def resolveTaskData(taskData):
+    """Returns the data behind a TaskData handle, plain task data is returned as is"""
+    if isinstance(taskData, TaskData):
+        return taskData.resolve()
+    return taskData
+
+
+def configure(cores=None, backend=None):
+    """Sets the number of cores and the backend used by mapTasks()
+
+    Unset values fall back to the MINER_CORES and MINER_BACKEND environment
+    variables, then to 5 cores and the process backend. A single core always
+    runs serially.
+    """
+    if cores is not None:
+        if int(cores) < 1:
+            raise ValueError("number of cores must be at least 1, got {}".format(cores))
+        _settings["cores"] = int(cores)
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError("unknown backend '{}', use one of {}".format(backend, ", ".join(BACKENDS)))
+        _settings["backend"] = backend
+
+
+def numCores(cores=None):
+    """Returns cores if given, otherwise the configured number of cores"""
+    if cores is not None:
+        return max(int(cores), 1)
+    if _settings["cores"] is not None:
+        return _settings["cores"]
+    return max(int(os.environ.get("MINER_CORES", DEFAULT_CORES)), 1)
+
+
+def backend(cores=None):
+    """Returns the backend used for the given number of cores"""
+    if numCores(cores) == 1:
+        return "serial"
+    name = _settings["backend"] or os.environ.get("MINER_BACKEND", "process")
+    if name not in BACKENDS:
+        raise ValueError("unknown backend '{}', use one of {}".format(name, ", ".join(BACKENDS)))
+    return name
+
+
+def splitTasks(count, cores=None, chunksPerCore=CHUNKS_PER_CORE):
+    """Splits range(count) into contiguous (start, stop) chunks
+
+    Produces about chunksPerCore chunks per core so that idle workers can
+    pick up the remaining work, and never returns empty chunks.
+    """
+    count = int(count)
+    if count == 0:
+        return []
+    numChunks = min(count, numCores(cores) * chunksPerCore)
+    bounds = np.linspace(0, count, numChunks + 1).round().astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(numChunks)]
+
+
+def _getPool(name, cores):
+    global _pool, _poolKey
+    with _poolLock:
+        if _pool is not None and _poolKey != (name, cores):
+            _pool.close()
+            _pool.join()
+            _pool = None
+        if _pool is None:
+            logging.info("starting {} pool with {:d} workers".format(name, cores))
+            if name == "thread":
+                _pool = multiprocessing.pool.ThreadPool(cores)
+            else:
+                # workers have to share the tracker of this process, otherwise
+                # they clean up shared task data they only attached to
+                resource_tracker.ensure_running()
+                _pool = multiprocessing.pool.Pool(cores)
+            _poolKey = (name, cores)
+        return _pool
+
+
+def mapTasks(function, tasks, cores=None):
+    """Applies function to every task and returns the results in task order
+
+    Tasks are handed out one at a time to the workers of the shared pool.
+    """
+    tasks = list(tasks)
+    cores = numCores(cores)
+    name = backend(cores)
+    if name == "serial" or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    pool = _getPool(name, cores)
+    return list(pool.imap(function, tasks, chunksize=1))
+
+
+def shutdown():
+    """Stops the shared worker pool, it is restarted on the next mapTasks() call"""
+    global _pool, _poolKey
+    with _poolLock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+        _pool = None
+        _poolKey = None
+
+
+atexit.register(shutdown)
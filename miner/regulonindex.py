@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+CSR lookups between genes, regulons and regulators.
+
+A RegulonIndex is built once from a regulonDf (Regulon_ID, Regulator and
+Gene columns) or from the regulon modules in regulons.json. It replaces the
+boolean filters over the regulon table (regulon_matrix[regulon_matrix.Gene==gene])
+with slices of int32 arrays. Regulon ids are kept as strings, the way the
+eigengene and activity matrices are indexed.
+"""
+import numpy as np
+from scipy import sparse
+
+from .vocabulary import Vocabulary
+
+
+def _csr(keys, values, numKeys):
+    # values grouped by key, keeping the row order within every key
+    order = np.argsort(keys, kind="stable")
+    indptr = np.zeros(numKeys + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(keys, minlength=numKeys))
+    return indptr, np.asarray(values, dtype=np.int32)[order]
+
+
+class RegulonIndex(object):
+    """gene -> regulons, regulon -> genes and regulator -> regulons lookups
+
+    Lookups take and return names. Rows are kept as they are in the regulon
+    table, so a gene listed twice in a regulon maps to that regulon twice.
+    """
+    def __init__(self, regulonIds, regulators, genes):
+        regulonIds = [str(id_) for id_ in regulonIds]
+        self.regulons = Vocabulary(regulonIds)
+        self.genes = Vocabulary(genes)
+        self.regulators = Vocabulary(regulators)
+
+        rowRegulons = self.regulons.encode(regulonIds)
+        rowGenes = self.genes.encode(genes)
+        rowRegulators = self.regulators.encode(regulators)
+
+        # codes are assigned in order of appearance, so the first rows are sorted
+        self.firstRows = np.unique(rowRegulons, return_index=True)[1]
+        self.regulonRegulator = rowRegulators[self.firstRows]
+
+        self.geneRegulons = _csr(rowGenes, rowRegulons, len(self.genes))
+        self.regulonGenes = _csr(rowRegulons, rowGenes, len(self.regulons))
+        self.regulatorRegulons = _csr(self.regulonRegulator, np.arange(len(self.regulons)), len(self.regulators))
+
+    @classmethod
+    def fromDataFrame(cls, regulonDf):
+        return cls(list(regulonDf["Regulon_ID"]), list(regulonDf["Regulator"]), list(regulonDf["Gene"]))
+
+    @classmethod
+    def fromModules(cls, regulonModules, regulonIDtoRegulator):
+        """Builds the index from regulons.json and a regulon id to regulator mapping
+
+        regulonIDtoRegulator is a dict or the DataFrame returned by regulonIdToRegulator.
+        """
+        if hasattr(regulonIDtoRegulator, "columns"):
+            regulonIDtoRegulator = regulonIDtoRegulator["Regulator"]
+        regulatorOf = {str(key): value for key, value in regulonIDtoRegulator.items()}
+        ids = []
+        regulators = []
+        genes = []
+        for id_ in regulonModules:
+            ids.extend([id_] * len(regulonModules[id_]))
+            regulators.extend([regulatorOf[str(id_)]] * len(regulonModules[id_]))
+            genes.extend(regulonModules[id_])
+        return cls(ids, regulators, genes)
+
+    @staticmethod
+    def _slice(csr, code):
+        indptr, indices = csr
+        return indices[indptr[code]:indptr[code + 1]]
+
+    def regulonCodesOfGene(self, gene):
+        if gene not in self.genes:
+            return np.zeros(0, dtype=np.int32)
+        return self._slice(self.geneRegulons, self.genes.index[gene])
+
+    def regulonCodesOfRegulator(self, regulator):
+        if regulator not in self.regulators:
+            return np.zeros(0, dtype=np.int32)
+        return self._slice(self.regulatorRegulons, self.regulators.index[regulator])
+
+    def regulonsOfGene(self, gene):
+        """Ids of the regulons that contain gene"""
+        return self.regulons.decode(self.regulonCodesOfGene(gene))
+
+    def regulonsOfRegulator(self, regulator):
+        """Ids of the regulons of regulator"""
+        return self.regulons.decode(self.regulonCodesOfRegulator(regulator))
+
+    def genesOfRegulon(self, regulon):
+        return self.genes.decode(self._slice(self.regulonGenes, self.regulons.index[str(regulon)]))
+
+    def regulatorOf(self, regulon):
+        return self.regulators.decode([self.regulonRegulator[self.regulons.index[str(regulon)]]])[0]
+
+    def regulonCounts(self):
+        """Number of regulon memberships of every gene, in gene order"""
+        return np.diff(self.geneRegulons[0])
+
+    def incidence(self):
+        """Sparse gene x regulon matrix counting memberships"""
+        indptr, indices = self.geneRegulons
+        data = np.ones(len(indices), dtype=np.int32)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(self.genes), len(self.regulons)))
+        matrix.sum_duplicates()
+        return matrix
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Array-wide two-group test statistics.
+
+The kernels compute many tests at once from group counts, sums and sums of
+squares obtained with matrix products, instead of one scipy call per row
+or comparison. Results match scipy.stats.ttest_ind and
+scipy.stats.chi2_contingency(correction=False) to floating point precision.
+"""
+import numpy as np
+from scipy import stats
+
+
+def groupIndicator(columns, members):
+    """0/1 vector over columns that is 1 for the columns in members"""
+    members = set(members)
+    return np.array([column in members for column in columns], dtype=float)
+
+
+def tTest(data, groups1, groups2=None, equal_var=False, nan_policy="propagate"):
+    """t-tests of every row of data between two groups of columns
+
+    groups1 and groups2 are 0/1 vectors over the columns of data, or matrices
+    with one group per row. groups2 defaults to the complement of groups1.
+    Returns t and p with shape (rows,) for vectors and (rows, groups)
+    otherwise, like ttest_ind(data[:,groups1==1], data[:,groups2==1], axis=1).
+    Welch's test is the default, equal_var=True gives Student's test.
+    Missing values make the tests of their groups NaN, with nan_policy="omit"
+    every test only uses the values that are present.
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    vector = np.ndim(groups1) == 1
+    groups1 = np.atleast_2d(np.asarray(groups1, dtype=float))
+    if groups2 is None:
+        groups2 = 1 - groups1
+    groups2 = np.atleast_2d(np.asarray(groups2, dtype=float))
+
+    missing = np.isnan(data)
+    if missing.any():
+        data = np.where(missing, 0, data)
+    present = (~missing).astype(float)
+    # centering the rows keeps the sums of squares well conditioned
+    with np.errstate(divide="ignore", invalid="ignore"):
+        center = data.sum(axis=1) / present.sum(axis=1)
+    data = np.where(missing, 0, data - np.nan_to_num(center)[:, np.newaxis])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if nan_policy == "omit":
+            n1 = np.dot(present, groups1.T)
+            n2 = np.dot(present, groups2.T)
+        else:
+            n1 = groups1.sum(axis=1)
+            n2 = groups2.sum(axis=1)
+        mean1 = np.dot(data, groups1.T) / n1
+        mean2 = np.dot(data, groups2.T) / n2
+        squares1 = np.maximum(np.dot(data ** 2, groups1.T) - n1 * mean1 ** 2, 0)
+        squares2 = np.maximum(np.dot(data ** 2, groups2.T) - n2 * mean2 ** 2, 0)
+
+        if equal_var:
+            df = np.broadcast_to(n1 + n2 - 2, mean1.shape)
+            se = np.sqrt((squares1 + squares2) / df * (1. / n1 + 1. / n2))
+        else:
+            se1 = squares1 / (n1 - 1) / n1
+            se2 = squares2 / (n2 - 1) / n2
+            df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+            # as in scipy, constant groups give an undefined df that is set to 1
+            df = np.where(np.isnan(df), 1, df)
+            se = np.sqrt(se1 + se2)
+        t = (mean1 - mean2) / se
+        p = 2 * stats.t.sf(np.abs(t), df)
+
+    if missing.any() and nan_policy != "omit":
+        missing = missing.astype(float)
+        undefined = (np.dot(missing, groups1.T) + np.dot(missing, groups2.T)) > 0
+        t[undefined] = np.nan
+        p[undefined] = np.nan
+    p[np.isnan(t)] = np.nan
+
+    if vector:
+        return t[:, 0], p[:, 0]
+    return t, p
+
+
+def chiSquare2x2(incidence, labels):
+    """Pearson chi-square of every 0/1 row of incidence against 0/1 labels
+
+    Same as chi2_contingency(crosstab(labels, row), correction=False) for
+    every row. Rows or labels with a single value give chi2 0 and p 1, as the
+    degenerate crosstab does. Returns chi2 and p arrays.
+    """
+    incidence = np.atleast_2d(np.asarray(incidence, dtype=float))
+    labels = np.asarray(labels, dtype=float)
+    n = float(len(labels))
+    positive = np.dot(incidence, labels)
+    rowSums = incidence.sum(axis=1)
+    labelSum = labels.sum()
+
+    # (ad - bc) of the 2x2 table is n*a - (a+b)*(a+c)
+    denominator = rowSums * (n - rowSums) * labelSum * (n - labelSum)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chi2 = np.where(denominator > 0, n * (n * positive - rowSums * labelSum) ** 2 / denominator, 0.)
+    p = np.where(denominator > 0, stats.chi2.sf(chi2, 1), 1.)
+    return chi2, p
+
+
+def pairedSpearman(a, b):
+    """Spearman correlation and p-value of every row of a with the same row of b
+
+    Same as spearmanr(a[i], b[i]) for every row i, computed as the mean product
+    of standardized ranks. Returns r and p arrays.
+    """
+    a = stats.rankdata(np.atleast_2d(np.asarray(a, dtype=float)), axis=1)
+    b = stats.rankdata(np.atleast_2d(np.asarray(b, dtype=float)), axis=1)
+    n = a.shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = (a - a.mean(axis=1)[:, np.newaxis]) / a.std(axis=1)[:, np.newaxis]
+        b = (b - b.mean(axis=1)[:, np.newaxis]) / b.std(axis=1)[:, np.newaxis]
+        r = np.clip((a * b).sum(axis=1) / n, -1, 1)
+        t = r * np.sqrt(np.clip((n - 2) / ((r + 1.0) * (1.0 - r)), 0, None))
+    p = 2 * stats.t.sf(np.abs(t), n - 2)
+    return r, p
+
+
+def pairedPearson(a, b):
+    """Pearson correlation and p-value of every row of a with the same row of b
+
+    Same as pearsonr(a[i][present], b[i][present]) for every row i, where
+    present excludes the columns that are NaN in either row. Rows with two
+    values give r +-1 and p 1 like pearsonr, constant rows give NaN.
+    Returns r and p arrays.
+    """
+    a = np.atleast_2d(np.asarray(a, dtype=float))
+    b = np.atleast_2d(np.asarray(b, dtype=float))
+    present = ~(np.isnan(a) | np.isnan(b))
+    n = present.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(present, a, 0)
+        b = np.where(present, b, 0)
+        a = np.where(present, a - (a.sum(axis=1) / n)[:, np.newaxis], 0)
+        b = np.where(present, b - (b.sum(axis=1) / n)[:, np.newaxis], 0)
+        r = np.clip((a * b).sum(axis=1) / np.sqrt((a ** 2).sum(axis=1) * (b ** 2).sum(axis=1)), -1, 1)
+        t = r * np.sqrt((n - 2) / ((1.0 + r) * (1.0 - r)))
+        p = np.where(n > 2, 2 * stats.t.sf(np.abs(t), n - 2), 1.)
+    r = np.where(n == 2, np.sign(r), r)
+    p[np.isnan(r)] = np.nan
+    return r, p
+
+
+def mannWhitneyAuc(scores, labels):
+    """ROC AUC of every row of scores against every row of 0/1 labels
+
+    Same as roc_auc_score(labels[j], scores[i]) for every pair of rows,
+    computed from average ranks as the normalized Mann-Whitney U statistic,
+    tied scores count half. Returns a (scores, labels) array, label rows with
+    a single class give NaN.
+    """
+    scores = np.atleast_2d(np.asarray(scores, dtype=float))
+    labels = np.atleast_2d(np.asarray(labels, dtype=float))
+    ranks = stats.rankdata(scores, axis=1)
+    n1 = labels.sum(axis=1)
+    n0 = labels.shape[1] - n1
+    u = np.dot(ranks, labels.T) - n1 * (n1 + 1) / 2.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        auc = u / (n1 * n0)
+    auc[:, (n1 == 0) | (n0 == 0)] = np.nan
+    return auc
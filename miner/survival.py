@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Array-wide univariate survival statistics.
+
+The kernels analyse every row of a feature matrix against the same
+survival data. The patients are sorted by duration once and the sums over
+risk sets and tied deaths are taken with cumulative sums for a whole block
+of features at a time, instead of preparing and fitting one model per
+feature. Cox regressions follow the Newton-Raphson iteration of
+lifelines.CoxPHFitter with Efron's method for ties, the z and p values
+match its summary to the convergence tolerance. Binary memberships can
+be screened with log-rank tests instead, which need no iteration and
+match lifelines.statistics.logrank_test.
+"""
+import numpy as np
+from scipy import stats
+
+
+BLOCK_SIZE = 512
+COX_MAX_STEPS = 500
+COX_PRECISION = 1e-07
+COX_R_PRECISION = 1e-09
+COX_STEP_SIZE = 0.95
+
+
+class EventTimes(object):
+    """Sorted event-time structure of survival data
+
+    Patients are ordered by duration with order, values passed to the sum
+    methods have one row per feature and one column per patient in that order.
+    """
+
+    def __init__(self, durations, events):
+        durations = np.asarray(durations, dtype=float)
+        self.order = np.argsort(durations, kind="mergesort")
+        sortedDurations = durations[self.order]
+        self.observed = (np.asarray(events, dtype=float) != 0)[self.order]
+        # first patient of every distinct duration
+        self.starts = np.flatnonzero(np.concatenate([[True], sortedDurations[1:] != sortedDurations[:-1]]))
+        self.times = sortedDurations[self.starts]
+        deaths = np.add.reduceat(self.observed.astype(float), self.starts)
+        # distinct durations with at least one death and their number of deaths
+        self.eventTimes = np.flatnonzero(deaths > 0)
+        self.deaths = deaths[self.eventTimes]
+
+    def timeSums(self, values):
+        return np.add.reduceat(values, self.starts, axis=1)
+
+    def riskSums(self, values):
+        # sums over the patients at risk at every event time, those with a duration from the time on
+        sums = self.timeSums(values)
+        return np.cumsum(sums[:, ::-1], axis=1)[:, ::-1][:, self.eventTimes]
+
+    def deathSums(self, values):
+        return self.timeSums(np.where(self.observed, values, 0))[:, self.eventTimes]
+
+
+def efronDerivatives(x, beta, eventTimes):
+    """Log partial likelihood with its first and second derivative at beta for every row of x"""
+    phi = np.exp(beta[:, np.newaxis] * x)
+    risk0 = eventTimes.riskSums(phi)
+    risk1 = eventTimes.riskSums(phi * x)
+    risk2 = eventTimes.riskSums(phi * x * x)
+    tie0 = eventTimes.deathSums(phi)
+    tie1 = eventTimes.deathSums(phi * x)
+    tie2 = eventTimes.deathSums(phi * x * x)
+    deathSum = eventTimes.deathSums(x).sum(axis=1)
+
+    gradient = deathSum.copy()
+    loglik = deathSum * beta
+    hessian = np.zeros(len(beta))
+    # Efron: the k-th of d tied deaths removes k/d of the tied risk from the risk set
+    deaths = eventTimes.deaths
+    for k in range(int(deaths.max()) if len(deaths) > 0 else 0):
+        columns = np.flatnonzero(deaths > k)
+        proportion = k / deaths[columns]
+        denom = 1.0 / (risk0[:, columns] - proportion * tie0[:, columns])
+        summand = (risk1[:, columns] - proportion * tie1[:, columns]) * denom
+        gradient -= summand.sum(axis=1)
+        loglik += np.log(denom).sum(axis=1)
+        hessian += (summand ** 2 - (risk2[:, columns] - proportion * tie2[:, columns]) * denom).sum(axis=1)
+    return loglik, gradient, hessian
+
+
+def coxBlock(x, eventTimes):
+    # lifelines fits the standardized values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (x - x.mean(axis=1)[:, np.newaxis]) / x.std(axis=1, ddof=1)[:, np.newaxis]
+    rows = x.shape[0]
+    beta = np.zeros(rows)
+    delta = np.zeros(rows)
+    hessian = np.zeros(rows)
+    stepSize = np.full(rows, COX_STEP_SIZE)
+    temperBackUp = np.zeros(rows, dtype=bool)
+    norms = np.zeros((rows, 3))
+    previousLoglik = np.zeros(rows)
+    # missing, infinite or constant values fail before the first step
+    failed = ~np.isfinite(x).all(axis=1)
+    active = ~failed
+
+    step = 0
+    while active.any():
+        step += 1
+        rows = np.flatnonzero(active)
+        beta[rows] += stepSize[rows] * delta[rows]
+        with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+            loglik, gradient, h = efronDerivatives(x[rows], beta[rows], eventTimes)
+            newDelta = gradient / -h
+        # CoxPHFitter gives up when the information is not positive or the step undefined
+        singular = ~(-h > 0) | np.isnan(newDelta)
+        failed[rows[singular]] = True
+        active[rows[singular]] = False
+        keep = ~singular
+        rows, loglik, gradient, h, newDelta = rows[keep], loglik[keep], gradient[keep], h[keep], newDelta[keep]
+        delta[rows] = newDelta
+        hessian[rows] = h
+
+        norm = np.abs(newDelta)
+        previous = previousLoglik[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            stalled = (previous != 0) & (np.abs(loglik - previous) / -previous < COX_R_PRECISION)
+        done = ((norm < COX_PRECISION) | stalled | (gradient * newDelta / 2 < COX_PRECISION) |
+                (step >= COX_MAX_STEPS) | (stepSize[rows] <= 0.00001) | ((np.abs(loglik) < 0.0001) & (norm > 1.0)))
+        active[rows[done]] = False
+        rows, loglik, norm = rows[~done], loglik[~done], norm[~done]
+        previousLoglik[rows] = loglik
+
+        # step size rules of lifelines.utils.StepSizer
+        size = stepSize[rows]
+        size = np.where(temperBackUp[rows], np.minimum(size * 1.3, COX_STEP_SIZE), size)
+        size = np.where(norm >= 15.0, size * 0.1, np.where(norm > 5.0, size * 0.25, size))
+        temperBackUp[rows] |= norm > 5.0
+        norms[rows] = np.column_stack([norms[rows, 1:], norm])
+        if step >= 3:
+            decreasing = (np.diff(norms[rows], axis=1) < 0).all(axis=1)
+            size = np.where(decreasing, np.minimum(size * 1.3, 1.0), size * 0.98)
+        stepSize[rows] = size
+
+    with np.errstate(invalid="ignore"):
+        z = np.where(failed, 0, beta * np.sqrt(-hessian))
+    p = np.where(failed, 1, stats.chi2.sf(z ** 2, 1))
+    return z, p
+
+
+def coxRegression(values, durations, events, blockSize=BLOCK_SIZE):
+    """Univariate Cox proportional hazards regression of every row of values
+
+    values has one row per feature and one column per patient, durations
+    and events are the survival data of the patients in the same order.
+    Returns the Wald z and p of every feature like the z and p columns of
+    CoxPHFitter().summary, features whose model cannot be fit (missing or
+    constant values, no deaths) get z = 0 and p = 1.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    durations = np.asarray(durations, dtype=float)
+    events = np.asarray(events, dtype=float)
+    z = np.zeros(values.shape[0])
+    p = np.ones(values.shape[0])
+    if len(durations) == 0 or not (np.isfinite(durations).all() and np.isfinite(events).all()):
+        return z, p
+
+    eventTimes = EventTimes(durations, events)
+    for start in range(0, values.shape[0], blockSize):
+        stop = min(start + blockSize, values.shape[0])
+        z[start:stop], p[start:stop] = coxBlock(values[start:stop, eventTimes.order], eventTimes)
+    return z, p
+
+
+def logRankTest(membership, durations, events, blockSize=BLOCK_SIZE):
+    """Log-rank tests of the members of every row of membership against the other patients
+
+    membership has one row per feature and one column per patient, nonzero
+    entries are members. Returns z = (O - E) / sqrt(V) of the deaths among
+    the members, positive for a higher hazard like the Cox z, and its p.
+    Rows without a variance, e.g. without members or non-members, get
+    z = 0 and p = 1.
+    """
+    membership = np.atleast_2d(np.asarray(membership, dtype=float))
+    durations = np.asarray(durations, dtype=float)
+    events = np.asarray(events, dtype=float)
+    z = np.zeros(membership.shape[0])
+    p = np.ones(membership.shape[0])
+    if len(durations) == 0 or not (np.isfinite(durations).all() and np.isfinite(events).all()):
+        return z, p
+
+    eventTimes = EventTimes(durations, events)
+    deaths = eventTimes.deaths
+    atRisk = eventTimes.riskSums(np.ones((1, len(durations))))[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # hypergeometric variance of the deaths among the members at every event time
+        spread = np.where(atRisk > 1, deaths * (atRisk - deaths) / (atRisk - 1), 0)
+    for start in range(0, membership.shape[0], blockSize):
+        stop = min(start + blockSize, membership.shape[0])
+        members = (membership[start:stop, eventTimes.order] != 0).astype(float)
+        share = eventTimes.riskSums(members) / atRisk
+        observed = eventTimes.deathSums(members).sum(axis=1)
+        expected = (share * deaths).sum(axis=1)
+        variance = (share * (1 - share) * spread).sum(axis=1)
+        defined = variance > 1e-12
+        z[start:stop][defined] = (observed - expected)[defined] / np.sqrt(variance[defined])
+        p[start:stop][defined] = stats.chi2.sf(z[start:stop][defined] ** 2, 1)
+    return z, p
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Integer-coded vocabularies for genes, samples, regulons and TFs.
+
+A Vocabulary assigns dense int32 codes to names in insertion order. The
+command line tools build the gene and sample vocabularies once from the
+preprocessed expression data, the pipeline functions that accept them
+keep clusters, regulons, memberships and mechanistic output as int32 code
+arrays, and the names are decoded only where results are written to disk.
+"""
+import numpy as np
+
+
+class Vocabulary(object):
+    """Dense int32 codes for a list of unique names"""
+    def __init__(self, names=()):
+        self._names = []
+        self.index = {}
+        self.update(names)
+
+    def update(self, names):
+        """Adds the names that are not yet coded, returns self"""
+        for name in names:
+            if name not in self.index:
+                self.index[name] = len(self._names)
+                self._names.append(name)
+        return self
+
+    @property
+    def names(self):
+        return np.array(self._names, dtype=object)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def encode(self, names, missing="raise"):
+        """int32 codes of names
+
+        missing selects what happens to names that are not coded: "raise"
+        raises a KeyError, "drop" leaves them out and "add" adds them.
+        """
+        if missing == "add":
+            self.update(names)
+        if missing == "drop":
+            return np.array([self.index[name] for name in names if name in self.index], dtype=np.int32)
+        return np.array([self.index[name] for name in names], dtype=np.int32)
+
+    def decode(self, codes):
+        """Names of codes, as a list"""
+        return [self._names[code] for code in codes]
+
+    def positions(self, names):
+        """Position of every coded name in names, -1 for the codes that are not in names"""
+        positions = np.full(len(self), -1, dtype=np.int64)
+        for i, name in enumerate(names):
+            code = self.index.get(name)
+            if code is not None:
+                positions[code] = i
+        return positions
+
+    def mask(self, codes):
+        """Boolean array over the vocabulary that is True at codes"""
+        mask = np.zeros(len(self), dtype=bool)
+        mask[np.asarray(codes, dtype=np.int64)] = True
+        return mask
+
+    def encodeSets(self, dict_, missing="raise"):
+        """Encodes a dict of name lists such as clusters, regulons or memberships"""
+        return {key: self.encode(dict_[key], missing=missing) for key in dict_}
+
+    def decodeSets(self, dict_):
+        """Inverse of encodeSets"""
+        return {key: self.decode(dict_[key]) for key in dict_}
+
+
+def expressionVocabularies(expressionData):
+    """Gene and sample Vocabularies of an expression matrix
+
+    Genes are coded in row order and samples in column order, so the codes
+    of the expressed genes and of the samples are their positions in
+    expressionData. Genes from other sources, e.g. database targets, are
+    added after them.
+    """
+    return Vocabulary(expressionData.index), Vocabulary(expressionData.columns)
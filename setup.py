@@ -41,5 +41,6 @@ setuptools.setup(
     scripts=['bin/miner3-coexpr', 'bin/miner3-mechinf',
              'bin/miner3-bcmembers', 'bin/miner3-subtypes',
              'bin/miner3-survival', 'bin/miner3-causalinference', 'bin/miner3-causalinf-pre',
-             'bin/miner3-causalinf-post', 'bin/miner3-neo', 'bin/miner3-riskpredict',
+             'bin/miner3-causalinf-post', 'bin/miner3-neo', 'bin/miner3-neo-parallel',
+             'bin/miner3-riskpredict',
              'bin/gene2opentargets', 'bin/drug2opentargets'])
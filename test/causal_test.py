@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import sys
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from miner import miner
+
+
+class CausalTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.data = rng.normal(size=(20, 30)) * 10 + 100
+        self.data[2, :] = 1.0
+        self.groups = (rng.uniform(size=(4, 30)) > 0.5).astype(float)
+
+    def test_mutation_groups(self):
+        mutations = pd.DataFrame([[1, 0, 1, 0], [0, np.nan, 0, 1]], index=["M1", "M2"],
+                                 columns=["s0", "s1", "s2", "s9"])
+        mutant, wildtype = miner.mutationGroups(mutations, ["s0", "s1", "s2", "s3"])
+        np.testing.assert_array_equal([[1, 0, 1, 0], [0, 0, 0, 0]], mutant)
+        np.testing.assert_array_equal([[0, 1, 0, 0], [1, 1, 1, 0]], wildtype)
+
+    def test_mutation_regulator_stratification(self):
+        samples = ["s%d" % i for i in range(30)]
+        tfs = pd.DataFrame(self.data[:5], index=["TF%d" % i for i in range(5)], columns=samples)
+        mutations = pd.DataFrame(self.groups[:3], index=["M1", "M2", "M3"], columns=samples)
+        tfs.iloc[1] += 30 * mutations.iloc[0]
+        incidence, stratification = miner.mutationRegulatorStratification(mutations, tfs, threshold=0.01,
+                                                                          dictionary_=True, numCores=1)
+        self.assertEqual(bool, incidence.values.dtype)
+        self.assertTrue(incidence.loc["TF1", "M1"])
+        expected = stats.ttest_ind(tfs.loc["TF1", mutations.loc["M1"] == 1], tfs.loc["TF1", mutations.loc["M1"] == 0],
+                                   equal_var=False)
+        np.testing.assert_allclose(expected, stratification["M1"]["TF1"])
+        self.assertEqual(int(incidence.values.sum()), sum(len(hits) for hits in stratification.values()))
+
+    def test_post_process_causal_results(self):
+        rng = np.random.RandomState(12)
+        patients = ["P%d" % i for i in range(40)]
+        mutations = pd.DataFrame((rng.uniform(size=(4, 40)) > 0.6).astype(int),
+                                 index=["M%d" % i for i in range(4)], columns=patients)
+        # a mutation with too few mutant patients for some of the tests
+        mutations.loc["M3", :] = 0
+        mutations.loc["M3", ["P0", "P1", "P2"]] = 1
+        tfExp = pd.DataFrame(rng.normal(size=(3, 40)), index=["TF0", "TF1", "TF2"], columns=patients)
+        eigengenes = pd.DataFrame(rng.normal(size=(3, 40)), index=[0, 1, 2], columns=patients)
+        # values <= -4.01 mark patients that do not express a regulator or bicluster
+        tfExp.values[rng.uniform(size=tfExp.shape) > 0.8] = -4.01
+        tfExp.loc["TF2", :] = -5
+        tfExp.loc["TF2", ["P%d" % i for i in range(0, 40, 3)]] = rng.normal(size=14)
+        eigengenes.values[rng.uniform(size=eigengenes.shape) > 0.85] = -4.5
+        tfExp.loc["TF0", ["P0", "P1", "P2"]] = [0.5, -0.3, -4.01]
+        eigengenes.loc[2, ["P0", "P1", "P2"]] = [0.1, 0.2, 0.3]
+        causal = {0: {"TF0": ["M0", "M1"], "TF1": ["M2"]},
+                  1: {"TF1": ["M3", "M0"], "TF2": ["M1"]},
+                  2: {"TF2": ["M2", "M3"], "TF0": ["M3"]}}
+        mechanistic = {str(bc): {tf: [0.001 * (bc + 1), []] for tf in causal[bc]} for bc in causal}
+        postProcessed = miner.postProcessCausalResults(causal, mutations, tfExp, eigengenes,
+                                                       mechanisticOutput=mechanistic, numCores=2)
+
+        self.assertEqual(list(causal), list(postProcessed))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for bc in causal:
+                self.assertEqual(list(causal[bc]), list(postProcessed[bc]))
+                for tf in causal[bc]:
+                    # the entry of a regulator is rewritten for every mutation, the last one is kept
+                    mutation = causal[bc][tf][-1]
+                    mut = mutations.columns[mutations.loc[mutation] > 0]
+                    wt = mutations.columns[mutations.loc[mutation] == 0]
+                    mutTfs = tfExp.loc[tf, mut][tfExp.loc[tf, mut] > -4.01]
+                    mutBc = eigengenes.loc[bc, mut][eigengenes.loc[bc, mut] > -4.01]
+                    mutRegT, mutRegP = 0, 1
+                    if len(mutTfs) > 1:
+                        wtTfs = tfExp.loc[tf, wt][tfExp.loc[tf, wt] > -4.01]
+                        mutRegT, mutRegP = stats.ttest_ind(mutTfs, wtTfs, equal_var=False)
+                    mutBcP, mutCorrR, mutCorrP = 1, 0, 1
+                    if len(mutBc) > 1:
+                        wtBc = eigengenes.loc[bc, wt][eigengenes.loc[bc, wt] > -4.01]
+                        mutBcP = stats.ttest_ind(mutBc, wtBc, equal_var=False)[1]
+                        if len(mutTfs) > 2:
+                            both = mutTfs.index.intersection(mutBc.index)
+                            mutCorrR, mutCorrP = stats.pearsonr(tfExp.loc[tf, both], eigengenes.loc[bc, both])
+                    phyper = mechanistic[str(bc)][tf][0]
+                    result = postProcessed[bc][tf]
+                    self.assertEqual([mutation], list(result["mutations"]))
+                    self.assertAlmostEqual(10 ** -((-np.log10(mutCorrP) - np.log10(phyper)) / 2.),
+                                           result["regBcWeightedPValue"])
+                    self.assertEqual(np.sign(mutCorrR), result["edgeRegBc"])
+                    self.assertEqual(phyper, result["regBcHyperPValue"])
+                    result = result["mutations"][mutation]
+                    self.assertAlmostEqual(len(mut) / 40., result["mutationFrequency"])
+                    self.assertAlmostEqual(10 ** -((-np.log10(mutRegP) - np.log10(mutBcP) - np.log10(mutCorrP)
+                                                    - np.log10(phyper)) / 4.), result["mutRegBcWeightedPValue"])
+                    self.assertEqual(np.sign(mutRegT), result["edgeMutReg"])
+                    self.assertAlmostEqual(mutRegP, result["mutRegPValue"])
+                    self.assertAlmostEqual(mutBcP, result["mutBcPValue"])
+                    self.assertAlmostEqual(mutCorrP, result["regBcCorrPValue"])
+                    self.assertAlmostEqual(mutCorrR, result["regBcCorrR"])
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CausalTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
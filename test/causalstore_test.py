@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from miner import miner
+from miner.causalstore import CausalStore, RESULT_COLUMNS
+
+
+class CausalStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.results = pd.DataFrame([["M1", "TF1", "0", 1, 2.0, 0.5, 0.01, 3.0, 2.5, 1.0],
+                                     ["M1", "TF1", "1", 1, 2.0, -0.2, 0.2, -1.0, 1.1, 1.0],
+                                     ["M2", "TF2", "2", -1, 1.5, 0.4, 0.03, -2.0, 1.8, 0.5]],
+                                    columns=RESULT_COLUMNS)
+        self.results.index = list(self.results.Regulon)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_and_query(self):
+        store = CausalStore(os.path.join(self.tmpdir, "results.sqlite"))
+        store.append(self.results.iloc[:2], source="common")
+        store.append(self.results.iloc[2:], source="translocations")
+        self.assertEqual(3, len(store))
+        self.assertEqual(["M1", "M2"], store.mutations())
+        self.assertEqual(["0", "2"], list(store.query([("RegulatorRegulon_Spearman_p-value", "<=", 0.05)]).index))
+        self.assertEqual(["2"], list(store.query(source="translocations").index))
+        self.assertEqual(["1"], list(store.query([("Fraction_of_edges_correctly_aligned", ">=", 0.5)],
+                                                 mutation="M1", regulator=["TF1"])
+                                     .query("RegulatorRegulon_Spearman_R < 0").index))
+        self.assertRaises(ValueError, store.query, [("p; DROP TABLE causal_results", "<", 1)])
+
+    def test_read_causal_files(self):
+        directory = os.path.join(self.tmpdir, "causal_results")
+        os.mkdir(directory)
+        self.results.to_csv(os.path.join(directory, "M_causal_results.csv"))
+        store = CausalStore(os.path.join(self.tmpdir, "results.sqlite"))
+        store.append(self.results)
+        where = [("-log10(p)_Regulon_stratification", ">=", 1.3)]
+        fromFiles = miner.readCausalFiles(directory, where=where)
+        fromStore = miner.readCausalFiles(store.path, where=where)
+        self.assertEqual(["R-0", "R-2"], list(fromStore.Regulon))
+        pd.testing.assert_frame_equal(fromFiles, fromStore, check_dtype=False)
+
+    def test_parallel_event_analysis(self):
+        rng = np.random.RandomState(3)
+        genes = ["G%d" % i for i in range(60)]
+        regulons = {"G%d" % t: {str(c): list(rng.choice(genes, 8, replace=False)) for c in range(2)}
+                    for t in range(10)}
+        modules, regulonDf = miner.regulonDictionary(regulons)
+        samples = ["S%d" % i for i in range(40)]
+        reference = pd.DataFrame(rng.normal(size=(len(modules), 40)), index=list(modules), columns=samples)
+        expression = pd.DataFrame(rng.normal(size=(60, 40)), index=genes, columns=samples)
+        events = {"causal_results_%s" % name: pd.DataFrame((rng.uniform(size=(n, 40)) > 0.6).astype(int),
+                                                           index=["%s%d" % (name, i) for i in range(n)],
+                                                           columns=samples)
+                  for name, n in [("mutations", 6), ("translocations", 3)]}
+        serial = os.path.join(self.tmpdir, "serial.sqlite")
+        correlations = miner.regulonTfCorrelation(regulonDf, expression, reference)
+        for folder, events_ in events.items():
+            miner.causalNetworkAnalysis(regulonDf, expression, reference, events_, self.tmpdir,
+                                        significance_threshold=0.3, causalFolder=folder, store=serial,
+                                        correlation_df_bcindex=correlations)
+        # the correlation table is written by one run and read back by later ones
+        filename = os.path.join(self.tmpdir, "regulonTfCorrelation.csv")
+        correlations.to_csv(filename)
+        pd.testing.assert_frame_equal(correlations, miner.readRegulonTfCorrelation(filename))
+        merged = os.path.join(self.tmpdir, "merged.sqlite")
+        miner.parallelCausalEventAnalysis(regulonDf, expression, reference, events, self.tmpdir, 2,
+                                          significance_threshold=0.3, store=merged,
+                                          correlation_df_bcindex=miner.readRegulonTfCorrelation(filename))
+        expected = CausalStore(serial).query().sort_values(["Mutation", "Regulator", "Regulon"])
+        results = CausalStore(merged).query().sort_values(["Mutation", "Regulator", "Regulon"])
+        self.assertTrue(len(expected) > 0)
+        pd.testing.assert_frame_equal(expected, results)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CausalStoreTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from miner import database, miner
+
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldCache = os.environ.get("MINER_DATABASE_CACHE")
+        os.environ["MINER_DATABASE_CACHE"] = os.path.join(self.tmpdir, "cache")
+        self.dict_ = {"TF1": ["g1", "g2", "g3"], "TF2": ["g3", "g3", "g4"], "TF3": []}
+        self.path = os.path.join(self.tmpdir, "test_db.pkl")
+        with open(self.path, "wb") as f:
+            pickle.dump(self.dict_, f)
+
+    def tearDown(self):
+        # databases loaded from the temporary directory, also when an assertion failed
+        for path in [path for path in database._DATABASES if path.startswith(os.path.abspath(self.tmpdir))]:
+            database._DATABASES.pop(path)
+        if self.oldCache is None:
+            del os.environ["MINER_DATABASE_CACHE"]
+        else:
+            os.environ["MINER_DATABASE_CACHE"] = self.oldCache
+        shutil.rmtree(self.tmpdir)
+
+    def test_mapping_view(self):
+        db = database.loadDatabase(self.path)
+        self.assertEqual(list(self.dict_.keys()), list(db.keys()))
+        for key in self.dict_:
+            self.assertEqual(self.dict_[key], db[key])
+        self.assertEqual(frozenset(["g3", "g4"]), db.set("TF2"))
+        self.assertIn("TF3", db)
+        self.assertNotIn("g1", db)
+        self.assertIs(db, database.loadDatabase(self.path))
+
+    def test_matrix_view(self):
+        db = database.loadDatabase(self.path)
+        matrix = db.matrix()
+        self.assertEqual((3, 4), matrix.shape)
+        self.assertEqual(2, matrix[db.keyIndex["TF2"], db.valueIndex["g3"]])
+        self.assertEqual([3, 3, 0], list(db.sizes()))
+        self.assertEqual(0, matrix[2].nnz)
+
+    def test_pickles_by_reference(self):
+        db = database.loadDatabase(self.path)
+        self.assertIs(db, pickle.loads(pickle.dumps(db)))
+
+    def test_enrichment_analysis(self):
+        reference = {"T1": ["g1", "g2", "g3", "g4"], "T2": ["g4", "g5"], "T3": ["g6", "g7", "g8"]}
+        reciprocal = {}
+        for term, genes in reference.items():
+            for gene in genes:
+                reciprocal.setdefault(gene, []).append(term)
+        paths = []
+        for name, dict_ in (("ref", reference), ("rec", reciprocal)):
+            paths.append(os.path.join(self.tmpdir, name + ".pkl"))
+            with open(paths[-1], "wb") as f:
+                pickle.dump(dict_, f)
+        modules = {"m1": ["g1", "g2", "g3", "g9"], "m2": ["g1", "g6"], "m3": ["g6", "g7", "g8", "g4"]}
+        expressed = ["g%d" % i for i in range(1, 10)]
+        results = miner.enrichmentAnalysis(modules, paths[0], paths[1], expressed,
+                                           min_overlap=3, threshold=0.5)
+        self.assertEqual(["m1", "m3"], sorted(results.keys()))
+        self.assertEqual(["T1"], list(results["m1"].keys()))
+        self.assertAlmostEqual(miner.hyper(8, 4, 4, 3), results["m1"]["T1"])
+        self.assertAlmostEqual(miner.hyper(8, 3, 4, 3), results["m3"]["T3"])
+
+    def test_package_data_names(self):
+        path = database.databasePath("hallmarks")
+        self.assertTrue(path.endswith(os.path.join("network_dictionaries", "hallmarks.pkl")))
+        self.assertRaises(FileNotFoundError, database.databasePath, "no_such_database")
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(DatabaseTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
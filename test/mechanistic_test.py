@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+from miner import miner
+
+
+class MechanisticTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.exp = pd.DataFrame(rng.normal(size=(60, 30)),
+                                index=["g%d" % i for i in range(60)])
+        self.axes = pd.DataFrame(rng.normal(size=(30, 4)),
+                                 columns=["0", "1", "2", "3"])
+
+    def test_tf_axis_correlation_matches_pearson(self):
+        tfs = ["g1", "g5", "g7"]
+        corr = miner.tfAxisCorrelation(self.axes, tfs, self.exp)
+        for tf in tfs:
+            for axis in self.axes.columns:
+                expected = np.corrcoef(self.exp.loc[tf, :], self.axes[axis])[0, 1]
+                self.assertAlmostEqual(expected, corr.loc[tf, axis])
+
+    def test_axis_tfs_threshold_sweep(self):
+        tfs = ["g%d" % i for i in range(0, 60, 2)] + ["not_expressed"]
+        sweep = miner.axisTfs(self.axes, tfs, self.exp, correlationThreshold=[0, 0.2, 0.4])
+        self.assertEqual(len(tfs), len(sweep[0]["1"]))
+        for threshold in [0.2, 0.4]:
+            single = miner.axisTfs(self.axes, tfs, self.exp, correlationThreshold=threshold)
+            for axis in self.axes.columns:
+                self.assertEqual(list(single[axis]), list(sweep[threshold][axis]))
+        self.assertNotIn("not_expressed", sweep[0.2]["0"])
+        self.assertTrue(set(sweep[0.4]["2"]) <= set(sweep[0.2]["2"]))
+
+    def test_mann_whitney_auc_matches_roc_auc(self):
+        from sklearn.metrics import roc_auc_score
+        rng = np.random.RandomState(11)
+        scores = np.round(rng.normal(size=(5, 40)), 1)
+        labels = (rng.uniform(size=(3, 40)) > 0.6).astype(int)
+        labels[2, :] = 0
+        auc = miner.mannWhitneyAuc(scores, labels)
+        for i in range(scores.shape[0]):
+            for j in range(2):
+                self.assertAlmostEqual(roc_auc_score(labels[j], scores[i]), auc[i, j])
+        self.assertTrue(np.isnan(auc[:, 2]).all())
+
+    def test_coincidence_matrix(self):
+        modules = {"TF1": {"0": ["a", "b", "c"], "1": ["a", "b"], "2": ["a", "d"]}}
+        normDf = miner.coincidenceMatrix(modules, 0, freqThreshold=0.5)
+        self.assertEqual(1, normDf.loc["a", "b"])
+        self.assertEqual(0, normDf.loc["a", "c"])
+        self.assertEqual(1, normDf.loc["c", "a"])
+        self.assertEqual(1, normDf.loc["d", "d"])
+
+    def test_get_regulons_parallel_matches_serial(self):
+        rng = np.random.RandomState(7)
+        genes = ["G%d" % i for i in range(80)]
+        modules = {}
+        for t in range(12):
+            core = list(rng.choice(genes, 30, replace=False))
+            modules["TF%d" % t] = {str(c): list(rng.choice(core, 15, replace=False)) for c in range(8)}
+        serial = miner.getRegulons(modules, minNumberGenes=3, numCores=1)
+        parallel = miner.getRegulons(modules, minNumberGenes=3, numCores=3)
+        self.assertEqual(sorted(serial.keys()), list(serial.keys()))
+        self.assertEqual(serial, parallel)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(MechanisticTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+from miner import miner, neo
+
+# stands in for miner3-neo: one result file per mutation and regulator,
+# the first run of the shard that contains M3 fails
+FAKE_NEO = """
+import os, sys
+import pandas as pd
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+regulators = pd.read_csv(os.path.join(args["--indir"], "regStratAll.csv"), index_col=0)
+marker = os.path.join(args["--indir"], "..", "failed")
+if "M3" in regulators.columns and not os.path.exists(marker):
+    open(marker, "w").close()
+    print("failed")
+    sys.exit(1)
+for mutation in regulators.columns:
+    os.makedirs(os.path.join(args["--outdir"], "causal_" + mutation))
+    for regulator in regulators.index[regulators[mutation] == 1]:
+        pd.DataFrame({"id": [1], "mutation": ["m:" + mutation], "regulator": ["r:" + regulator], "x": [0],
+                      "bicluster": ["bic_7"], "score": [2.0], "y": [0]}).to_csv(
+            os.path.join(args["--outdir"], "causal_" + mutation,
+                         "sm.nonsilent_somatic.%s_%s.csv" % (mutation, regulator)), index=False)
+print("finished")
+"""
+
+
+class NeoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.indir = os.path.join(self.tmpdir, "pre")
+        os.mkdir(self.indir)
+        pd.DataFrame([[1, 0, 1, 1, 0], [1, 1, 0, 1, 0]], index=["TF1", "TF2"],
+                     columns=["M%d" % i for i in range(5)]).to_csv(os.path.join(self.indir, "regStratAll.csv"))
+        for name in neo.SHARED_INPUTS:
+            open(os.path.join(self.indir, name), "w").close()
+        self.script = os.path.join(self.tmpdir, "neo.py")
+        with open(self.script, "w") as outfile:
+            outfile.write(FAKE_NEO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_shards_are_balanced(self):
+        shards = neo.shardNeoInput(self.indir, os.path.join(self.tmpdir, "work"), 2)
+        self.assertEqual(2, len(shards))
+        mutations = [list(pd.read_csv(os.path.join(shard, "input", "regStratAll.csv"), index_col=0).columns)
+                     for shard in shards]
+        self.assertEqual(["M0", "M1", "M4"], sorted(mutations[0]))
+        self.assertEqual(["M2", "M3"], sorted(mutations[1]))
+
+    def test_run_neo_retries_and_merges(self):
+        outdir = os.path.join(self.tmpdir, "neo")
+        neo.runNeo(self.indir, outdir, cores=1, numShards=3, retries=1, command=[sys.executable, self.script])
+        self.assertEqual(["causal_M%d" % i for i in range(5)], sorted(os.listdir(outdir)))
+        self.assertEqual(["neo", "pre", "neo.py"], sorted(os.listdir(self.tmpdir), key=len))
+        causal = miner.processCausalResults(outdir)
+        self.assertEqual({"TF1": ["M0", "M2", "M3"], "TF2": ["M0", "M1", "M3"]},
+                         {tf: sorted(mutations) for tf, mutations in causal[7].items()})
+        # the log of a retried shard only holds the output of its last attempt
+        shards = neo.shardNeoInput(self.indir, os.path.join(self.tmpdir, "work"), 3)
+        shard = [shard for shard in shards
+                 if "M3" in pd.read_csv(os.path.join(shard, "input", "regStratAll.csv"), index_col=0).columns][0]
+        self.assertEqual((shard, 2, True), neo.runNeoShard((shard, [sys.executable, self.script], 1)))
+        with open(os.path.join(shard, "neo.log")) as infile:
+            self.assertEqual("finished\n", infile.read())
+
+    def test_run_neo_reports_failed_shards(self):
+        outdir = os.path.join(self.tmpdir, "neo")
+        self.assertRaises(RuntimeError, neo.runNeo, self.indir, outdir, cores=1, numShards=3, retries=0,
+                          command=[sys.executable, self.script])
+        self.assertEqual(4, len(os.listdir(outdir)))
+
+    def test_process_causal_results(self):
+        results = pd.DataFrame({"id": range(4),
+                                "mutation": ["m:M1", "m:M2", "m:M1", "m:M3"],
+                                "regulator": ["r:TF1", "r:TF1", "r:TF2", "r:TF1"],
+                                "x": 0,
+                                "bicluster": ["bc:R_4", "bc:R_4", "bc:R_2", "bc:R_4"],
+                                "score": [3.0, 2.0, 1.5, 0.5],
+                                "y": 0})
+        outdir = os.path.join(self.tmpdir, "neo")
+        os.mkdir(outdir)
+        results.to_csv(os.path.join(outdir, "neo.csv"), index=False)
+        causal = miner.processCausalResults(outdir)
+        self.assertEqual({4: {"TF1": ["M1", "M2"]}, 2: {"TF2": ["M1"]}}, causal)
+        self.assertEqual([4, 2], list(causal))
+        table = miner.processCausalResults(outdir, flat=True)
+        self.assertEqual(["Bicluster", "Regulator", "Mutation", "Score"], list(table.columns))
+        self.assertEqual([3.0, 2.0, 1.5], list(table.Score))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(NeoTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import sys
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+from miner import miner, parallel
+
+
+def sumRows(task):
+    start, stop = task[0]
+    df, offset = parallel.resolveTaskData(task[1])
+    return {key: df.loc[key, :].sum() + offset for key in df.index[start:stop]}
+
+
+class ParallelTest(unittest.TestCase):
+
+    def test_task_data_roundtrip(self):
+        df = pd.DataFrame(np.arange(12, dtype=float).reshape(4, 3),
+                          index=["a", "b", "c", "d"], columns=["x", "y", "z"])
+        mixed = pd.DataFrame({"t": [1.5, 2.5], "s": [1, 0]}, index=["p1", "p2"])
+        with parallel.TaskData((df, mixed, {"r": ["g1"]}, 3)) as shared:
+            resolved = pickle.loads(pickle.dumps(shared)).resolve()
+            pd.testing.assert_frame_equal(df, resolved[0])
+            pd.testing.assert_frame_equal(mixed, resolved[1])
+            self.assertEqual({"r": ["g1"]}, resolved[2])
+            self.assertEqual(3, resolved[3])
+            self.assertFalse(resolved[0].values.flags.writeable)
+
+    def test_resolve_plain_task_data(self):
+        data = ([1, 2], "x")
+        self.assertIs(data, parallel.resolveTaskData(data))
+
+    def test_multiprocess_shared_task_data(self):
+        df = pd.DataFrame(np.arange(20, dtype=float).reshape(10, 2))
+        taskSplit = miner.splitForMultiprocessing(df.index, 2)
+        with parallel.TaskData((df, 1)) as shared:
+            tasks = [[taskSplit[i], shared] for i in range(len(taskSplit))]
+            output = miner.condenseOutput(miner.multiprocess(sumRows, tasks))
+        self.assertEqual({i: 4 * i + 2 for i in range(10)}, output)
+
+    def test_split_tasks_covers_range(self):
+        chunks = parallel.splitTasks(10, cores=3)
+        self.assertEqual(10, len(chunks))
+        chunks = parallel.splitTasks(103, cores=3)
+        self.assertEqual(12, len(chunks))
+        self.assertEqual(0, chunks[0][0])
+        self.assertEqual(103, chunks[-1][1])
+        for i in range(1, len(chunks)):
+            self.assertEqual(chunks[i - 1][1], chunks[i][0])
+            self.assertLess(chunks[i][0], chunks[i][1])
+        self.assertEqual([], parallel.splitTasks(0, cores=3))
+
+    def test_map_tasks_backends_agree(self):
+        df = pd.DataFrame(np.arange(40, dtype=float).reshape(20, 2))
+        expected = {i: 4 * i + 2 for i in range(20)}
+        try:
+            for backend in parallel.BACKENDS:
+                parallel.configure(backend=backend)
+                taskSplit = parallel.splitTasks(len(df.index), 3)
+                with parallel.TaskData((df, 1)) as shared:
+                    tasks = [[taskSplit[i], shared] for i in range(len(taskSplit))]
+                    output = miner.condenseOutput(miner.multiprocess(sumRows, tasks, 3))
+                self.assertEqual(expected, output, backend)
+        finally:
+            parallel.configure(backend="process")
+            parallel.shutdown()
+
+    def test_single_core_runs_serially(self):
+        self.assertEqual("serial", parallel.backend(1))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ParallelTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sklearn.linear_model import Ridge
+from miner import miner
+
+
+class PredictorTest(unittest.TestCase):
+
+    def test_chi_square_test_with_tri_state_rows(self):
+        rng = np.random.RandomState(11)
+        membership = rng.randint(-1, 2, size=(4, 40))
+        membership[0] = rng.randint(0, 2, size=40)
+        for risk in [rng.randint(0, 2, size=40), rng.randint(0, 3, size=40)]:
+            expected = [stats.chi2_contingency(pd.crosstab(risk, row), correction=False)[1] for row in membership]
+            np.testing.assert_allclose(expected, miner.chiSquareTest(risk, membership), rtol=1e-10)
+
+    def test_univariate_predictor_is_reproducible(self):
+        rng = np.random.RandomState(9)
+        labels = (np.arange(30) < 12).astype(int)
+        data = rng.normal(size=(20, 30))
+        data[4, labels == 1] += 3
+        serial = miner.univariate_predictor(data, labels, None, n_iter=12, numCores=1, seed=1)
+        parallel = miner.univariate_predictor(data, labels, None, n_iter=12, numCores=3, seed=1)
+        pd.testing.assert_frame_equal(serial, parallel)
+        self.assertEqual([4] * 12, list(serial.Gene))
+
+    def test_ridge_path_scores(self):
+        rng = np.random.RandomState(10)
+        train, target, test = rng.normal(size=(30, 50)), rng.normal(size=30), rng.normal(size=(10, 50))
+        alphas = [0.01, 1, 100, 25000]
+        scores = miner.ridgePathScores(train, target, test, alphas)
+        for i, alpha in enumerate(alphas):
+            expected = Ridge(alpha=alpha, fit_intercept=True).fit(train, target).predict(test) - target.mean()
+            np.testing.assert_allclose(expected, scores[i], rtol=1e-8, atol=1e-12)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(PredictorTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
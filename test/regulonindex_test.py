@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+from miner import miner
+from miner.regulonindex import RegulonIndex
+
+
+class RegulonIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        regulons = {"TF1": {"0": ["g1", "g2", "TF2"], "1": ["g2", "g3"]},
+                    "TF2": {"0": ["g1", "g4"]}}
+        self.modules, self.regulonDf = miner.regulonDictionary(regulons)
+
+    def test_lookups(self):
+        index = RegulonIndex.fromDataFrame(self.regulonDf)
+        self.assertEqual(["0", "1", "2"], list(index.regulons))
+        self.assertEqual(["0", "2"], index.regulonsOfGene("g1"))
+        self.assertEqual(["0"], index.regulonsOfGene("TF2"))
+        self.assertEqual([], index.regulonsOfGene("TF1"))
+        self.assertEqual(["0", "1"], index.regulonsOfRegulator("TF1"))
+        self.assertEqual(["g2", "g3"], index.genesOfRegulon("1"))
+        self.assertEqual("TF2", index.regulatorOf(2))
+        self.assertEqual(2, index.incidence()[index.genes.index["g2"], :].sum())
+
+    def test_from_modules(self):
+        regulonIDtoRegulator = miner.regulonIdToRegulator(self.regulonDf)
+        self.assertEqual(["TF1", "TF1", "TF2"], list(regulonIDtoRegulator["Regulator"]))
+        index = RegulonIndex.fromModules(self.modules, regulonIDtoRegulator)
+        expected = RegulonIndex.fromDataFrame(self.regulonDf)
+        for gene in expected.genes:
+            self.assertEqual(expected.regulonsOfGene(gene), index.regulonsOfGene(gene))
+        self.assertEqual(["2"], index.regulonsOfRegulator("TF2"))
+
+    def test_network_activity(self):
+        rng = np.random.RandomState(5)
+        reference = pd.DataFrame(rng.normal(size=(3, 6)), index=["0", "1", "2"])
+        activity = miner.networkActivity(reference, self.regulonDf, minRegulons=2)
+        self.assertEqual(["g1", "g2"], list(activity.index))
+        np.testing.assert_allclose(reference.loc[["0", "2"], :].mean(axis=0), activity.loc["g1", :])
+
+    def test_regulon_tf_correlation(self):
+        from scipy import stats
+        rng = np.random.RandomState(8)
+        samples = ["s%d" % i for i in range(15)]
+        reference = pd.DataFrame(rng.normal(size=(3, 15)), index=["0", "1", "2"], columns=samples)
+        expression = pd.DataFrame(rng.normal(size=(2, 20)), index=["TF1", "g1"],
+                                  columns=samples + ["x%d" % i for i in range(5)])
+        correlation = miner.regulonTfCorrelation(self.regulonDf, expression, reference)
+        expected = stats.spearmanr(expression.loc["TF1", samples], reference.loc["1", :])
+        self.assertAlmostEqual(expected[0], correlation.loc["1", "Spearman_R"])
+        self.assertAlmostEqual(expected[1], correlation.loc["1", "Spearman_p"])
+        self.assertEqual([0, 1], list(correlation.loc["2", ["Spearman_R", "Spearman_p"]]))
+
+    def test_differential_activity_top_regulons(self):
+        from scipy import stats
+        rng = np.random.RandomState(2)
+        reference = pd.DataFrame(rng.normal(size=(3, 20)), index=["0", "1", "2"],
+                                 columns=["s%d" % i for i in range(20)])
+        reference.iloc[0, 10:] += 2
+        baseline, relapse = list(reference.columns[:10]), list(reference.columns[10:])
+        volcano = miner.differentialActivity(self.regulonDf, reference.copy(), baseline, relapse,
+                                             minRegulons=2, maxRegulons=1)
+        neglogps = [-np.log10(stats.ttest_ind(reference.loc[r, relapse], reference.loc[r, baseline])[1])
+                    for r in ["0", "2"]]
+        self.assertEqual(["g1", "g2"], sorted(volcano.index))
+        self.assertAlmostEqual(max(neglogps), volcano.loc["g1", "-log10(p)"])
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(RegulonIndexTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
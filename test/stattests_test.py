@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import sys
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sklearn.metrics import roc_auc_score
+from miner import stattests
+
+
+class StatTestsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.data = rng.normal(size=(20, 30)) * 10 + 100
+        self.data[2, :] = 1.0
+        self.groups = (rng.uniform(size=(4, 30)) > 0.5).astype(float)
+
+    def test_welch_matches_scipy(self):
+        t, p = stattests.tTest(self.data, self.groups)
+        self.assertEqual((20, 4), t.shape)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for k in range(4):
+                expected = stats.ttest_ind(self.data[:, self.groups[k] == 1], self.data[:, self.groups[k] == 0],
+                                           axis=1, equal_var=False)
+                np.testing.assert_allclose(expected[0], t[:, k], rtol=1e-8)
+                np.testing.assert_allclose(expected[1], p[:, k], rtol=1e-6)
+
+    def test_student_with_explicit_groups(self):
+        groups2 = np.zeros(30)
+        groups2[:8] = 1
+        groups2 = groups2 * (1 - self.groups[0])
+        t, p = stattests.tTest(self.data, self.groups[0], groups2, equal_var=True)
+        expected = stats.ttest_ind(self.data[:, self.groups[0] == 1], self.data[:, groups2 == 1], axis=1)
+        self.assertEqual((20,), t.shape)
+        np.testing.assert_allclose(expected[1][[0, 1, 3]], p[[0, 1, 3]], rtol=1e-6)
+
+    def test_welch_omitting_missing_values(self):
+        data = self.data.copy()
+        data[np.random.RandomState(2).uniform(size=data.shape) > 0.8] = np.nan
+        t, p = stattests.tTest(data, self.groups, nan_policy="omit")
+        for i in range(20):
+            for k in range(4):
+                values = data[i, ~np.isnan(data[i])]
+                groups = self.groups[k, ~np.isnan(data[i])]
+                expected = stats.ttest_ind(values[groups == 1], values[groups == 0], equal_var=False)
+                np.testing.assert_allclose(expected, [t[i, k], p[i, k]], rtol=1e-8)
+
+    def test_chi_square_matches_contingency(self):
+        rng = np.random.RandomState(9)
+        incidence = (rng.uniform(size=(10, 40)) > 0.6).astype(int)
+        incidence[0, :] = 0
+        labels = (rng.uniform(size=40) > 0.5).astype(int)
+        chi2, p = stattests.chiSquare2x2(incidence, labels)
+        for i in range(10):
+            expected = stats.chi2_contingency(pd.crosstab(labels, incidence[i]), correction=False)
+            self.assertAlmostEqual(expected[0], chi2[i])
+            self.assertAlmostEqual(expected[1], p[i])
+
+    def test_paired_spearman(self):
+        rng = np.random.RandomState(1)
+        a = np.round(rng.normal(size=(6, 25)), 1)
+        b = rng.normal(size=(6, 25))
+        b[0] = -a[0]
+        r, p = stattests.pairedSpearman(a, b)
+        for i in range(6):
+            expected = stats.spearmanr(a[i], b[i])
+            self.assertAlmostEqual(expected[0], r[i])
+            self.assertAlmostEqual(expected[1], p[i])
+
+    def test_paired_pearson(self):
+        rng = np.random.RandomState(6)
+        a = rng.normal(size=(5, 12))
+        b = rng.normal(size=(5, 12))
+        a[0, :3] = np.nan
+        b[1, 5] = np.nan
+        b[2, 2:] = np.nan
+        r, p = stattests.pairedPearson(a, b)
+        for i in range(5):
+            present = ~(np.isnan(a[i]) | np.isnan(b[i]))
+            expected = stats.pearsonr(a[i, present], b[i, present])
+            self.assertAlmostEqual(expected[0], r[i])
+            self.assertAlmostEqual(expected[1], p[i])
+
+    def test_roc_auc(self):
+        rng = np.random.RandomState(8)
+        data = np.vstack([rng.normal(size=(3, 20)), rng.randint(0, 3, size=(3, 20))])
+        labels = (rng.uniform(size=20) > 0.5).astype(int)
+        expected = [roc_auc_score(labels, row) for row in data]
+        np.testing.assert_allclose(expected, stattests.mannWhitneyAuc(data, labels)[:, 0], rtol=1e-12)
+        self.assertTrue(np.isnan(stattests.mannWhitneyAuc(data, np.ones(20))).all())
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(StatTestsTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
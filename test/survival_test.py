@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter, KaplanMeierFitter
+from lifelines.statistics import logrank_test
+from miner import miner, survival
+
+
+def pairwiseGuanScore(durations, status, km, a):
+    # direct definition of the GuanRank score of patient a
+    score = 0
+    for b in range(len(durations)):
+        if b == a:
+            continue
+        if status[a] == 1:
+            score += durations[b] > durations[a]
+            if durations[b] <= durations[a] and status[b] == 0:
+                score += km[a] / km[b]
+            if durations[b] == durations[a] and status[b] == 1:
+                score += 0.5
+        elif durations[b] >= durations[a]:
+            score += 1 - (0.5 if status[b] == 0 else 1) * km[b] / km[a]
+        elif status[b] == 0:
+            score += 0.5 * km[a] / km[b]
+    return score
+
+
+class SurvivalTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.survival = pd.DataFrame({"duration": rng.randint(1, 30, 80).astype(float),
+                                      "observed": (rng.uniform(size=80) > 0.4).astype(int)},
+                                     index=["P%d" % i for i in range(80)])
+        self.km = miner.kmAnalysis(self.survival, "duration", "observed")
+
+    def test_km_curves(self):
+        groups = [list(self.survival.index[:30]), list(self.survival.index[20:]) + ["missing"]]
+        curves = miner.kmCurves(self.survival, groups)
+        self.assertEqual(sorted(set(self.survival.duration)), list(curves.columns))
+        for i, group in enumerate(groups):
+            patients = [patient for patient in group if patient in self.survival.index]
+            kmf = KaplanMeierFitter().fit(self.survival.loc[patients, "duration"],
+                                          self.survival.loc[patients, "observed"])
+            expected = kmf.survival_function_.iloc[1:, 0]
+            np.testing.assert_array_equal(expected.values, curves.loc[i, expected.index].values)
+
+    def test_km_analysis(self):
+        kmf = KaplanMeierFitter().fit(self.survival.duration, self.survival.observed)
+        survival = kmf.survival_function_.iloc[:, 0]
+        self.assertTrue((np.diff(self.km.duration) >= 0).all())
+        np.testing.assert_array_equal(survival[self.km.duration].values, self.km.kmEstimate.values)
+
+    def test_cox_regression(self):
+        rng = np.random.RandomState(3)
+        values = np.vstack([rng.normal(size=(4, 80)), (rng.uniform(size=(3, 80)) > 0.7).astype(float),
+                            np.zeros((1, 80)), rng.normal(size=(1, 80))])
+        values[-1, 5] = np.nan
+        z, p = survival.coxRegression(values, self.survival.duration, self.survival.observed, blockSize=3)
+        for i in range(7):
+            data = self.survival.assign(value=values[i])
+            summary = CoxPHFitter().fit(data, "duration", "observed").summary
+            self.assertAlmostEqual(summary.loc["value", "z"], z[i], places=6)
+            self.assertAlmostEqual(summary.loc["value", "p"], p[i], places=6)
+        self.assertEqual([0, 0], list(z[7:]))
+        self.assertEqual([1, 1], list(p[7:]))
+
+    def test_log_rank_test(self):
+        rng = np.random.RandomState(5)
+        membership = (rng.uniform(size=(5, 80)) > 0.6).astype(int)
+        membership[4] = 1
+        z, p = survival.logRankTest(membership, self.survival.duration, self.survival.observed, blockSize=2)
+        durations, observed = self.survival.duration.values, self.survival.observed.values
+        for i in range(4):
+            members = membership[i] == 1
+            expected = logrank_test(durations[members], durations[~members], observed[members], observed[~members])
+            self.assertAlmostEqual(expected.test_statistic, z[i] ** 2)
+            self.assertAlmostEqual(expected.p_value, p[i])
+        self.assertEqual((0, 1), (z[4], p[4]))
+
+        membershipDf = pd.DataFrame(membership, columns=self.survival.index)
+        results = miner.parallelMemberSurvivalAnalysis(membershipDf, 2, survivalData=self.survival, method="logrank")
+        np.testing.assert_allclose(z, [results[i][0] for i in range(5)], rtol=1e-12)
+        self.assertRaises(ValueError, miner.parallelMemberSurvivalAnalysis, membershipDf,
+                          survivalData=self.survival, method="wald")
+
+    def test_guan_rank(self):
+        guan = miner.guanRank(self.km)
+        durations, status, km = [np.array(self.km.iloc[:, i]) for i in range(3)]
+        expected = np.array([pairwiseGuanScore(durations, status, km, a) for a in range(len(durations))])
+        expected = pd.Series(expected / expected.max(), index=self.km.index)
+        np.testing.assert_allclose(expected[guan.index], guan.GuanScore, rtol=1e-12)
+        self.assertTrue((np.diff(guan.GuanScore) <= 0).all())
+
+    def test_guan_rank_cache(self):
+        cacheFolder = tempfile.mkdtemp()
+        try:
+            guan = miner.guanRank(self.km, cacheFolder=cacheFolder)
+            self.assertEqual(1, len(os.listdir(cacheFolder)))
+            miner._GUANRANKS.clear()
+            cached = miner.guanRank(self.km, cacheFolder=cacheFolder)
+            pd.testing.assert_frame_equal(guan, cached)
+            cached.iloc[0, 0] = -1
+            pd.testing.assert_frame_equal(guan, miner.guanRank(self.km))
+        finally:
+            shutil.rmtree(cacheFolder)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(SurvivalTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
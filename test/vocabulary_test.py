@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from miner import database, miner
+from miner.vocabulary import Vocabulary, expressionVocabularies
+
+
+class VocabularyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldCache = os.environ.get("MINER_DATABASE_CACHE")
+        os.environ["MINER_DATABASE_CACHE"] = os.path.join(self.tmpdir, "cache")
+        rng = np.random.RandomState(5)
+        self.exp = pd.DataFrame(rng.normal(size=(60, 30)), index=["g%d" % i for i in range(60)],
+                                columns=["s%d" % i for i in range(30)])
+        self.exp.iloc[:12, :10] += 3
+        self.exp.iloc[20:32, 15:] -= 3
+
+    def tearDown(self):
+        for path in [path for path in database._DATABASES if path.startswith(os.path.abspath(self.tmpdir))]:
+            database._DATABASES.pop(path)
+        if self.oldCache is None:
+            del os.environ["MINER_DATABASE_CACHE"]
+        else:
+            os.environ["MINER_DATABASE_CACHE"] = self.oldCache
+        shutil.rmtree(self.tmpdir)
+
+    def test_encode_decode(self):
+        genes = Vocabulary(["g1", "g2", "g3"])
+        codes = genes.encode(["g3", "g1"])
+        self.assertEqual(np.int32, codes.dtype)
+        self.assertEqual([2, 0], list(codes))
+        self.assertEqual(["g3", "g1"], genes.decode(codes))
+        self.assertEqual([True, False, True], list(genes.mask(codes)))
+
+    def test_missing_names(self):
+        genes = Vocabulary(["g1", "g2"])
+        self.assertRaises(KeyError, genes.encode, ["g1", "g9"])
+        self.assertEqual([0], list(genes.encode(["g1", "g9"], missing="drop")))
+        self.assertEqual([0, 2], list(genes.encode(["g1", "g9"], missing="add")))
+        self.assertEqual(3, len(genes))
+        self.assertIn("g9", genes)
+
+    def test_encode_sets_roundtrip(self):
+        samples = Vocabulary(["s0", "s1", "s2"])
+        members = {"0": ["s2", "s0"], "1": []}
+        codes = samples.encodeSets(members)
+        self.assertEqual([2, 0], list(codes["0"]))
+        self.assertEqual(members, samples.decodeSets(codes))
+
+    def test_membership_to_incidence(self):
+        exp = pd.DataFrame(np.zeros((2, 4)), columns=["s0", "s1", "s2", "s3"])
+        incidence = miner.membershipToIncidence({"10": ["s1", "s3"], "2": [], "1": ["s0"]}, exp)
+        self.assertEqual(["1", "2", "10"], list(incidence.index))
+        self.assertEqual([0, 1, 0, 1], list(incidence.loc["10", :]))
+        self.assertEqual(0, incidence.loc["2", :].sum())
+
+    def test_positions(self):
+        genes = Vocabulary(["g1", "g2", "g3"])
+        self.assertEqual([1, -1, 0], list(genes.positions(["g3", "g1", "g9"])))
+
+    def test_mechanistic_inference_with_codes(self):
+        clusters = {"0": ["g%d" % i for i in range(14)] + ["unexpressed"],
+                    "1": ["g%d" % i for i in range(18, 34)]}
+        tfToGenes = {"g50": ["g%d" % i for i in range(10)] + ["g40", "other"],
+                     "g51": ["g%d" % i for i in range(20, 31)],
+                     "g52": ["g1", "g45", "g46"]}
+        path = os.path.join(self.tmpdir, "tfbsdb.pkl")
+        with open(path, "wb") as f:
+            pickle.dump(tfToGenes, f)
+        axes = miner.principalDf(clusters, self.exp, subkey=None, minNumberGenes=1)
+        expected = miner.mechanisticInference(axes, clusters, self.exp, correlationThreshold=[0, 0.05],
+                                              numCores=1, database_path=path)
+
+        genes, samples = expressionVocabularies(self.exp)
+        clusterCodes = genes.encodeSets(clusters, missing="add")
+        pd.testing.assert_frame_equal(axes, miner.principalDf(clusterCodes, self.exp, subkey=None,
+                                                              minNumberGenes=1, genes=genes))
+        outputs = miner.mechanisticInference(axes, clusterCodes, self.exp, correlationThreshold=[0, 0.05],
+                                             numCores=2, database_path=path, genes=genes)
+        self.assertIn("g50", expected[0]["0"])
+        for threshold in [0, 0.05]:
+            for key in outputs[threshold]:
+                for tf in outputs[threshold][key]:
+                    self.assertEqual(np.int32, outputs[threshold][key][tf][1].dtype)
+            self.assertEqual(expected[threshold], miner.decodeMechanisticOutput(outputs[threshold], genes))
+
+    def test_regulons_and_memberships_with_codes(self):
+        regulons = {"TF1": {0: ["g%d" % i for i in range(12)], 1: ["g20", "g25", "g30", "unexpressed"]},
+                    "TF2": {0: ["g%d" % i for i in range(20, 32)]}}
+        modules, regulonDf = miner.regulonDictionary(regulons)
+        genes, samples = expressionVocabularies(self.exp)
+        codes = {tf: genes.encodeSets(regulons[tf], missing="add") for tf in regulons}
+        moduleCodes, codeDf = miner.regulonDictionary(codes, genes=genes)
+        self.assertEqual(modules, genes.decodeSets(moduleCodes))
+        pd.testing.assert_frame_equal(regulonDf, codeDf)
+        pd.testing.assert_frame_equal(miner.getEigengenes(modules, self.exp),
+                                      miner.getEigengenes(moduleCodes, self.exp, genes=genes))
+
+        background = miner.backgroundDf(self.exp)
+        for label in [2, 0, "excluded", "included"]:
+            members = miner.biclusterMembershipDictionary(modules, background, label=label)
+            memberCodes = miner.biclusterMembershipDictionary(moduleCodes, background, label=label,
+                                                              genes=genes, samples=samples)
+            self.assertEqual(members, samples.decodeSets(memberCodes))
+            pd.testing.assert_frame_equal(miner.membershipToIncidence(members, self.exp),
+                                          miner.membershipToIncidence(memberCodes, self.exp, samples=samples))
+        self.assertTrue(len(members["0"]) > 0)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(VocabularyTest))
+    if len(sys.argv) > 1 and sys.argv[1] == 'xml':
+      xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
+    else:
+      unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))